@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import threading
+import requests
+from typing import Dict, List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from console import printError
+from exceptions import UsageError
+from formatters import determineServerFormatter
+from main import removeDupes, removeWhitelisted, writeLinesToFile
+from sources import MVPS, BaseSource, PolishFiltersTeamKADHosts, downloadSource, parseResponse
+
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_THRESHOLD = 0.10
+STAGES = ["download", "parse", "dedup", "whitelist", "format", "write"]
+TOP_LEVEL_DOMAINS = ["com", "net", "org", "io", "info", "co.uk", "de", "ru", "xyz", "top"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class BenchmarkSource(BaseSource):
+	"""a source served by the fixture server, parsed like one of the real sources"""
+
+	def __init__(self, name: str, url: str, realSource) -> None:
+		self._name = name
+		self._url = url
+		self._realSource = realSource
+		self._dialect = realSource.dialect
+
+	def format(self, lines):
+		return self._realSource.format(lines)
+
+
+# kind of list -> the real source that publishes that kind
+dialectSources = {
+	"hosts": PolishFiltersTeamKADHosts(),
+	"plain": BaseSource(),
+	"mvps": MVPS(),
+}
+
+
+def generateDomains(count: int, generator: random.Random) -> List[str]:
+	"""random domains, where about a fifth are subdomains of earlier ones so that lists look realistic"""
+	domains: List[str] = []
+	for _ in range(count):
+		if len(domains) > 0 and generator.random() < 0.2:
+			parent = domains[generator.randrange(len(domains))]
+			label = "".join(generator.choices(LETTERS, k=generator.randint(2, 10)))
+			domains.append("{}.{}".format(label, parent))
+		else:
+			label = "".join(generator.choices(LETTERS, k=generator.randint(4, 16)))
+			domains.append("{}.{}".format(label, generator.choice(TOP_LEVEL_DOMAINS)))
+	return domains
+
+
+def renderList(dialect: str, domains: List[str], generator: random.Random) -> bytes:
+	"""writes domains the way each kind of source publishes them, including comments and noise"""
+	lines = ["# synthetic {} list".format(dialect), "# {} entries".format(len(domains)), ""]
+	if dialect == "mvps":
+		lines.extend(["127.0.0.1 localhost", "::1 localhost"])
+	for domain in domains:
+		if generator.random() < 0.05:
+			domain = domain.upper() + "."
+		if dialect == "hosts":
+			lines.append("0.0.0.0 {}".format(domain))
+		elif dialect == "mvps":
+			lines.append("0.0.0.0 {} #[tracker]".format(domain) if generator.random() < 0.1 else "0.0.0.0 {}".format(domain))
+		else:
+			lines.append(domain)
+		if generator.random() < 0.01:
+			lines.append("# comment")
+	return "\n".join(lines).encode("utf-8")
+
+
+def createFixtures(size: int, seed: int = 0) -> Dict[str, bytes]:
+	"""spreads size domains over one list per dialect, with some domains appearing in more than one list"""
+	generator = random.Random(seed)
+	domains = generateDomains(size, generator)
+	share = size // len(dialectSources)
+	overlap = share // 4
+	fixtures = {}
+	for index, dialect in enumerate(dialectSources):
+		start = max(index * share - overlap, 0)
+		end = size if index == len(dialectSources) - 1 else (index + 1) * share
+		fixtures["/{}.txt".format(dialect)] = renderList(dialect, domains[start:end], generator)
+	return fixtures
+
+
+class FixtureServer:
+	"""serves fixtures from memory on a local port, standing in for the real sources"""
+
+	def __init__(self, fixtures: Dict[str, bytes]) -> None:
+		self._fixtures = fixtures
+		self._server = ThreadingHTTPServer(("127.0.0.1", 0), self.createHandler())
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+	def createHandler(self):
+		fixtures = self._fixtures
+
+		class FixtureHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = fixtures.get(self.path)
+				if body is None:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; charset=utf-8")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		return FixtureHandler
+
+	def urlFor(self, path: str) -> str:
+		return "http://127.0.0.1:{}{}".format(self._server.server_port, path)
+
+	def __enter__(self):
+		self._thread.start()
+		return self
+
+	def __exit__(self, *args):
+		self._server.shutdown()
+		self._server.server_close()
+
+
+def createWhitelist(lines: List[str], generator: random.Random) -> List[str]:
+	"""whitelists roughly one domain in a thousand, plus a few whole subtrees"""
+	count = max(len(lines) // 1000, 1)
+	whitelist = generator.sample(lines, min(count, len(lines)))
+	whitelist.extend("*.{}".format(domain) for domain in generator.sample(lines, min(10, len(lines))))
+	return whitelist
+
+
+def timeStage(timings: Dict[str, float], stage: str, func, *args):
+	start = time.perf_counter()
+	result = func(*args)
+	timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+	return result
+
+
+def runStages(sources, formatter, outputDirectory: str, seed: int) -> Dict[str, float]:
+	"""runs each stage of process() once, returning how long each one took in seconds"""
+	timings: Dict[str, float] = {}
+	lines: List[str] = []
+	with requests.Session() as session:
+		for source in sources:
+			response = timeStage(timings, "download", downloadSource, session, source)
+			lines.extend(timeStage(timings, "parse", parseResponse, source, response))
+	uniqueLines = timeStage(timings, "dedup", removeDupes, lines)
+	whitelist = createWhitelist(uniqueLines, random.Random(seed))
+	(uniqueLines, _, _) = timeStage(timings, "whitelist", removeWhitelisted, uniqueLines, whitelist)
+	formatted = timeStage(timings, "format", formatter.format, uniqueLines)
+	timeStage(timings, "write", writeLinesToFile, formatted, os.path.join(outputDirectory, "output.txt"))
+	timings["lines"] = len(lines)
+	return timings
+
+
+def runBenchmark(sizes: List[int], repeat: int, serverType: str, seed: int = 0) -> dict:
+	"""for every size, keeps the fastest time of each stage across the repeats"""
+	results = []
+	for size in sizes:
+		printError("benchmarking {} domains".format(size))
+		with FixtureServer(createFixtures(size, seed)) as server, tempfile.TemporaryDirectory() as outputDirectory:
+			sources = [BenchmarkSource(name, server.urlFor("/{}.txt".format(name)), realSource) for (name, realSource) in dialectSources.items()]
+			best: Dict[str, float] = {}
+			for _ in range(repeat):
+				timings = runStages(sources, determineServerFormatter(serverType), outputDirectory, seed)
+				for stage in STAGES:
+					best[stage] = min(best.get(stage, timings[stage]), timings[stage])
+		results.append({"size": size, "lines": timings["lines"], "stages": best})
+	return {
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"serverType": serverType,
+		"repeat": repeat,
+		"results": results,
+	}
+
+
+def compareResults(baseline: dict, current: dict, threshold: float) -> List[str]:
+	"""returns a message for every stage that got more than threshold (e.g. 0.10 for 10%) slower"""
+	regressions = []
+	baselineBySize = {result["size"]: result["stages"] for result in baseline["results"]}
+	for result in current["results"]:
+		baselineStages = baselineBySize.get(result["size"])
+		if baselineStages is None:
+			continue
+		for stage in STAGES:
+			before = baselineStages.get(stage)
+			after = result["stages"].get(stage)
+			if before is None or after is None or before <= 0:
+				continue
+			change = (after - before) / before
+			if change > threshold:
+				regressions.append("{} domains, {}: {:.3f}s -> {:.3f}s (+{:.0%})".format(result["size"], stage, before, after, change))
+	return regressions
+
+
+def formatResults(report: dict) -> str:
+	header = "{:>10}  ".format("domains") + "  ".join("{:>10}".format(stage) for stage in STAGES)
+	rows = [header]
+	for result in report["results"]:
+		rows.append("{:>10}  ".format(result["size"]) + "  ".join("{:>9.3f}s".format(result["stages"][stage]) for stage in STAGES))
+	return "\n".join(rows)
+
+
+def parseSizes(value: str) -> List[int]:
+	try:
+		sizes = [int(size) for size in value.split(",")]
+	except ValueError:
+		raise UsageError("--sizes requires a comma separated list of whole numbers")
+	if any(size < 1 for size in sizes):
+		raise UsageError("--sizes must all be at least 1")
+	return sizes
+
+
+def readReport(path: str) -> dict:
+	with open(path, "r", encoding="utf-8") as file:
+		return json.load(file)
+
+
+def getUsage():
+	return """USAGE:
+benchmark.py run [--sizes=10000,100000,1000000] [--repeat=3] [--server=unbound] [--output=results.json]
+benchmark.py compare BASELINE.json CURRENT.json [--threshold=0.10]
+
+compare exits with status 1 if any stage got more than threshold slower"""
+
+
+def main(args: List[str]) -> int:
+	positional = [arg for arg in args if not arg.startswith("--")]
+	options = dict(arg[2:].partition("=")[::2] for arg in args if arg.startswith("--"))
+	if len(positional) == 1 and positional[0] == "run":
+		sizes = parseSizes(options["sizes"]) if "sizes" in options else DEFAULT_SIZES
+		report = runBenchmark(sizes, int(options.get("repeat", 3)), options.get("server", "unbound"))
+		print(formatResults(report))
+		if "output" in options:
+			with open(options["output"], "w", encoding="utf-8") as file:
+				json.dump(report, file, indent="\t")
+			printError("results written to {}".format(os.path.abspath(options["output"])))
+		return 0
+	if len(positional) == 3 and positional[0] == "compare":
+		regressions = compareResults(readReport(positional[1]), readReport(positional[2]), float(options.get("threshold", DEFAULT_THRESHOLD)))
+		for regression in regressions:
+			printError("regression: {}".format(regression))
+		if len(regressions) == 0:
+			printError("no regressions")
+		return 1 if len(regressions) > 0 else 0
+	print(getUsage())
+	raise UsageError("unknown benchmark command")
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
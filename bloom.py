@@ -0,0 +1,107 @@
+import os
+import math
+import mmap
+import struct
+import hashlib
+from typing import Iterable, Tuple
+from domains import getParentDomains
+from snapshot import normalizeQuery
+from exceptions import BloomFilterFormatError
+
+
+# magic, number of domains, number of bits, number of hashes, the false positive rate it was built for
+BLOOM_HEADER = struct.Struct("<8sQQId")
+BLOOM_MAGIC = b"PYBLOOM1"
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+def getSize(count: int, falsePositiveRate: float) -> Tuple[int, int]:
+	"""the number of bits and of hashes that give the false positive rate for count domains"""
+	bitCount = max(math.ceil(-count * math.log(falsePositiveRate) / math.log(2) ** 2), 8)
+	hashCount = max(round(bitCount / max(count, 1) * math.log(2)), 1)
+	return (bitCount, hashCount)
+
+
+def getBitIndexes(domain: str, bitCount: int, hashCount: int) -> Iterable[int]:
+	"""
+	two 64-bit halves of one BLAKE2b digest stand in for every hash, as h1 + i * h2 (Kirsch and Mitzenmacher)
+	any other reader of the file has to hash the same way, which only needs a BLAKE2b implementation
+	"""
+	digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=16).digest()
+	(first, second) = struct.unpack("<QQ", digest)
+	return ((first + index * second) % bitCount for index in range(hashCount))
+
+
+def writeBloomFilter(domains: Iterable[str], path: str, falsePositiveRate: float = DEFAULT_FALSE_POSITIVE_RATE) -> Tuple[int, int]:
+	"""
+	writes a Bloom filter of the domains, sized for falsePositiveRate, after a header giving its size
+	bit i is bit i % 8 of byte i // 8
+	returns the number of domains and the size of the file in bytes
+	"""
+	domains = set(normalizeQuery(domain) for domain in domains)
+	(bitCount, hashCount) = getSize(len(domains), falsePositiveRate)
+	bits = bytearray((bitCount + 7) // 8)
+	for domain in domains:
+		for index in getBitIndexes(domain, bitCount, hashCount):
+			bits[index >> 3] |= 1 << (index & 7)
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "wb") as file:
+		file.write(BLOOM_HEADER.pack(BLOOM_MAGIC, len(domains), bitCount, hashCount, falsePositiveRate))
+		file.write(bits)
+	os.replace(temporaryPath, path)
+	return (len(domains), BLOOM_HEADER.size + len(bits))
+
+
+class BloomFilterReader:
+	"""
+	answers whether a domain is probably in a filter written by writeBloomFilter, touching only a few bytes per lookup
+	false means certainly not listed, true means listed or, at about the false positive rate, a false alarm
+	the file is memory mapped, so many processes can share one copy of it through the page cache
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		with open(path, "rb") as file:
+			self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._map) < BLOOM_HEADER.size:
+			self._map.close()
+			raise BloomFilterFormatError(path)
+		(magic, self._count, self._bitCount, self._hashCount, self._falsePositiveRate) = BLOOM_HEADER.unpack_from(self._map, 0)
+		if magic != BLOOM_MAGIC or self._bitCount == 0 or BLOOM_HEADER.size + (self._bitCount + 7) // 8 > len(self._map):
+			self._map.close()
+			raise BloomFilterFormatError(path)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	@property
+	def falsePositiveRate(self) -> float:
+		return self._falsePositiveRate
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._map.close()
+
+	def containsKey(self, domain: str) -> bool:
+		for index in getBitIndexes(domain, self._bitCount, self._hashCount):
+			if not self._map[BLOOM_HEADER.size + (index >> 3)] & (1 << (index & 7)):
+				return False
+		return True
+
+	def mightContain(self, domain: str) -> bool:
+		"""true if exactly this domain is probably in the filter"""
+		return self.containsKey(normalizeQuery(domain))
+
+	def mightBeBlocked(self, domain: str) -> bool:
+		"""true if the domain or any of its parents is probably in the filter, with a false alarm more likely for each parent"""
+		domain = normalizeQuery(domain)
+		return self.containsKey(domain) or any(self.containsKey(parent) for parent in getParentDomains(domain))
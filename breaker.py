@@ -0,0 +1,57 @@
+import json
+import time
+from typing import Dict, Optional
+from report import writeAtomically
+from exceptions import CircuitOpenError
+
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 6 * 3600
+
+
+class CircuitBreaker:
+	"""
+	skips a source for a cooldown once it has failed threshold runs in a row, rather than waiting on it every run
+	after the cooldown the source is tried once more, and one more failure skips it again
+	the failures are kept between runs in a JSON file
+	"""
+
+	def __init__(self, path: str, threshold: int = DEFAULT_FAILURE_THRESHOLD, cooldown: float = DEFAULT_COOLDOWN) -> None:
+		self._path = path
+		self._threshold = threshold
+		self._cooldown = cooldown
+		self._states: Dict[str, dict] = {}
+		try:
+			with open(path, "r", encoding="utf-8") as file:
+				self._states = json.load(file)
+		except (OSError, ValueError):
+			pass
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def getOpenUntil(self, source) -> Optional[float]:
+		"""when the source will be tried again, or None if it isn't being skipped"""
+		state = self._states.get(source.url)
+		if state is None or state.get("openUntil") is None or state["openUntil"] <= time.time():
+			return None
+		return state["openUntil"]
+
+	def check(self, source):
+		"""raises CircuitOpenError if the source should be skipped"""
+		openUntil = self.getOpenUntil(source)
+		if openUntil is not None:
+			raise CircuitOpenError(source, self._states[source.url]["failures"], openUntil)
+
+	def recordSuccess(self, source):
+		self._states.pop(source.url, None)
+
+	def recordFailure(self, source):
+		state = self._states.setdefault(source.url, {"failures": 0, "openUntil": None})
+		state["failures"] += 1
+		if state["failures"] >= self._threshold:
+			state["openUntil"] = time.time() + self._cooldown
+
+	def save(self):
+		writeAtomically(self.path, json.dumps(self._states, indent="\t"))
@@ -0,0 +1,185 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+from typing import Dict, List, Optional
+from email.utils import parsedate_to_datetime
+
+
+class CacheEntry:
+	"""the validators sent by the server for a source, and the source's already formatted lines"""
+
+	def __init__(self, etag: Optional[str], lastModified: Optional[str], lines: List[str]) -> None:
+		self._etag = etag
+		self._lastModified = lastModified
+		self._lines = lines
+
+	@property
+	def etag(self) -> Optional[str]:
+		return self._etag
+
+	@property
+	def lastModified(self) -> Optional[str]:
+		return self._lastModified
+
+	@property
+	def lines(self) -> List[str]:
+		return self._lines
+
+	def isConditional(self) -> bool:
+		return self.etag is not None or self.lastModified is not None
+
+
+class SourceCache:
+	"""keeps one JSON file per source in a directory, so unchanged sources can be fetched with a conditional GET"""
+
+	def __init__(self, directory: str) -> None:
+		self._directory = directory
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	def pathFor(self, source) -> str:
+		key = hashlib.sha1(source.url.encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, "{}.json".format(key))
+
+	def load(self, source) -> Optional[CacheEntry]:
+		"""returns None if the source has not been cached, or the cache file is unusable"""
+		try:
+			with open(self.pathFor(source), "r", encoding="utf-8") as file:
+				stored = json.load(file)
+		except (OSError, ValueError):
+			return None
+		if stored.get("url") != source.url:
+			return None
+		return CacheEntry(stored.get("etag"), stored.get("lastModified"), stored.get("lines", []))
+
+	def save(self, source, entry: CacheEntry):
+		"""writes to a temporary file first so that a crash never leaves a half-written entry behind"""
+		path = self.pathFor(source)
+		temporaryPath = path + ".tmp"
+		stored = {
+			"url": source.url,
+			"etag": entry.etag,
+			"lastModified": entry.lastModified,
+			"lines": entry.lines,
+		}
+		with open(temporaryPath, "w", encoding="utf-8") as file:
+			json.dump(stored, file)
+		os.replace(temporaryPath, path)
+
+
+class MemoryCache:
+	"""like SourceCache, but only for as long as the process runs"""
+
+	def __init__(self) -> None:
+		self._entries: Dict[str, CacheEntry] = {}
+
+	def load(self, source) -> Optional[CacheEntry]:
+		return self._entries.get(source.url)
+
+	def save(self, source, entry: CacheEntry):
+		self._entries[source.url] = entry
+
+
+class SourceArchive:
+	"""
+	keeps the last successfully parsed lines of each source, gzip compressed, to fall back on when a download fails
+	a file's modification time is when its source was last known to be good
+	"""
+
+	def __init__(self, directory: str, maxAge: Optional[float] = None) -> None:
+		self._directory = directory
+		self._maxAge = maxAge
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	@property
+	def maxAge(self) -> Optional[float]:
+		"""in seconds, None for no limit"""
+		return self._maxAge
+
+	def pathFor(self, source) -> str:
+		key = hashlib.sha1(source.url.encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, "{}.txt.gz".format(key))
+
+	def getAge(self, source) -> Optional[float]:
+		"""seconds since the source was last known to be good, or None if it never was"""
+		try:
+			return max(time.time() - os.path.getmtime(self.pathFor(source)), 0.0)
+		except OSError:
+			return None
+
+	def save(self, source, lines: List[str]):
+		path = self.pathFor(source)
+		temporaryPath = path + ".tmp"
+		with gzip.open(temporaryPath, "wt", encoding="utf-8", newline="\n") as file:
+			for line in lines:
+				file.write(line)
+				file.write("\n")
+		os.replace(temporaryPath, path)
+
+	def confirm(self, source, lines: List[str]):
+		"""records that the source is still good, e.g. after the server said it hasn't changed"""
+		if self.getAge(source) is None:
+			self.save(source, lines)
+		else:
+			os.utime(self.pathFor(source))
+
+	def load(self, source, ignoreAge: bool = False) -> Optional[List[str]]:
+		"""returns None if there is no copy, it is unreadable, or it is older than maxAge"""
+		age = self.getAge(source)
+		if age is None or (not ignoreAge and self.maxAge is not None and age > self.maxAge):
+			return None
+		try:
+			with gzip.open(self.pathFor(source), "rt", encoding="utf-8", newline="\n") as file:
+				return file.read().split("\n")[:-1]
+		except (OSError, EOFError, UnicodeDecodeError):
+			return None
+
+
+def parseHttpDate(value: Optional[str]) -> Optional[float]:
+	try:
+		return parsedate_to_datetime(value).timestamp()
+	except (TypeError, ValueError):
+		return None
+
+
+def getFreshness(headers) -> Optional[float]:
+	"""
+	how many seconds a response stays fresh, going by Cache-Control: max-age or else Expires
+	0 if it must not be reused without asking again, or None if the server didn't say
+	"""
+	directives = [directive.strip().lower() for directive in headers.get("Cache-Control", "").split(",")]
+	if "no-cache" in directives or "no-store" in directives:
+		return 0.0
+	for directive in directives:
+		(name, _, value) = directive.partition("=")
+		if name == "max-age":
+			try:
+				return max(float(value.strip('"')), 0.0)
+			except ValueError:
+				return None
+	expires = parseHttpDate(headers.get("Expires"))
+	if expires is None:
+		# an Expires that isn't a date, such as 0, means already expired
+		return 0.0 if "Expires" in headers else None
+	date = parseHttpDate(headers.get("Date"))
+	return max(expires - (date if date is not None else time.time()), 0.0)
+
+
+def createConditionalHeaders(entry: Optional[CacheEntry]) -> dict:
+	headers = {}
+	if entry is None:
+		return headers
+	if entry.etag is not None:
+		headers["If-None-Match"] = entry.etag
+	if entry.lastModified is not None:
+		headers["If-Modified-Since"] = entry.lastModified
+	return headers
@@ -0,0 +1,55 @@
+import ast
+import sys
+from typing import Dict, List
+from console import printError
+
+
+def getBoundNames(statement: ast.stmt) -> List[str]:
+	"""the names a top-level statement binds, where one import of the same name from the same place counts once"""
+	if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+		return [statement.name]
+	if isinstance(statement, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+		targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+		return [node.id for target in targets for node in ast.walk(target) if isinstance(node, ast.Name)]
+	if isinstance(statement, ast.Try):
+		# try: import x / except ImportError: x = None binds x once, whichever way it goes
+		names: List[str] = []
+		for block in [statement.body, statement.orelse, statement.finalbody] + [handler.body for handler in statement.handlers]:
+			for inner in block:
+				names.extend(name for name in getBoundNames(inner) if name not in names)
+		return names
+	return []
+
+
+def findDuplicates(path: str) -> Dict[str, List[int]]:
+	"""every top-level name that more than one statement binds, with the lines that bind it"""
+	with open(path, encoding="utf-8") as file:
+		tree = ast.parse(file.read(), path)
+	lines: Dict[str, List[int]] = {}
+	imports: Dict[str, str] = {}
+	for statement in tree.body:
+		if isinstance(statement, (ast.Import, ast.ImportFrom)):
+			module = statement.module if isinstance(statement, ast.ImportFrom) else ""
+			for alias in statement.names:
+				name = (alias.asname or alias.name).split(".")[0]
+				origin = "{}.{}".format(module, alias.name)
+				if imports.get(name) == origin:
+					continue
+				imports[name] = origin
+				lines.setdefault(name, []).append(statement.lineno)
+			continue
+		for name in getBoundNames(statement):
+			lines.setdefault(name, []).append(statement.lineno)
+	return {name: found for (name, found) in lines.items() if len(found) > 1}
+
+
+def main(args: List[str]) -> int:
+	path = args[0] if len(args) > 0 else "pyhosts.py"
+	duplicates = findDuplicates(path)
+	for name, found in sorted(duplicates.items()):
+		printError("{} is bound more than once in {}, on lines {}".format(name, path, ", ".join(str(line) for line in found)))
+	return 1 if len(duplicates) > 0 else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,5 @@
+import sys
+
+
+def printError(message: str):
+	print(message, file=sys.stderr)
@@ -0,0 +1,85 @@
+import signal
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+from collections import OrderedDict
+
+
+# minutes
+DEFAULT_REFRESH_INTERVAL = 60
+# however briefly a server says a source stays fresh, it isn't downloaded more often than this, in seconds
+MIN_REFRESH_INTERVAL = 5 * 60
+# nor less often than this, however long it says
+MAX_REFRESH_INTERVAL = 24 * 3600
+
+
+class RefreshSchedule:
+	"""
+	when each source is next due, from how long its server said it stays fresh (Cache-Control or Expires),
+	or the default interval if it didn't say or the download failed
+	times are from time.monotonic(), like the wait between refreshes, so that setting the clock doesn't move them
+	"""
+
+	def __init__(self, defaultInterval: float) -> None:
+		self._defaultInterval = defaultInterval
+		self._due: Dict[str, float] = {}
+
+	def getDue(self, sources, now: float) -> List:
+		"""the sources due at now, including any that haven't been downloaded yet"""
+		return [source for source in sources if self._due.get(source.url, now) <= now]
+
+	def getNextDue(self) -> Optional[float]:
+		return min(self._due.values()) if len(self._due) > 0 else None
+
+	def schedule(self, source, freshFor: Optional[float], now: float) -> float:
+		"""sets when the source is next due, returning the interval in seconds"""
+		interval = self._defaultInterval if freshFor is None else min(max(freshFor, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+		self._due[source.url] = now + interval
+		return interval
+
+
+class DomainSet:
+	"""
+	the merged domains of every source held in memory, with how many sources list each domain,
+	so that a refreshed source only adds and removes what changed in it rather than merging every source again
+	domains keep the order in which they were first listed, like DomainStore
+	"""
+
+	def __init__(self) -> None:
+		self._sources: Dict[str, Dict[str, None]] = {}
+		self._counts: Dict[str, int] = {}
+
+	def __len__(self) -> int:
+		return len(self._counts)
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self._counts)
+
+	def updateSource(self, key: str, lines: Iterable[str]) -> bool:
+		"""replaces what the source listed last time with lines, returning true if the merged domains changed"""
+		listed = OrderedDict.fromkeys(lines)
+		stored = self._sources.get(key, {})
+		changed = False
+		for domain in listed:
+			if domain not in stored:
+				count = self._counts.get(domain, 0)
+				self._counts[domain] = count + 1
+				changed = changed or count == 0
+		for domain in stored:
+			if domain not in listed:
+				self._counts[domain] -= 1
+				if self._counts[domain] == 0:
+					del self._counts[domain]
+					changed = True
+		if len(listed) > 0:
+			self._sources[key] = listed
+		else:
+			self._sources.pop(key, None)
+		return changed
+
+
+def createStopEvent() -> threading.Event:
+	"""an event that is set by SIGTERM or Ctrl+C, so that the daemon stops between refreshes rather than midway"""
+	stopped = threading.Event()
+	for signalNumber in (signal.SIGINT, signal.SIGTERM):
+		signal.signal(signalNumber, lambda *args: stopped.set())
+	return stopped
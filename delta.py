@@ -0,0 +1,107 @@
+import os
+import subprocess
+from typing import List, Optional
+from console import printError
+from report import writeAtomically
+from exceptions import ControlCommandError
+
+
+class ControlRunner:
+	"""runs a server's control command, e.g. unbound-control, giving it input on stdin"""
+
+	def run(self, command: List[str], input: Optional[str]):
+		try:
+			subprocess.run(command, input=input, capture_output=True, text=True, check=True)
+		except subprocess.CalledProcessError as e:
+			raise ControlCommandError(command, e.stderr or e.stdout or "exit status {}".format(e.returncode))
+		except OSError as e:
+			raise ControlCommandError(command, str(e))
+
+
+class Delta:
+	"""the domains added and removed since the previous run, each in the order they were listed"""
+
+	def __init__(self, added: List[str], removed: List[str]) -> None:
+		self._added = added
+		self._removed = removed
+
+	@property
+	def added(self) -> List[str]:
+		return self._added
+
+	@property
+	def removed(self) -> List[str]:
+		return self._removed
+
+	def isEmpty(self) -> bool:
+		return len(self.added) == 0 and len(self.removed) == 0
+
+
+def computeDelta(previous: List[str], current: List[str]) -> Delta:
+	previousSet = set(previous)
+	currentSet = set(current)
+	return Delta([domain for domain in current if domain not in previousSet], [domain for domain in previous if domain not in currentSet])
+
+
+class DeltaWriter:
+	"""
+	keeps the domains each target was last written with in a directory, and writes what changed since then
+	to <name>.add and <name>.remove, optionally applying them to the running server with a ControlRunner
+	"""
+
+	def __init__(self, directory: str, runner: Optional[ControlRunner] = None) -> None:
+		self._directory = directory
+		self._runner = runner
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	def pathFor(self, name: str, extension: str) -> str:
+		return os.path.join(self.directory, "{}.{}".format(name, extension))
+
+	def isAppliedInPlace(self, name: str, serverFormatter) -> bool:
+		"""true if the server keeps the output up to date itself from the deltas applied to it, once its domains are remembered"""
+		return (
+			self._runner is not None
+			and serverFormatter.supportsDelta
+			and serverFormatter.deltaUpdatesOutput
+			and os.path.exists(self.pathFor(name, "domains"))
+		)
+
+	def loadPrevious(self, name: str) -> Optional[List[str]]:
+		"""returns None if the target has not been written before"""
+		try:
+			with open(self.pathFor(name, "domains"), "r", encoding="utf-8") as file:
+				return file.read().splitlines()
+		except FileNotFoundError:
+			return None
+
+	def write(self, name: str, serverFormatter, domains: List[str]) -> Optional[Delta]:
+		"""
+		the domains are only remembered once the delta has been written and applied,
+		so a failed control command is retried with the same delta next run
+		the first run only remembers the domains, as the server loads them from the output that was just written
+		"""
+		if not serverFormatter.supportsDelta:
+			printError("no delta written for {}, it can't be updated while running".format(serverFormatter.name))
+			return None
+		previous = self.loadPrevious(name)
+		if previous is None:
+			printError("no previous domains for {}, they are remembered for the next delta".format(name))
+			previous = domains
+		delta = computeDelta(previous, domains)
+		additions = serverFormatter.formatAdditions(delta.added)
+		removals = serverFormatter.formatRemovals(delta.removed)
+		writeAtomically(self.pathFor(name, "add"), "".join(line + "\n" for line in additions))
+		writeAtomically(self.pathFor(name, "remove"), "".join(line + "\n" for line in removals))
+		printError(
+			"delta for {}: {} added, {} removed, written to {}".format(name, len(delta.added), len(delta.removed), os.path.abspath(self.directory))
+		)
+		if self._runner is not None and not delta.isEmpty():
+			for command, input in serverFormatter.getControlCommands(additions, removals):
+				self._runner.run(command, input)
+			printError("delta applied to {}".format(serverFormatter.name))
+		writeAtomically(self.pathFor(name, "domains"), "".join(domain + "\n" for domain in domains))
+		return delta
@@ -0,0 +1,53 @@
+from typing import Iterator, List
+
+
+def getParentDomains(domain: str) -> Iterator[str]:
+	"""
+	yields every parent of a domain, nearest first
+	e.g. a.b.example.com gives b.example.com, example.com, com
+	"""
+	index = domain.find(".")
+	while index != -1:
+		yield domain[index + 1 :]
+		index = domain.find(".", index + 1)
+
+
+def isSuffixRule(rule: str) -> bool:
+	"""*.example.com and .example.com both cover example.com and every subdomain of it"""
+	return rule.startswith("*.") or rule.startswith(".")
+
+
+class DomainTrie:
+	"""stores domains label by label from the right, so a.tracker.com and b.tracker.com share com -> tracker"""
+
+	# key marking that the path to a node is itself a domain, labels are never None
+	_BLOCKED = None
+
+	def __init__(self) -> None:
+		self._root = {}
+
+	def add(self, domain: str):
+		node = self._root
+		for label in reversed(domain.split(".")):
+			node = node.setdefault(label, {})
+		node[DomainTrie._BLOCKED] = True
+
+	def hasBlockedParent(self, domain: str) -> bool:
+		"""true if any parent of the domain (but not the domain itself) has been added"""
+		node = self._root
+		labels = domain.split(".")
+		for label in reversed(labels[1:]):
+			node = node.get(label)
+			if node is None:
+				return False
+			if DomainTrie._BLOCKED in node:
+				return True
+		return False
+
+
+def collapseSubdomains(domains: List[str]) -> List[str]:
+	"""drops every domain whose parent is also in the list, keeping the order of the rest"""
+	trie = DomainTrie()
+	for domain in domains:
+		trie.add(domain)
+	return [domain for domain in domains if not trie.hasBlockedParent(domain)]
@@ -1,3 +1,6 @@
+import time
+
+
 class UnknownServerTypeError(Exception):
 	"""Raised when the (REQUIRED) DNS server type is not recognised/supported by pyhosts"""
 
@@ -111,3 +114,90 @@ class LocalhostFoundError(Exception):
 
 	def __str__(self) -> str:
 		return self.message
+
+
+class ControlCommandError(Exception):
+	"""Raised when a server's control command (e.g. unbound-control) fails"""
+
+	def __init__(self, command, output) -> None:
+		self._message = "'{}' failed: {}".format(" ".join(command), output.strip())
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class SnapshotFormatError(Exception):
+	"""Raised when a file is not a domain snapshot, or is truncated"""
+
+	def __init__(self, filename) -> None:
+		self._message = "not a domain snapshot: {}".format(filename)
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class BloomFilterFormatError(Exception):
+	"""Raised when a file is not a Bloom filter of domains, or is truncated"""
+
+	def __init__(self, filename) -> None:
+		self._message = "not a domain Bloom filter: {}".format(filename)
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class CircuitOpenError(Exception):
+	"""Raised instead of downloading a source that has failed too many runs in a row, until its cooldown is over"""
+
+	def __init__(self, source, failures, openUntil) -> None:
+		self._source = source
+		self._message = "skipped after {} failed runs in a row, next try after {}".format(
+			failures, time.strftime("%Y-%m-%d %H:%M", time.localtime(openUntil))
+		)
+		super().__init__(self.message)
+
+	@property
+	def source(self):
+		return self._source
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class DownloadTimeoutError(Exception):
+	"""Raised when a source is still sending after the whole download was meant to be over, however steadily it sends"""
+
+	def __init__(self, source, seconds) -> None:
+		self._source = source
+		self._message = "{} (still downloading after {} seconds)".format(source, seconds)
+		super().__init__(self.message)
+
+	@property
+	def source(self):
+		return self._source
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
@@ -1,24 +1,92 @@
-from typing import List
+import time
+import itertools
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, Optional, Tuple
+from domains import DomainTrie, collapseSubdomains
 from exceptions import LocalhostFoundError, UnknownServerTypeError
 
 
-def determineServerFormatter(serverArg: str):
+# the name the examples in the README load the zone as
+DEFAULT_RPZ_ZONE = "rpz.local"
+# the TTL given to every record in the zone file and in updates
+RPZ_TTL = 300
+# the most names Windows reads from one line of the HOSTS file
+MAX_HOSTS_PER_LINE = 9
+# address=/example.com/ answers NXDOMAIN for example.com and its subdomains, local=/example.com/ too, and never asks upstream
+DNSMASQ_DIRECTIVES = ("address", "local")
+
+
+def determineServerFormatter(serverArg: str, rpzZone: str = DEFAULT_RPZ_ZONE, hostsPerLine: int = 1, dnsmasqDirective: str = DNSMASQ_DIRECTIVES[0]):
 	serverArgLower = serverArg.lower()
 	if serverArgLower == "unbound":
 		return UnboundFormatter()
 	elif serverArgLower == "bind":
 		return BindFormatter()
 	elif serverArgLower == "winhosts":
-		return WindowsHostsFileFormatter()
+		return WindowsHostsFileFormatter(hostsPerLine)
+	elif serverArgLower == "rpz":
+		return RpzFormatter(zone=rpzZone)
+	elif serverArgLower == "dnsmasq":
+		return DnsmasqFormatter(dnsmasqDirective)
 	else:
 		raise UnknownServerTypeError(serverArg)
 
 
-class BaseFormatter:
+class BaseFormatter(ABC):
 	@property
 	def name(self):
 		return self._name
 
+	@property
+	def coversSubdomains(self) -> bool:
+		"""true if the server blocks every subdomain of a listed domain, e.g. a.example.com for example.com"""
+		return self._coversSubdomains
+
+	def getHeader(self) -> List[str]:
+		"""lines written before any domains"""
+		return []
+
+	@abstractmethod
+	def formatDomain(self, domain: str) -> List[str]:
+		"""the lines that block one domain, which every server writes differently"""
+
+	@property
+	def variableLinePrefix(self) -> Optional[str]:
+		"""how a line that changes every time the output is written starts, whatever the domains, so it doesn't count as a change"""
+		return None
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		"""formats one domain at a time, so the output never has to be held in memory"""
+		yield from self.getHeader()
+		for line in rejectLocalhost(lines):
+			yield from self.formatDomain(line)
+
+	def format(self, lines: Iterable[str]) -> List[str]:
+		return list(self.stream(lines))
+
+	@property
+	def supportsDelta(self) -> bool:
+		"""
+		true if a running server can be given added and removed domains without reloading everything
+		servers that can't have nothing to add, remove or run, rather than failing if asked
+		"""
+		return False
+
+	@property
+	def deltaUpdatesOutput(self) -> bool:
+		"""true if applying a delta changes the output itself, as BIND does to a dynamic zone's file, which mustn't then be rewritten under it"""
+		return False
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		return []
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		return []
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""the commands, and what to give each one on stdin, that apply formatted removals and additions to a running server"""
+		return []
+
 	def __str__(self) -> str:
 		return self.name
 
@@ -26,40 +94,214 @@ class BaseFormatter:
 class UnboundFormatter(BaseFormatter):
 	def __init__(self) -> None:
 		self._name = "Unbound Formatter"
+		self._coversSubdomains = True
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ['local-zone: "{}." always_nxdomain'.format(domain)]
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = 'local-zone: "{}." always_nxdomain'.format(line)
-			formatted.append(line)
-		return formatted
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		"""bulk input for unbound-control local_zones"""
+		return ["{}. always_nxdomain".format(domain) for domain in domains]
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		"""bulk input for unbound-control local_zones_remove"""
+		return ["{}.".format(domain) for domain in domains]
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		commands = []
+		if len(removals) > 0:
+			commands.append((["unbound-control", "local_zones_remove"], "\n".join(removals) + "\n"))
+		if len(additions) > 0:
+			commands.append((["unbound-control", "local_zones"], "\n".join(additions) + "\n"))
+		return commands
 
 
 class BindFormatter(BaseFormatter):
 	def __init__(self) -> None:
 		self._name = "BIND Formatter"
+		self._coversSubdomains = True
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ['zone "{}" {{ type master; file "/etc/bind/zones/db.poison"; }};'.format(domain)]
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		"""the zone statements added to the include"""
+		return [line for domain in domains for line in self.formatDomain(domain)]
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = 'zone "{}" {{ type master; file "/etc/bind/zones/db.poison"; }};'.format(line)
-			formatted.append(line)
-		return formatted
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		"""the names of the zones taken out of the include"""
+		return list(domains)
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""
+		rndc reconfig reads the include that was just written, loading the zones added to it and dropping those removed,
+		without reloading the others, so the running server and the include never disagree, however many zones changed
+		"""
+		if len(additions) == 0 and len(removals) == 0:
+			return []
+		return [(["rndc", "reconfig"], None)]
 
 
 class WindowsHostsFileFormatter(BaseFormatter):
-	def __init__(self) -> None:
+	"""
+	with hostsPerLine above 1, lists that many domains after each address, which makes the file
+	far smaller and quicker for the DNS Client service to read
+	"""
+
+	def __init__(self, hostsPerLine: int = 1) -> None:
 		self._name = "Windows Hosts File Formatter"
+		self._coversSubdomains = False
+		self._hostsPerLine = hostsPerLine
+
+	@property
+	def hostsPerLine(self) -> int:
+		return self._hostsPerLine
+
+	def getHeader(self) -> List[str]:
+		return ["127.0.0.1 localhost", "::1 localhost", ""]
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["0.0.0.0 {}".format(domain)]
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		if self.hostsPerLine == 1:
+			yield from super().stream(lines)
+			return
+		yield from self.getHeader()
+		domains = rejectLocalhost(lines)
+		while True:
+			batch = list(itertools.islice(domains, self.hostsPerLine))
+			if len(batch) == 0:
+				return
+			yield "0.0.0.0 {}".format(" ".join(batch))
+
+
+class DnsmasqFormatter(BaseFormatter):
+	"""
+	dnsmasq matches every subdomain of a listed domain, so subdomains of listed domains are always left out
+	format sees every domain and leaves them all out, stream only those that come after their parent
+	"""
+
+	def __init__(self, directive: str = DNSMASQ_DIRECTIVES[0]) -> None:
+		self._name = "dnsmasq Formatter"
+		self._coversSubdomains = True
+		self._directive = directive
+
+	@property
+	def directive(self) -> str:
+		return self._directive
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["{}=/{}/".format(self.directive, domain)]
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		"""keeps the domains written so far in a trie, which shares their parents' labels, to find their subdomains"""
+		yield from self.getHeader()
+		written = DomainTrie()
+		for domain in rejectLocalhost(lines):
+			if written.hasBlockedParent(domain):
+				continue
+			written.add(domain)
+			yield from self.formatDomain(domain)
+
+	def format(self, lines: Iterable[str]) -> List[str]:
+		return list(super().stream(collapseSubdomains(list(lines))))
+
+
+class RpzFormatter(BaseFormatter):
+	"""
+	writes a single Response Policy Zone, which BIND and Unbound load far faster than one zone per domain
+	every domain gets a CNAME to the root, which RPZ treats as NXDOMAIN, for itself and its subdomains
+	"""
+
+	def __init__(self, serial=None, zone: str = DEFAULT_RPZ_ZONE) -> None:
+		self._name = "RPZ Formatter"
+		self._coversSubdomains = True
+		# a serial given here is used for every header, otherwise each header gets a new one
+		self._fixedSerial = serial
+		self._serial = serial if serial is not None else 0
+		self._zone = zone.rstrip(".")
+
+	@property
+	def serial(self) -> int:
+		"""the serial in the last header, or 0 before any header has been written"""
+		return self._serial
+
+	def getNextSerial(self) -> int:
+		"""
+		seconds since the epoch, which increase between runs and fit the 32-bit serial until 2106,
+		and at least one more than the last serial, for a formatter reused by the daemon that writes twice in a second
+		"""
+		if self._fixedSerial is not None:
+			return self._fixedSerial
+		return max(int(time.time()), self._serial + 1)
+
+	@property
+	def zone(self) -> str:
+		"""the name the zone is loaded as, which updates need because nsupdate only takes absolute names"""
+		return self._zone
+
+	def getHeader(self) -> List[str]:
+		self._serial = self.getNextSerial()
+		return [
+			"$TTL {}".format(RPZ_TTL),
+			"@ IN SOA localhost. root.localhost. ({} 60 60 60 60)".format(self.serial),
+			"@ IN NS localhost.",
+			"",
+		]
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["{} CNAME .".format(domain), "*.{} CNAME .".format(domain)]
+
+	@property
+	def variableLinePrefix(self) -> Optional[str]:
+		"""the SOA record, whose serial is new every time"""
+		return "@ IN SOA "
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
+
+	@property
+	def deltaUpdatesOutput(self) -> bool:
+		return True
+
+	def formatUpdate(self, action: str, domains: List[str]) -> List[str]:
+		"""an nsupdate script, which BIND applies to the zone as an incremental (IXFR) change and bumps the serial for"""
+		if len(domains) == 0:
+			return []
+		lines = ["zone {}.".format(self.zone)]
+		for domain in domains:
+			for name in (domain, "*." + domain):
+				if action == "add":
+					lines.append("update add {}.{}. {} CNAME .".format(name, self.zone, RPZ_TTL))
+				else:
+					lines.append("update delete {}.{}. CNAME".format(name, self.zone))
+		lines.append("send")
+		return lines
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		return self.formatUpdate("add", domains)
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		return self.formatUpdate("delete", domains)
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""nsupdate -l uses the session key BIND creates for local updates, which the zone only accepts with update-policy local"""
+		return [(["nsupdate", "-l"], "\n".join(lines) + "\n") for lines in (removals, additions) if len(lines) > 0]
+
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = ["127.0.0.1 localhost", "::1 localhost", ""]
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = "0.0.0.0 {}".format(line)
-			formatted.append(line)
-		return formatted
+def rejectLocalhost(lines: Iterable[str]) -> Iterator[str]:
+	"""blocking localhost would break the machine, so it is an error for any source to list it"""
+	for line in lines:
+		if line == "localhost":
+			raise LocalhostFoundError()
+		yield line
@@ -1,12 +1,48 @@
 import os
 import sys
+import time
 import logging
+import itertools
+import contextlib
 import requests
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
 from collections import OrderedDict
-from formatters import determineServerFormatter
-from sources import getSources, downloadSources
-from exceptions import DownloadError, FileReadError, FileWriteError, UsageError
+from concurrent.futures import ThreadPoolExecutor
+from console import printError
+from cache import MemoryCache, SourceArchive, SourceCache
+from report import RunReport
+from domains import collapseSubdomains, getParentDomains, isSuffixRule
+from delta import ControlRunner, DeltaWriter
+from formatters import DEFAULT_RPZ_ZONE, DNSMASQ_DIRECTIVES, MAX_HOSTS_PER_LINE, determineServerFormatter
+from store import DomainStore, SourceIndex, writeSourceIndex
+from snapshot import normalizeQuery, writeSnapshot
+from bloom import DEFAULT_FALSE_POSITIVE_RATE, writeBloomFilter
+from spill import ExternalDeduplicator
+from output import AtomicOutputFile, getCompression, isCompressionAvailable
+from daemon import DEFAULT_REFRESH_INTERVAL, MIN_REFRESH_INTERVAL, DomainSet, RefreshSchedule, createStopEvent
+from serve import DEFAULT_SERVE_PORT, Publisher, startServer
+from breaker import DEFAULT_COOLDOWN, DEFAULT_FAILURE_THRESHOLD, CircuitBreaker
+from sources import (
+	DEFAULT_CONNECT_TIMEOUT,
+	DEFAULT_CONNECTIONS_PER_HOST,
+	DEFAULT_DOWNLOAD_TIMEOUT,
+	DEFAULT_READ_TIMEOUT,
+	DEFAULT_RETRIES,
+	DownloadPolicy,
+	ParsePool,
+	getSources,
+	fetchSources,
+	loadArchivedSources,
+	streamSources,
+)
+from exceptions import DownloadError, FileReadError, FileWriteError, NoSourcesConfiguredError, UsageError
+
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+# in hours, a week of failed downloads is as long as a source's last known good copy is trusted
+DEFAULT_MAX_ARCHIVE_AGE = 7 * 24
+# what the blacklist file is stored as in a DomainStore, which can't clash with a source's url
+BLACKLIST_KEY = "blacklist.txt"
 
 
 def combineWithScriptDirectory(filename):
@@ -40,6 +76,110 @@ def removeDupes(lines: List[str]) -> List[str]:
 	return list(OrderedDict.fromkeys(lines))
 
 
+class WhitelistIndex:
+	"""exact rules are looked up in a set, suffix rules (*.example.com or .example.com) by walking a domain's parents"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		self._exact = set()
+		self._suffixes = {}
+		for rule in whitelist:
+			if isSuffixRule(rule):
+				self._suffixes[rule.lstrip("*.")] = rule
+			else:
+				self._exact.add(rule)
+
+	def findRule(self, domain: str) -> Optional[str]:
+		"""returns the whitelist rule that spares the domain, or None if it should stay blocked"""
+		if domain in self._exact:
+			return domain
+		if len(self._suffixes) == 0:
+			return None
+		if domain in self._suffixes:
+			return self._suffixes[domain]
+		for parent in getParentDomains(domain):
+			if parent in self._suffixes:
+				return self._suffixes[parent]
+		return None
+
+
+def removeWhitelisted(lines: List[str], whitelist: List[str]) -> Tuple[List[str], List[str], int]:
+	"""
+	removes whitelisted domains in a single pass, keeping the order of the rest
+	returns the remaining lines, the whitelist rules that saved at least one domain, and how many domains were saved
+	"""
+	index = WhitelistIndex(whitelist)
+	remaining: List[str] = []
+	usedRules = set()
+	savedCount = 0
+	for line in lines:
+		rule = index.findRule(line)
+		if rule is None:
+			remaining.append(line)
+		else:
+			usedRules.add(rule)
+			savedCount += 1
+	savedVia = [rule for rule in removeDupes(whitelist) if rule in usedRules]
+	return (remaining, savedVia, savedCount)
+
+
+class WhitelistFilter:
+	"""drops whitelisted domains from a stream as they go past, remembering which rules saved them"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		self._whitelist = whitelist
+		self._index = WhitelistIndex(whitelist)
+		self._usedRules = set()
+		self._totalCount = 0
+		self._savedCount = 0
+
+	@property
+	def totalCount(self) -> int:
+		return self._totalCount
+
+	@property
+	def savedCount(self) -> int:
+		return self._savedCount
+
+	@property
+	def savedVia(self) -> List[str]:
+		return [rule for rule in removeDupes(self._whitelist) if rule in self._usedRules]
+
+	def isWhitelisted(self, line: str) -> bool:
+		rule = self._index.findRule(line)
+		if rule is None:
+			return False
+		self._usedRules.add(rule)
+		self._savedCount += 1
+		return True
+
+	def filter(self, lines: Iterable[str]) -> Iterator[str]:
+		for line in lines:
+			self._totalCount += 1
+			if not self.isWhitelisted(line):
+				yield line
+
+
+class UniqueDomainFilter(WhitelistFilter):
+	"""drops duplicate and whitelisted domains from a stream as they go past, holding only the domains seen so far"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		super().__init__(whitelist)
+		self._seen = set()
+
+	@property
+	def uniqueCount(self) -> int:
+		return len(self._seen)
+
+	def filter(self, lines: Iterable[str]) -> Iterator[str]:
+		for line in lines:
+			self._totalCount += 1
+			if line in self._seen:
+				continue
+			self._seen.add(line)
+			if not self.isWhitelisted(line):
+				yield line
+
+
 def readLines(path) -> List[str]:
 	with open(path, "r") as file:
 		if not file.readable:
@@ -47,77 +187,804 @@ def readLines(path) -> List[str]:
 		return list(filter(lambda x: not x.startswith("#") and len(x) > 0, file.read().splitlines()))
 
 
-def writeLinesToStdOut(lines: List[str]):
-	print("\n".join(lines), file=sys.stdout)
+def writeLinesToStream(lines: Iterator[str], stream):
+	"""writes the lines separated by newlines one at a time, rather than joining them into one string first"""
+	for line in lines:
+		stream.write(line)
+		stream.write("\n")
+
 
+def writeLinesToStdOut(lines: Iterable[str]):
+	writeLinesToStream(iter(lines), sys.stdout)
 
-def writeLinesToFile(lines, filename):
-	if len(lines) > 0:
-		with open(filename, "w") as file:
-			if not file.writable:
-				raise FileWriteError(filename)
-			file.write("\n".join(lines))
+
+def writeLinesToFile(lines: Iterable[str], filename, ignoredPrefix: Optional[str] = None):
+	"""with ignoredPrefix, the file is only replaced if a line that doesn't start with it changed"""
+	lines = iter(lines)
+	firstLine = next(lines, None)
+	if firstLine is None:
+		printError("no lines to write")
+		return
+	output = AtomicOutputFile(filename, WRITE_BUFFER_SIZE, ignoredPrefix)
+	with output as file:
+		if not file.writable:
+			raise FileWriteError(filename)
+		file.write(firstLine)
+		for line in lines:
+			file.write("\n")
+			file.write(line)
+	if output.changed:
 		printError("file written to {}".format(os.path.abspath(filename)))
 	else:
-		printError("no lines to write")
+		printError("{} is unchanged, left as it is".format(os.path.abspath(filename)))
 
 
-def writeLines(lines, filename):
+def writeLines(lines, filename, ignoredPrefix: Optional[str] = None):
 	if filename is None:
 		writeLinesToStdOut(lines)
 	else:
-		writeLinesToFile(lines, filename)
+		writeLinesToFile(lines, filename, ignoredPrefix)
+
+
+def collapseForServer(lines: List[str], serverFormatter) -> List[str]:
+	"""removes subdomains of blocked domains, but only for servers that block subdomains themselves"""
+	if not serverFormatter.coversSubdomains:
+		printError("not collapsing subdomains, {} does not block them".format(serverFormatter.name))
+		return lines
+	collapsed = collapseSubdomains(lines)
+	removedCount = len(lines) - len(collapsed)
+	printError("collapsed {} subdomain(s) covered by a blocked parent ({} -> {})".format(removedCount, len(lines), len(collapsed)))
+	return collapsed
+
+
+def printWhitelistSummary(savedVia: List[str], savedCount: int):
+	if savedCount > 0:
+		printError("{} domain(s) saved via whitelisting ({})".format(savedCount, ", ".join(savedVia)))
+	else:
+		printError("no domains saving via whitelisting")
+
 
+class Target:
+	"""one output of a run, the server type to format the domains for and the file to write them to (None for stdout)"""
 
-def process(serverFormatter, filename):
-	printError("using {}".format(serverFormatter.name))
+	def __init__(self, serverFormatter, filename: Optional[str]) -> None:
+		self._serverFormatter = serverFormatter
+		self._filename = filename
+
+	@property
+	def serverFormatter(self):
+		return self._serverFormatter
+
+	@property
+	def filename(self) -> Optional[str]:
+		return self._filename
+
+	@property
+	def deltaName(self) -> str:
+		"""what this target's delta files are called"""
+		return os.path.basename(self.filename) if self.filename is not None else "stdout"
+
+
+def processStreaming(target, cache, report, memoryBudget, policy, breaker):
+	"""
+	downloads, filters, formats and writes one line at a time
+	peak memory is the set of unique domains, instead of several copies of every line
+	with a memory budget, duplicates are removed on disk instead, so not even that set is held
+	"""
+	with report.stage("stream") as stage:
+		lines = itertools.chain(loadBlacklist(), streamSources(getSources(), cache, report, policy, breaker))
+		if memoryBudget is None:
+			uniqueFilter = UniqueDomainFilter(loadWhitelist())
+			writeLines(target.serverFormatter.stream(uniqueFilter.filter(lines)), target.filename, target.serverFormatter.variableLinePrefix)
+			(totalCount, uniqueCount) = (uniqueFilter.totalCount, uniqueFilter.uniqueCount)
+		else:
+			deduplicator = ExternalDeduplicator(memoryBudget)
+			uniqueFilter = WhitelistFilter(loadWhitelist())
+			writeLines(
+				target.serverFormatter.stream(uniqueFilter.filter(deduplicator.deduplicate(lines))),
+				target.filename,
+				target.serverFormatter.variableLinePrefix,
+			)
+			(totalCount, uniqueCount) = (deduplicator.totalCount, deduplicator.uniqueCount)
+			printError("removed duplicates with {} temporary file(s)".format(deduplicator.runCount))
+		stage.linesIn = totalCount
+		stage.linesOut = uniqueCount - uniqueFilter.savedCount
+	printError("finished downloading ({} total, {} unique)".format(totalCount, uniqueCount))
+	printWhitelistSummary(uniqueFilter.savedVia, uniqueFilter.savedCount)
+
+
+def writeTarget(target, lines: List[str], stageSuffix: str, report, deltaWriter):
+	"""formats and writes the shared domains for one target, leaving them untouched for the others"""
+	if deltaWriter is not None and os.path.exists(target.filename) and deltaWriter.isAppliedInPlace(target.deltaName, target.serverFormatter):
+		printError("{} is kept up to date by the server, only the delta is applied to it".format(target.filename))
+	else:
+		with report.stage("format" + stageSuffix, len(lines)) as stage:
+			formattedForServer = target.serverFormatter.format(lines)
+			stage.linesOut = len(formattedForServer)
+		with report.stage("write" + stageSuffix, len(formattedForServer)):
+			writeLines(formattedForServer, target.filename, target.serverFormatter.variableLinePrefix)
+	if deltaWriter is not None:
+		with report.stage("delta" + stageSuffix, len(lines)) as stage:
+			delta = deltaWriter.write(target.deltaName, target.serverFormatter, lines)
+			stage.linesOut = len(delta.added) + len(delta.removed) if delta is not None else None
+
+
+def writeTargets(targets: List[Target], lines: List[str], collapse: bool, report, deltaWriter=None, sort: bool = False):
+	"""
+	writes every target from the same domains, one thread per target
+	targets whose servers block subdomains share a single collapsed copy of the domains
+	"""
+	if sort:
+		with report.stage("sort", len(lines)):
+			lines = sorted(lines)
+	collapsed = None
+	jobs = []
+	for target in targets:
+		targetLines = lines
+		if collapse and target.serverFormatter.coversSubdomains:
+			if collapsed is None:
+				with report.stage("collapse", len(lines)) as stage:
+					collapsed = collapseForServer(lines, target.serverFormatter)
+					stage.linesOut = len(collapsed)
+			targetLines = collapsed
+		elif collapse:
+			collapseForServer(lines, target.serverFormatter)
+		stageSuffix = "" if len(targets) == 1 else " {}".format(target.filename)
+		jobs.append((target, targetLines, stageSuffix))
+	if len(jobs) == 1:
+		writeTarget(*jobs[0], report, deltaWriter)
+		return
+	with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+		futures = [executor.submit(writeTarget, *job, report, deltaWriter) for job in jobs]
+		for future in futures:
+			future.result()
+
+
+def writeDomainSnapshot(lines: List[str], path: Optional[str], report):
+	"""the blocked domains, before any collapsing or formatting, for other tools to look up with DomainSetReader"""
+	if path is None:
+		return
+	with report.stage("snapshot", len(lines)) as stage:
+		stage.linesOut = writeSnapshot(lines, path)
+	printError("snapshot of {} domain(s) written to {}".format(stage.linesOut, os.path.abspath(path)))
+
+
+def writeDomainBloomFilter(lines: List[str], path: Optional[str], falsePositiveRate: float, report):
+	"""the blocked domains as a Bloom filter, for tools that can afford a false alarm but not the whole list"""
+	if path is None:
+		return
+	with report.stage("bloom", len(lines)) as stage:
+		(stage.linesOut, size) = writeBloomFilter(lines, path, falsePositiveRate)
+	printError("Bloom filter of {} domain(s) in {} bytes written to {}".format(stage.linesOut, size, os.path.abspath(path)))
+
+
+def writeDomainExports(lines: List[str], options, report):
+	writeDomainSnapshot(lines, options.snapshotPath, report)
+	writeDomainBloomFilter(lines, options.bloomPath, options.bloomFalsePositiveRate, report)
+
+
+def createDownloadPolicy(options) -> DownloadPolicy:
+	return DownloadPolicy(options.connectTimeout, options.readTimeout, options.retries, downloadTimeout=options.downloadTimeout)
+
+
+def openCircuitBreaker(options) -> Optional[CircuitBreaker]:
+	return CircuitBreaker(options.breakerPath) if options.breakerPath is not None else None
+
+
+def fetchOrLoadSources(sources, options, cache, report, parsePool, archive):
+	"""with --offline every source comes from its last known good copy, otherwise it is downloaded"""
+	if options.offline:
+		return loadArchivedSources(sources, archive, report)
+	return fetchSources(
+		sources,
+		options.workers,
+		options.connectionsPerHost,
+		cache,
+		report,
+		parsePool,
+		archive,
+		createDownloadPolicy(options),
+		openCircuitBreaker(options),
+	)
+
+
+def processInMemory(targets, options, cache, report, deltaWriter, parsePool, archive):
 	lines: List[str] = []
-	lines.extend(loadBlacklist())
-	downloaded = downloadSources(getSources())
-	lines.extend(downloaded)
-	uniqueLines = removeDupes(lines)
+	# (source name, lines) for the lookup index, which shares the lines rather than copying them
+	listings: List[Tuple[str, List[str]]] = []
+	with report.stage("download") as stage:
+		blacklist = loadBlacklist()
+		lines.extend(blacklist)
+		listings.append((BLACKLIST_KEY, blacklist))
+		for source, formattedLines, _ in fetchOrLoadSources(getSources(), options, cache, report, parsePool, archive):
+			if formattedLines is not None:
+				lines.extend(formattedLines)
+				listings.append((source.name, formattedLines))
+		stage.linesOut = len(lines)
+	with report.stage("dedup", len(lines)) as stage:
+		uniqueLines = removeDupes(lines)
+		stage.linesOut = len(uniqueLines)
 	printError("finished downloading ({} total, {} unique)".format(len(lines), len(uniqueLines)))
-	savedViaWhitelist = []
-	for whitelisted in loadWhitelist():
-		if whitelisted in uniqueLines:
-			uniqueLines.remove(whitelisted)
-			savedViaWhitelist.append(whitelisted)
-	if len(savedViaWhitelist) > 0:
-		printError("{} domain(s) saved via whitelisting ({})".format(len(savedViaWhitelist), ", ".join(savedViaWhitelist)))
+	whitelist = loadWhitelist()
+	with report.stage("whitelist", len(uniqueLines)) as stage:
+		(uniqueLines, savedViaWhitelist, savedCount) = removeWhitelisted(uniqueLines, whitelist)
+		stage.linesOut = len(uniqueLines)
+	printWhitelistSummary(savedViaWhitelist, savedCount)
+	if options.indexPath is not None:
+		with report.stage("index", len(lines)):
+			writeSourceIndex(options.indexPath, listings, whitelist)
+		printError("lookup index written to {}".format(os.path.abspath(options.indexPath)))
+	writeDomainExports(uniqueLines, options, report)
+	writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+
+
+def processIncremental(targets, options, cache, report, deltaWriter, parsePool, archive):
+	"""
+	applies only what changed in each source since the last run to the domains kept in options.storePath
+	with --cache, sources that haven't changed upstream cost nothing beyond the conditional request
+	"""
+	whitelist = loadWhitelist()
+	index = WhitelistIndex(whitelist)
+	with DomainStore(options.storePath) as store:
+		with report.stage("whitelist"):
+			if store.updateWhitelist(whitelist, index.findRule):
+				printError("whitelist changed, checking every stored domain again")
+		with report.stage("download") as stage:
+			sources = getSources()
+			storedKeys = set(store.getSourceKeys())
+			changes = [store.updateSource(BLACKLIST_KEY, loadBlacklist(), index.findRule)]
+			for source, formattedLines, statistics in fetchOrLoadSources(sources, options, cache, report, parsePool, archive):
+				# a failed source keeps what it listed last time, an unchanged one has nothing to apply
+				if formattedLines is None or (statistics.notModified and source.url in storedKeys):
+					continue
+				changes.append(store.updateSource(source.url, formattedLines, index.findRule))
+			configuredKeys = set([BLACKLIST_KEY] + [source.url for source in sources])
+			for key in storedKeys - configuredKeys:
+				changes.append((0, store.removeSource(key)))
+			addedCount = sum(added for (added, _) in changes)
+			removedCount = sum(removed for (_, removed) in changes)
+			changedCount = sum(1 for (added, removed) in changes if added + removed > 0)
+			stage.linesOut = addedCount + removedCount
+		printError("{} changed source(s), {} domain listing(s) added, {} removed".format(changedCount, addedCount, removedCount))
+		savedCounts = store.countWhitelisted()
+		savedVia = [rule for rule in removeDupes(whitelist) if rule in savedCounts]
+		printWhitelistSummary(savedVia, sum(savedCounts.values()))
+		uniqueLines = list(store.getBlockedDomains())
+		printError("{} unique domain(s) stored, {} blocked".format(store.countDomains(), len(uniqueLines)))
+		writeDomainExports(uniqueLines, options, report)
+		writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+
+
+def publishTargets(targets, publisher):
+	"""serves the outputs as they are now on disk, if they are being served"""
+	if publisher is None:
+		return
+	for target in targets:
+		if os.path.exists(target.filename):
+			publisher.publish(target.filename)
+
+
+def processDaemon(targets, options, cache, deltaWriter, parsePool, archive, publisher):
+	"""
+	keeps every source's domains in memory and downloads each source again when it is due, until stopped
+	the outputs are only written again when the blocked domains change, and each refresh writes its own report
+	a refresh that fails is logged and tried again within MIN_REFRESH_INTERVAL seconds, rather than stopping the daemon
+	"""
+	cache = cache if cache is not None else MemoryCache()
+	sources = getSources()
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
+	schedule = RefreshSchedule(options.refreshInterval * 60)
+	domains = DomainSet()
+	whitelist: Optional[List[str]] = None
+	# true after a failed refresh, whose outputs might not have been written
+	failed = False
+	stopped = createStopEvent()
+	while not stopped.is_set():
+		report = RunReport(options.traceMemory)
+		now = time.monotonic()
+		due = schedule.getDue(sources, now)
+		try:
+			with report.stage("download") as stage:
+				changed = domains.updateSource(BLACKLIST_KEY, loadBlacklist()) or failed
+				# only the blacklist and whitelist are checked again when no source is due
+				if len(due) > 0:
+					for source, formattedLines, statistics in fetchOrLoadSources(due, options, cache, report, parsePool, archive):
+						schedule.schedule(source, None if statistics.failed else statistics.freshFor, now)
+						# a failed source keeps what it listed last time
+						if formattedLines is not None:
+							changed = domains.updateSource(source.url, formattedLines) or changed
+				stage.linesOut = len(domains)
+			latestWhitelist = loadWhitelist()
+			if latestWhitelist != whitelist:
+				whitelist = latestWhitelist
+				changed = True
+			if changed:
+				with report.stage("whitelist", len(domains)) as stage:
+					(uniqueLines, savedViaWhitelist, savedCount) = removeWhitelisted(list(domains), whitelist)
+					stage.linesOut = len(uniqueLines)
+				printWhitelistSummary(savedViaWhitelist, savedCount)
+				writeDomainExports(uniqueLines, options, report)
+				writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+				publishTargets(targets, publisher)
+			else:
+				printError("no domains changed, outputs left as they are")
+			writeReports(report, options)
+			failed = False
+		except Exception as e:
+			failed = True
+			printError("refresh failed - '{}'".format(e))
+			# sources that the failure left unscheduled are tried again soon rather than straight away
+			for source in schedule.getDue(due, now):
+				schedule.schedule(source, MIN_REFRESH_INTERVAL, now)
+		delay = max(schedule.getNextDue() - time.monotonic(), 0)
+		if failed:
+			delay = min(delay, MIN_REFRESH_INTERVAL)
+		printError("next refresh at {}".format(time.strftime("%H:%M:%S", time.localtime(time.time() + delay))))
+		stopped.wait(delay)
+	printError("stopped")
+
+
+class LookupResult:
+	"""why a domain is or isn't blocked, according to the run that built the lookup index"""
+
+	def __init__(self, domain: str, listedBy: List[str], parents: List[Tuple[str, List[str]]], whitelistRule: Optional[str]) -> None:
+		self._domain = domain
+		self._listedBy = listedBy
+		self._parents = parents
+		self._whitelistRule = whitelistRule
+
+	@property
+	def domain(self) -> str:
+		return self._domain
+
+	@property
+	def listedBy(self) -> List[str]:
+		"""the sources that listed the domain itself, including the blacklist"""
+		return self._listedBy
+
+	@property
+	def parents(self) -> List[Tuple[str, List[str]]]:
+		"""each blocked parent of the domain, nearest first, with the sources that listed it"""
+		return self._parents
+
+	@property
+	def whitelistRule(self) -> Optional[str]:
+		return self._whitelistRule
+
+	@property
+	def blacklisted(self) -> bool:
+		"""true if the blacklist lists the domain itself or one of its blocked parents"""
+		return BLACKLIST_KEY in self.listedBy or any(BLACKLIST_KEY in listedBy for (_, listedBy) in self.parents)
+
+	def getVerdict(self) -> str:
+		if len(self.listedBy) > 0 and self.whitelistRule is None:
+			return "blocked by blacklist" if self.blacklisted else "blocked"
+		if len(self.parents) > 0:
+			# the whitelist only removes the domain's own entry, a blocked parent still covers it
+			return "blocked via parent by blacklist" if self.blacklisted else "blocked via parent"
+		if len(self.listedBy) > 0:
+			return "whitelisted"
+		return "not listed"
+
+	def describe(self) -> str:
+		details = []
+		if len(self.listedBy) > 0:
+			details.append("listed by {}".format(describeListers(self.listedBy)))
+		for parent, listedBy in self.parents:
+			details.append("parent {} listed by {} (blocks subdomains on unbound, bind and rpz)".format(parent, describeListers(listedBy)))
+		if self.whitelistRule is not None:
+			details.append("whitelist rule {}".format(self.whitelistRule))
+		return "\t".join([self.domain, self.getVerdict()] + details)
+
+
+def describeListers(listedBy: List[str]) -> str:
+	"""the sources that listed a domain, naming the blacklist as such rather than as if it were a source"""
+	return ", ".join("the blacklist ({})".format(name) if name == BLACKLIST_KEY else name for name in listedBy)
+
+
+def lookupDomains(index: SourceIndex, domains: List[str]) -> List[LookupResult]:
+	"""looks up every domain and all of its parents in one batch"""
+	domains = [normalizeQuery(domain) for domain in domains]
+	whitelistIndex = WhitelistIndex(index.getWhitelist())
+	candidates = set(domains)
+	for domain in domains:
+		candidates.update(getParentDomains(domain))
+	found = index.findSources(candidates)
+	results = []
+	for domain in domains:
+		# a whitelisted parent was left out of the output, so it blocks nothing
+		parents = [(parent, found[parent]) for parent in getParentDomains(domain) if parent in found and whitelistIndex.findRule(parent) is None]
+		results.append(LookupResult(domain, found.get(domain, []), parents, whitelistIndex.findRule(domain)))
+	return results
+
+
+def lookup(args: List[str]):
+	(domains, options) = parseOptions(args)
+	if options.indexPath is None:
+		raise UsageError("lookup requires --index, the file written by a run with --index")
+	if options.domainsPath is not None:
+		domains.extend(readLines(options.domainsPath))
+	if len(domains) == 0:
+		raise UsageError("lookup requires at least one domain, or --domains=FILE")
+	with SourceIndex(options.indexPath) as index:
+		results = lookupDomains(index, domains)
+	writeLinesToStdOut(result.describe() for result in results)
+
+
+def writeReports(report, options):
+	if options.reportPath is not None:
+		report.writeJson(options.reportPath)
+		printError("report written to {}".format(os.path.abspath(options.reportPath)))
+	if options.prometheusPath is not None:
+		report.writePrometheus(options.prometheusPath)
+		printError("metrics written to {}".format(os.path.abspath(options.prometheusPath)))
+
+
+def process(targets: List[Target], options):
+	for target in targets:
+		printError("using {}".format(target.serverFormatter.name))
+	report = RunReport(options.traceMemory)
+	cache = SourceCache(options.cacheDirectory) if options.cacheDirectory is not None else None
+	archive = None
+	if options.archiveDirectory is not None:
+		archive = SourceArchive(options.archiveDirectory, options.maxArchiveAge * 3600)
+	deltaWriter = None
+	if options.deltaDirectory is not None:
+		deltaWriter = DeltaWriter(options.deltaDirectory, ControlRunner() if options.applyDelta else None)
+	publisher = Publisher() if options.serveAddress is not None else None
+	server = startServer(publisher, *options.serveAddress) if publisher is not None else None
+	if options.stream:
+		memoryBudget = options.memoryBudget * 1024 * 1024 if options.memoryBudget is not None else None
+		processStreaming(targets[0], cache, report, memoryBudget, createDownloadPolicy(options), openCircuitBreaker(options))
 	else:
-		printError("no domains saving via whitelisting")
-	formattedForServer = serverFormatter.format(uniqueLines)
-	writeLines(formattedForServer, filename)
+		with ParsePool(options.parseProcesses) if options.parseProcesses is not None else contextlib.nullcontext() as parsePool:
+			if options.daemon:
+				processDaemon(targets, options, cache, deltaWriter, parsePool, archive, publisher)
+			elif options.storePath is not None:
+				processIncremental(targets, options, cache, report, deltaWriter, parsePool, archive)
+			else:
+				processInMemory(targets, options, cache, report, deltaWriter, parsePool, archive)
+	if not options.daemon:
+		writeReports(report, options)
+		publishTargets(targets, publisher)
+	if server is not None:
+		if not options.daemon:
+			printError("serving until stopped")
+			createStopEvent().wait()
+		server.shutdown()
+
+
+class Options:
+	"""settings given on the command line as --name or --name=value"""
+
+	def __init__(self) -> None:
+		self.workers = 1
+		self.connectionsPerHost = DEFAULT_CONNECTIONS_PER_HOST
+		self.cacheDirectory = None
+		self.collapse = False
+		self.sort = False
+		self.overwrite = False
+		self.daemon = False
+		self.refreshInterval = DEFAULT_REFRESH_INTERVAL
+		self.serveAddress = None
+		self.hostsPerLine = 1
+		self.dnsmasqDirective = DNSMASQ_DIRECTIVES[0]
+		self.stream = False
+		self.reportPath = None
+		self.prometheusPath = None
+		self.traceMemory = False
+		self.storePath = None
+		self.deltaDirectory = None
+		self.applyDelta = False
+		self.rpzZone = DEFAULT_RPZ_ZONE
+		self.snapshotPath = None
+		self.bloomPath = None
+		self.bloomFalsePositiveRate = DEFAULT_FALSE_POSITIVE_RATE
+		self.indexPath = None
+		self.domainsPath = None
+		self.memoryBudget = None
+		self.parseProcesses = None
+		self.archiveDirectory = None
+		self.maxArchiveAge = DEFAULT_MAX_ARCHIVE_AGE
+		self.offline = False
+		self.connectTimeout = DEFAULT_CONNECT_TIMEOUT
+		self.readTimeout = DEFAULT_READ_TIMEOUT
+		self.downloadTimeout = DEFAULT_DOWNLOAD_TIMEOUT
+		self.retries = DEFAULT_RETRIES
+		self.breakerPath = None
+
+
+def parsePositiveInt(name: str, value: str) -> int:
+	try:
+		number = int(value)
+	except ValueError:
+		raise UsageError("{} requires a whole number".format(name))
+	if number < 1:
+		raise UsageError("{} must be at least 1".format(name))
+	return number
+
+
+def parseCount(name: str, value: str) -> int:
+	"""a whole number that may be 0"""
+	try:
+		number = int(value)
+	except ValueError:
+		raise UsageError("{} requires a whole number".format(name))
+	if number < 0:
+		raise UsageError("{} must not be negative".format(name))
+	return number
+
+
+def parseSeconds(name: str, value: str) -> float:
+	try:
+		seconds = float(value)
+	except ValueError:
+		raise UsageError("{} requires a number of seconds".format(name))
+	if not seconds > 0:
+		raise UsageError("{} must be more than 0".format(name))
+	return seconds
+
+
+def parseProcessCount(name: str, value: str) -> int:
+	"""a number of processes, or one for every core if no number is given"""
+	if len(value) == 0:
+		return os.cpu_count() or 1
+	return parsePositiveInt(name, value)
+
+
+def parseServeAddress(name: str, value: str) -> Tuple[str, int]:
+	"""[HOST:]PORT, where no host means every interface and no port means the default"""
+	(host, _, port) = value.rpartition(":")
+	if len(port) == 0:
+		return (host, DEFAULT_SERVE_PORT)
+	if not port.isdigit() or not 0 < int(port) < 65536:
+		raise UsageError("{} requires a port number, e.g. {}=8080 or {}=127.0.0.1:8080".format(name, name, name))
+	return (host, int(port))
+
+
+def parseHostsPerLine(name: str, value: str) -> int:
+	count = parsePositiveInt(name, value)
+	if count > MAX_HOSTS_PER_LINE:
+		raise UsageError("{} can be at most {}, the most Windows reads from one line".format(name, MAX_HOSTS_PER_LINE))
+	return count
+
+
+def parseDnsmasqDirective(name: str, value: str) -> str:
+	if value not in DNSMASQ_DIRECTIVES:
+		raise UsageError("{} must be one of {}".format(name, ", ".join(DNSMASQ_DIRECTIVES)))
+	return value
+
+
+def parseRate(name: str, value: str) -> float:
+	try:
+		rate = float(value)
+	except ValueError:
+		raise UsageError("{} requires a number".format(name))
+	if not 0 < rate < 1:
+		raise UsageError("{} must be more than 0 and less than 1".format(name))
+	return rate
+
+
+def parsePath(name: str, value: str) -> str:
+	if len(value) == 0:
+		raise UsageError("{} requires a path".format(name))
+	return value
+
+
+def parseName(name: str, value: str) -> str:
+	if len(value) == 0:
+		raise UsageError("{} requires a name".format(name))
+	return value
+
+
+# maps each option to the Options attribute it sets, and how to parse its value (None for flags)
+optionParsers = {
+	"--workers": ("workers", parsePositiveInt),
+	"--connections-per-host": ("connectionsPerHost", parsePositiveInt),
+	"--cache": ("cacheDirectory", parsePath),
+	"--collapse": ("collapse", None),
+	"--sort": ("sort", None),
+	"--overwrite": ("overwrite", None),
+	"--daemon": ("daemon", None),
+	"--refresh-interval": ("refreshInterval", parsePositiveInt),
+	"--serve": ("serveAddress", parseServeAddress),
+	"--hosts-per-line": ("hostsPerLine", parseHostsPerLine),
+	"--dnsmasq-directive": ("dnsmasqDirective", parseDnsmasqDirective),
+	"--stream": ("stream", None),
+	"--report": ("reportPath", parsePath),
+	"--prometheus": ("prometheusPath", parsePath),
+	"--trace-memory": ("traceMemory", None),
+	"--incremental": ("storePath", parsePath),
+	"--delta": ("deltaDirectory", parsePath),
+	"--apply-delta": ("applyDelta", None),
+	"--rpz-zone": ("rpzZone", parseName),
+	"--snapshot": ("snapshotPath", parsePath),
+	"--bloom": ("bloomPath", parsePath),
+	"--bloom-fp-rate": ("bloomFalsePositiveRate", parseRate),
+	"--index": ("indexPath", parsePath),
+	"--domains": ("domainsPath", parsePath),
+	"--memory-budget": ("memoryBudget", parsePositiveInt),
+	"--parse-processes": ("parseProcesses", parseProcessCount),
+	"--archive": ("archiveDirectory", parsePath),
+	"--max-archive-age": ("maxArchiveAge", parsePositiveInt),
+	"--offline": ("offline", None),
+	"--connect-timeout": ("connectTimeout", parseSeconds),
+	"--read-timeout": ("readTimeout", parseSeconds),
+	"--download-timeout": ("downloadTimeout", parseSeconds),
+	"--retries": ("retries", parseCount),
+	"--circuit-breaker": ("breakerPath", parsePath),
+}
+
+
+def parseOptions(args):
+	positional: List[str] = []
+	options = Options()
+	for arg in args:
+		if not arg.startswith("--"):
+			positional.append(arg)
+			continue
+		(name, _, value) = arg.partition("=")
+		if name not in optionParsers:
+			raise UsageError("unknown option: {}".format(name))
+		(attribute, parser) = optionParsers[name]
+		setattr(options, attribute, True if parser is None else parser(name, value))
+	return (positional, options)
+
+
+def checkOutputPath(filename: str, options) -> str:
+	"""with --overwrite or --delta the output is expected to be rewritten every run"""
+	if os.path.exists(filename) and not options.overwrite and options.deltaDirectory is None:
+		raise FileExistsError(filename)
+	if not isCompressionAvailable(getCompression(filename)):
+		raise UsageError("writing {} needs the zstandard package (pip install zstandard)".format(filename))
+	return filename
+
+
+def parseTarget(arg: str, options) -> Target:
+	"""parses a type=path target, e.g. unbound=blackhole.txt"""
+	(serverType, _, filename) = arg.partition("=")
+	if len(filename) == 0:
+		raise UsageError("target {} requires a path, e.g. {}=output.txt".format(arg, serverType))
+	return Target(
+		determineServerFormatter(serverType, options.rpzZone, options.hostsPerLine, options.dnsmasqDirective), checkOutputPath(filename, options)
+	)
+
+
+def parseTargets(args: List[str], options) -> List[Target]:
+	"""either type=path targets, or a server type followed by an optional filename"""
+	if not any("=" in arg for arg in args):
+		filename = checkOutputPath(args[1], options) if len(args) >= 2 else None
+		return [Target(determineServerFormatter(args[0], options.rpzZone, options.hostsPerLine, options.dnsmasqDirective), filename)]
+	if not all("=" in arg for arg in args):
+		raise UsageError("targets must all be given as type=path")
+	targets = [parseTarget(arg, options) for arg in args]
+	filenames = [os.path.abspath(target.filename) for target in targets]
+	if len(set(filenames)) != len(filenames):
+		raise UsageError("each target must be written to a different file")
+	deltaNames = [target.deltaName for target in targets]
+	if options.deltaDirectory is not None and len(set(deltaNames)) != len(deltaNames):
+		raise UsageError("with --delta, each target's file must have a different name")
+	return targets
 
 
 def parseArguments(args):
+	(args, options) = parseOptions(args)
 	if len(args) < 1:
 		print(getUsage())
 		raise UsageError("too few arguments")
-	serverFormatter = determineServerFormatter(args[0])
-	if len(args) >= 2:
-		if os.path.exists(args[1]):
-			raise FileExistsError(args[1])
-		filename = args[1]
-	else:
-		filename = None
-	return (serverFormatter, filename)
-
-
-def printError(message: str):
-	print(message, file=sys.stderr)
+	if options.memoryBudget is not None:
+		# only streaming avoids holding every line at once
+		options.stream = True
+	if options.daemon:
+		# a daemon rewrites its outputs whenever the domains change
+		options.overwrite = True
+	if options.daemon and (options.stream or options.storePath is not None or options.indexPath is not None or options.offline):
+		raise UsageError("--daemon keeps every domain in memory, so it cannot be used with --stream, --incremental, --index or --offline")
+	if options.stream and options.collapse:
+		raise UsageError("--collapse needs every domain at once, so it cannot be used with --stream")
+	if options.stream and options.sort:
+		raise UsageError("--sort needs every domain at once, so it cannot be used with --stream")
+	if options.stream and options.storePath is not None:
+		raise UsageError("--incremental keeps every domain in its store, so it cannot be used with --stream")
+	if options.stream and options.deltaDirectory is not None:
+		raise UsageError("--delta compares every domain with the previous run, so it cannot be used with --stream")
+	if options.stream and options.snapshotPath is not None:
+		raise UsageError("--snapshot sorts every domain at once, so it cannot be used with --stream")
+	if options.stream and options.bloomPath is not None:
+		raise UsageError("--bloom is sized from the number of domains, so it cannot be used with --stream")
+	if options.offline and options.archiveDirectory is None:
+		raise UsageError("--offline builds from the last known good copies, so it requires --archive")
+	if options.stream and options.archiveDirectory is not None:
+		raise UsageError("--stream can't fall back once a source has started streaming, so it cannot be used with --archive")
+	if options.stream and options.parseProcesses is not None:
+		raise UsageError("--stream parses each line as it arrives, so it cannot be used with --parse-processes")
+	if options.indexPath is not None and (options.stream or options.storePath is not None):
+		raise UsageError("--index is built from every source's domains at once, so it cannot be used with --stream or --incremental")
+	if options.applyDelta and options.deltaDirectory is None:
+		raise UsageError("--apply-delta requires --delta")
+	targets = parseTargets(args, options)
+	if options.stream and len(targets) > 1:
+		raise UsageError("--stream writes a single target, so it cannot be used with more than one")
+	if options.daemon and any(target.filename is None for target in targets):
+		raise UsageError("--daemon writes its outputs again and again, so every target needs a file")
+	if options.serveAddress is not None and any(target.filename is None for target in targets):
+		raise UsageError("--serve publishes the output files, so every target needs a file")
+	servedNames = [os.path.basename(target.filename) for target in targets if target.filename is not None]
+	if options.serveAddress is not None and len(set(servedNames)) != len(servedNames):
+		raise UsageError("--serve publishes each output by its file name, so their names must differ")
+	return (targets, options)
 
 
 def getUsage():
 	return """USAGE:
-first argument is DNS server type (REQUIRED): unbound, bind, winhosts
-second argument is output filename (OPTIONAL) """
+first argument is DNS server type (REQUIRED): unbound, bind, winhosts, rpz, dnsmasq
+second argument is output filename (OPTIONAL)
+
+or, to write several outputs from one download, any number of type=path targets:
+unbound=blackhole.txt bind=named.conf.local winhosts=hosts
+
+or, to see why domains are or aren't blocked: lookup DOMAIN... --index=FILE [--domains=FILE]
+
+OPTIONS:
+--workers=N                 download up to N sources at once (default 1)
+--connections-per-host=N    open at most N connections to any one host (default {})
+--cache=DIR                 keep downloaded sources in DIR, and only download them again when they change
+--hosts-per-line=N          list up to N domains (at most {}) on each line of the Windows HOSTS file, which makes it smaller and quicker to load
+--dnsmasq-directive=NAME    write dnsmasq entries as address=/domain/ or local=/domain/ (default {})
+--collapse                  leave out subdomains of blocked domains (unbound, bind, rpz and dnsmasq)
+--daemon                    keep running, downloading each source again when it is due and rewriting the outputs when the domains change
+--refresh-interval=MINUTES  how often the daemon downloads a source whose server doesn't say how long it stays fresh (default {})
+--serve[=[HOST:]PORT]       serve the outputs over HTTP once built, until stopped (default port {}), e.g. for other resolvers to download
+--overwrite                 replace output files that already exist, leaving them as they are if nothing changed
+--sort                      write the domains in alphabetical order, so that outputs diff and sync well from run to run
+--stream                    download, filter and write one line at a time to save memory (downloads one source at a time)
+--report=FILE               write the time, data and memory used by each source and stage to FILE as JSON
+--prometheus=FILE           write the same figures to FILE for node_exporter's textfile collector
+--trace-memory              include each stage's peak Python memory in the report (slows the run down)
+--incremental=FILE          keep every source's domains in FILE, and only apply what changed since the last run (best with --cache)
+--delta=DIR                 also write the domains added and removed since the last run to DIR, and replace the output file
+--apply-delta               apply the delta to the running server (unbound-control, rndc, or nsupdate for rpz)
+--rpz-zone=NAME             the name the RPZ zone is loaded as, used by the delta (default {})
+--snapshot=FILE             also write the blocked domains to FILE in a compact binary format, for other tools to look up
+--bloom=FILE                also write the blocked domains to FILE as a Bloom filter, for tools that only need a probable answer
+--bloom-fp-rate=RATE        how often the Bloom filter may wrongly report a domain as listed (default {})
+--index=FILE                also write which sources listed each domain to FILE, for lookup
+--domains=FILE              with lookup, also look up every domain in FILE (one per line)
+--memory-budget=MB          remove duplicates on disk using about MB of memory, for lists too big to hold (implies --stream)
+--parse-processes[=N]       parse sources in N other processes (default one per core), splitting large sources into chunks
+--archive=DIR               keep every source's last good copy in DIR, and use it when the source fails to download
+--max-archive-age=HOURS     only use a last good copy that is at most HOURS old (default {})
+--offline                   build from the last good copies in --archive only, without using the network
+--connect-timeout=SECONDS   give up connecting to a source after SECONDS (default {})
+--read-timeout=SECONDS      give up on a source that sends nothing for SECONDS (default {})
+--download-timeout=SECONDS  give up on a source still sending after SECONDS, however steadily it sends (default {})
+--retries=N                 try a source that fails N more times, waiting a little longer each time (default {})
+--circuit-breaker=FILE      skip a source for {} hours after {} failed runs in a row, remembering the failures in FILE """.format(
+		DEFAULT_CONNECTIONS_PER_HOST,
+		MAX_HOSTS_PER_LINE,
+		DNSMASQ_DIRECTIVES[0],
+		DEFAULT_REFRESH_INTERVAL,
+		DEFAULT_SERVE_PORT,
+		DEFAULT_RPZ_ZONE,
+		DEFAULT_FALSE_POSITIVE_RATE,
+		DEFAULT_MAX_ARCHIVE_AGE,
+		DEFAULT_CONNECT_TIMEOUT,
+		DEFAULT_READ_TIMEOUT,
+		DEFAULT_DOWNLOAD_TIMEOUT,
+		DEFAULT_RETRIES,
+		DEFAULT_COOLDOWN // 3600,
+		DEFAULT_FAILURE_THRESHOLD,
+	)
 
 
 def main(args: List[str]):
 	try:
-		(serverFormatter, filename) = parseArguments(args)
-		process(serverFormatter, filename)
+		if len(args) > 0 and args[0] == "lookup":
+			lookup(args[1:])
+			return
+		(targets, options) = parseArguments(args)
+		process(targets, options)
 	except Exception as e:
 		logging.getLogger(__name__).exception(e)
 		sys.exit(-1)
@@ -0,0 +1,175 @@
+import os
+import io
+import stat
+import gzip
+import hashlib
+import itertools
+from typing import Optional
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+GZIP_LEVEL = 9
+# well past the point where higher levels cost far more time than they save bytes
+ZSTD_LEVEL = 12
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def getCompression(filename: str) -> Optional[str]:
+	"""how a file is compressed going by its extension, e.g. blackhole.txt.gz, or None for plain text"""
+	for extension, compression in COMPRESSIONS.items():
+		if filename.endswith(extension):
+			return compression
+	return None
+
+
+def isCompressionAvailable(compression: Optional[str]) -> bool:
+	return compression != "zstd" or zstandard is not None
+
+
+def createCompressor(file, compression: str):
+	"""
+	a binary stream that compresses what is written to it into file, and leaves file open when it is closed
+	gzip leaves the name and time out of its header, so the same lines always give the same bytes
+	"""
+	if compression == "gzip":
+		return gzip.GzipFile(filename="", mode="wb", fileobj=file, compresslevel=GZIP_LEVEL, mtime=0)
+	return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=False)
+
+
+def hashFile(path: str) -> bytes:
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+			digest.update(block)
+	return digest.digest()
+
+
+def openText(path: str, compression: Optional[str]):
+	"""reads back text written by AtomicOutputFile, unpacking it if it was compressed"""
+	if compression == "gzip":
+		return gzip.open(path, "rt", encoding="utf-8", errors="surrogateescape", newline="\n")
+	if compression == "zstd":
+		return io.TextIOWrapper(
+			zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8", errors="surrogateescape", newline="\n"
+		)
+	return open(path, "r", errors="surrogateescape")
+
+
+def isSameContent(first: str, second: str, compression: Optional[str] = None, ignoredPrefix: Optional[str] = None) -> bool:
+	"""
+	compares sizes first, so that only files that might be the same are hashed
+	with ignoredPrefix, compares the unpacked text line by line instead, leaving out lines that start with it in either file
+	"""
+	if ignoredPrefix is not None:
+		with openText(first, compression) as firstFile, openText(second, compression) as secondFile:
+			firstLines = (line for line in firstFile if not line.startswith(ignoredPrefix))
+			secondLines = (line for line in secondFile if not line.startswith(ignoredPrefix))
+			return all(firstLine == secondLine for (firstLine, secondLine) in itertools.zip_longest(firstLines, secondLines))
+	if os.path.getsize(first) != os.path.getsize(second):
+		return False
+	return hashFile(first) == hashFile(second)
+
+
+def copyOwnership(source: str, destination: str):
+	"""
+	gives destination the permissions of source, and its owner and group where allowed, before destination replaces it,
+	so that e.g. a root:bind 0640 include stays that way rather than taking the umask's
+	"""
+	status = os.stat(source)
+	if hasattr(os, "chown"):
+		try:
+			os.chown(destination, status.st_uid, status.st_gid)
+		except PermissionError:
+			# only root can give a file to another user, but anyone can give it a group they are in
+			try:
+				os.chown(destination, -1, status.st_gid)
+			except PermissionError:
+				pass
+	# after chown, which can clear the setuid and setgid bits
+	os.chmod(destination, stat.S_IMODE(status.st_mode))
+
+
+def syncDirectory(directory: str):
+	"""makes the rename itself survive a crash, where the platform allows opening a directory"""
+	if not hasattr(os, "O_DIRECTORY"):
+		return
+	descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+	try:
+		os.fsync(descriptor)
+	finally:
+		os.close(descriptor)
+
+
+class AtomicOutputFile:
+	"""
+	writes text to a temporary file beside filename, compressed if its extension asks for it,
+	then flushes it to disk and renames it over filename, so that a crash or a full disk never leaves half a file behind
+	if the new file has the same content as the old one, the old one is kept as it is and changed is false,
+	where lines starting with ignoredPrefix (such as a serial that changes every time) don't count
+	a file that is replaced keeps its permissions, and its owner and group where allowed
+	"""
+
+	def __init__(self, filename: str, bufferSize: int, ignoredPrefix: Optional[str] = None) -> None:
+		self._filename = filename
+		self._ignoredPrefix = ignoredPrefix
+		self._temporaryPath = filename + ".tmp"
+		self._bufferSize = bufferSize
+		self._file = None
+		self._compressor = None
+		self._text = None
+		self._changed = False
+
+	@property
+	def filename(self) -> str:
+		return self._filename
+
+	@property
+	def changed(self) -> bool:
+		return self._changed
+
+	def __enter__(self):
+		compression = getCompression(self._filename)
+		self._file = open(self._temporaryPath, "wb", buffering=self._bufferSize)
+		if compression is None:
+			# the same as open(filename, "w") would give
+			self._text = io.TextIOWrapper(self._file)
+		else:
+			self._compressor = createCompressor(self._file, compression)
+			self._text = io.TextIOWrapper(self._compressor, encoding="utf-8", newline="\n")
+		return self._text
+
+	def finish(self, keep: bool):
+		"""flushes every layer down to the temporary file, and on to the disk if it is going to be kept"""
+		try:
+			self._text.flush()
+			self._text.detach()
+			if self._compressor is not None:
+				self._compressor.close()
+			self._file.flush()
+			if keep:
+				os.fsync(self._file.fileno())
+		finally:
+			self._file.close()
+
+	def __exit__(self, exceptionType, *args):
+		try:
+			self.finish(exceptionType is None)
+		except BaseException:
+			os.remove(self._temporaryPath)
+			raise
+		if exceptionType is not None:
+			os.remove(self._temporaryPath)
+			return
+		if os.path.exists(self._filename):
+			if isSameContent(self._temporaryPath, self._filename, getCompression(self._filename), self._ignoredPrefix):
+				os.remove(self._temporaryPath)
+				return
+			copyOwnership(self._filename, self._temporaryPath)
+		os.replace(self._temporaryPath, self._filename)
+		syncDirectory(os.path.dirname(os.path.abspath(self._filename)))
+		self._changed = True
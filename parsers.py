@@ -0,0 +1,118 @@
+import re
+from typing import Callable, List, Optional
+
+
+# the kinds of list a source publishes, which decide how its lines are parsed
+PLAIN = "plain"  # one domain per line
+HOSTS = "hosts"  # "0.0.0.0 domain", or one domain per line
+HOSTS_WITH_COMMENTS = "hosts with comments"  # "0.0.0.0 domain #comment", skipping anything mentioning localhost
+
+
+class Trigger:
+	"""
+	something that makes a line behave differently under normalize, isValid and format than under transformLines
+	isPresent is a cheap test of the whole payload, so that the pattern is only searched for when needed
+	"""
+
+	def __init__(self, isPresent: Callable[[bytes], bool], pattern: bytes) -> None:
+		self._isPresent = isPresent
+		self._pattern = pattern
+
+	@property
+	def pattern(self) -> bytes:
+		return self._pattern
+
+	def isPresent(self, payload: bytes) -> bool:
+		return self._isPresent(payload)
+
+
+# isValid rejects localhost, and MVPS.format drops anything mentioning it
+LOCALHOST = Trigger(lambda payload: b"localhost" in payload, rb"localhost")
+# isValid rejects double dots, unless normalize removed one of them
+DOUBLE_DOTS = Trigger(lambda payload: b".." in payload, rb"\.\.")
+# format removes every '0.0.0.0 ', transformLines only removes it from the start of a line
+INNER_HOSTS_PREFIX = Trigger(lambda payload: payload.count(b"0.0.0.0 ") != payload.count(b"\n0.0.0.0 "), rb"(?<!\n)0\.0\.0\.0 ")
+# format turns '0.0.0.0 ' on its own (or followed by a comment, for MVPS) into an empty line, which transformLines would drop
+EMPTY_HOSTS_ENTRY = Trigger(
+	lambda payload: b"\n0.0.0.0 \n" in payload or b"\n0.0.0.0 .\n" in payload or b"\n0.0.0.0 #" in payload,
+	rb"(?<=\n)0\.0\.0\.0 (?=\.?\n|#)",
+)
+
+# dialect -> (what transformLines can't handle, whether format removes '0.0.0.0 ', whether format cuts lines at '#')
+dialects = {
+	PLAIN: ([LOCALHOST, DOUBLE_DOTS], False, False),
+	HOSTS: ([LOCALHOST, DOUBLE_DOTS, INNER_HOSTS_PREFIX, EMPTY_HOSTS_ENTRY], True, False),
+	HOSTS_WITH_COMMENTS: ([LOCALHOST, DOUBLE_DOTS, INNER_HOSTS_PREFIX, EMPTY_HOSTS_ENTRY], True, True),
+}
+
+_commentLines = re.compile(rb"\n#[^\n]*")
+_comments = re.compile(rb"#[^\n]*")
+# str.splitlines treats these as line breaks too, bytes.split doesn't
+_unusualLineBreaks = re.compile(rb"[\r\v\f\x1c\x1d\x1e]")
+_asciiSample = "#.0 az\n"
+
+
+def isAsciiCompatible(encoding: Optional[str]) -> bool:
+	"""true if the encoding decodes plain ASCII to itself, unlike e.g. UTF-16"""
+	if encoding is None:
+		return True
+	try:
+		return _asciiSample.encode("ascii").decode(encoding) == _asciiSample
+	except (LookupError, UnicodeDecodeError):
+		return False
+
+
+def findTriggeredLines(payload: bytes, triggers: List[Trigger]) -> List[tuple]:
+	"""returns the (start, end) of every line containing a trigger, in order"""
+	present = [trigger.pattern for trigger in triggers if trigger.isPresent(payload)]
+	if len(present) == 0:
+		return []
+	lines = []
+	for match in re.finditer(b"|".join(present), payload):
+		start = payload.rfind(b"\n", 0, match.start()) + 1
+		if len(lines) > 0 and lines[-1][0] == start:
+			continue
+		lines.append((start, payload.find(b"\n", match.start())))
+	return lines
+
+
+def transformLines(segment: bytes, removeHostsPrefix: bool, cutComments: bool) -> List[str]:
+	"""
+	does to every line of the segment at once what normalize, isValid and format do line by line
+	the segment must start and end with a newline, and contain no triggered lines
+	"""
+	segment = segment.replace(b".\n", b"\n").replace(b"\n.", b"\n")
+	hasComments = b"#" in segment
+	if hasComments:
+		segment = _commentLines.sub(b"", segment)
+	if removeHostsPrefix:
+		segment = segment.replace(b"\n0.0.0.0 ", b"\n")
+	if cutComments and hasComments:
+		segment = _comments.sub(b"", segment)
+	return list(filter(None, segment.decode("ascii").split("\n")))
+
+
+def parsePayload(
+	payload: bytes, encoding: Optional[str], dialect: Optional[str], parseLines: Callable[[List[str]], List[str]]
+) -> Optional[List[str]]:
+	"""
+	normalizes, validates and formats a whole downloaded list with a handful of passes over its bytes, instead of line by line
+	lines that transformLines can't handle exactly are found up front and given to parseLines,
+	the original parser (normalize, isValid, then the source's format)
+	returns None when the payload can't be parsed this way (no dialect, non-ASCII text, unusual line breaks)
+	otherwise the result is identical to parseLines(payload.decode(encoding).splitlines())
+	"""
+	if dialect not in dialects or not payload.isascii() or not isAsciiCompatible(encoding):
+		return None
+	(triggers, removeHostsPrefix, cutComments) = dialects[dialect]
+	payload = b"\n" + payload.lower().replace(b"\r\n", b"\n") + b"\n"
+	if _unusualLineBreaks.search(payload):
+		return None
+	parsed: List[str] = []
+	segmentStart = 0
+	for lineStart, lineEnd in findTriggeredLines(payload, triggers):
+		parsed.extend(transformLines(payload[segmentStart:lineStart], removeHostsPrefix, cutComments))
+		parsed.extend(parseLines([payload[lineStart:lineEnd].decode("ascii")]))
+		segmentStart = lineEnd
+	parsed.extend(transformLines(payload[segmentStart:], removeHostsPrefix, cutComments))
+	return parsed
@@ -1,9 +1,39 @@
 import os
 import sys
+import time
 import logging
+import itertools
+import contextlib
 import requests
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple, Dict, Callable
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import gzip
+import json
+import hashlib
+from email.utils import parsedate_to_datetime, formatdate
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import subprocess
+import sqlite3
+from urllib.request import pathname2url
+import mmap
+import struct
+import math
+import heapq
+import tempfile
+import re
+import io
+import random
+import multiprocessing
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+from urllib.parse import urlparse, unquote
+from abc import ABC, abstractmethod
+import stat
+import signal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 
 class UnknownServerTypeError(Exception):
@@ -121,6 +151,1395 @@ class LocalhostFoundError(Exception):
 		return self.message
 
 
+class ControlCommandError(Exception):
+	"""Raised when a server's control command (e.g. unbound-control) fails"""
+
+	def __init__(self, command, output) -> None:
+		self._message = "'{}' failed: {}".format(" ".join(command), output.strip())
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class SnapshotFormatError(Exception):
+	"""Raised when a file is not a domain snapshot, or is truncated"""
+
+	def __init__(self, filename) -> None:
+		self._message = "not a domain snapshot: {}".format(filename)
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class BloomFilterFormatError(Exception):
+	"""Raised when a file is not a Bloom filter of domains, or is truncated"""
+
+	def __init__(self, filename) -> None:
+		self._message = "not a domain Bloom filter: {}".format(filename)
+		super().__init__(self.message)
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class CircuitOpenError(Exception):
+	"""Raised instead of downloading a source that has failed too many runs in a row, until its cooldown is over"""
+
+	def __init__(self, source, failures, openUntil) -> None:
+		self._source = source
+		self._message = "skipped after {} failed runs in a row, next try after {}".format(
+			failures, time.strftime("%Y-%m-%d %H:%M", time.localtime(openUntil))
+		)
+		super().__init__(self.message)
+
+	@property
+	def source(self):
+		return self._source
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+class DownloadTimeoutError(Exception):
+	"""Raised when a source is still sending after the whole download was meant to be over, however steadily it sends"""
+
+	def __init__(self, source, seconds) -> None:
+		self._source = source
+		self._message = "{} (still downloading after {} seconds)".format(source, seconds)
+		super().__init__(self.message)
+
+	@property
+	def source(self):
+		return self._source
+
+	@property
+	def message(self):
+		return self._message
+
+	def __str__(self) -> str:
+		return self.message
+
+
+def printError(message: str):
+	print(message, file=sys.stderr)
+
+
+class CacheEntry:
+	"""the validators sent by the server for a source, and the source's already formatted lines"""
+
+	def __init__(self, etag: Optional[str], lastModified: Optional[str], lines: List[str]) -> None:
+		self._etag = etag
+		self._lastModified = lastModified
+		self._lines = lines
+
+	@property
+	def etag(self) -> Optional[str]:
+		return self._etag
+
+	@property
+	def lastModified(self) -> Optional[str]:
+		return self._lastModified
+
+	@property
+	def lines(self) -> List[str]:
+		return self._lines
+
+	def isConditional(self) -> bool:
+		return self.etag is not None or self.lastModified is not None
+
+
+class SourceCache:
+	"""keeps one JSON file per source in a directory, so unchanged sources can be fetched with a conditional GET"""
+
+	def __init__(self, directory: str) -> None:
+		self._directory = directory
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	def pathFor(self, source) -> str:
+		key = hashlib.sha1(source.url.encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, "{}.json".format(key))
+
+	def load(self, source) -> Optional[CacheEntry]:
+		"""returns None if the source has not been cached, or the cache file is unusable"""
+		try:
+			with open(self.pathFor(source), "r", encoding="utf-8") as file:
+				stored = json.load(file)
+		except (OSError, ValueError):
+			return None
+		if stored.get("url") != source.url:
+			return None
+		return CacheEntry(stored.get("etag"), stored.get("lastModified"), stored.get("lines", []))
+
+	def save(self, source, entry: CacheEntry):
+		"""writes to a temporary file first so that a crash never leaves a half-written entry behind"""
+		path = self.pathFor(source)
+		temporaryPath = path + ".tmp"
+		stored = {
+			"url": source.url,
+			"etag": entry.etag,
+			"lastModified": entry.lastModified,
+			"lines": entry.lines,
+		}
+		with open(temporaryPath, "w", encoding="utf-8") as file:
+			json.dump(stored, file)
+		os.replace(temporaryPath, path)
+
+
+class MemoryCache:
+	"""like SourceCache, but only for as long as the process runs"""
+
+	def __init__(self) -> None:
+		self._entries: Dict[str, CacheEntry] = {}
+
+	def load(self, source) -> Optional[CacheEntry]:
+		return self._entries.get(source.url)
+
+	def save(self, source, entry: CacheEntry):
+		self._entries[source.url] = entry
+
+
+class SourceArchive:
+	"""
+	keeps the last successfully parsed lines of each source, gzip compressed, to fall back on when a download fails
+	a file's modification time is when its source was last known to be good
+	"""
+
+	def __init__(self, directory: str, maxAge: Optional[float] = None) -> None:
+		self._directory = directory
+		self._maxAge = maxAge
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	@property
+	def maxAge(self) -> Optional[float]:
+		"""in seconds, None for no limit"""
+		return self._maxAge
+
+	def pathFor(self, source) -> str:
+		key = hashlib.sha1(source.url.encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, "{}.txt.gz".format(key))
+
+	def getAge(self, source) -> Optional[float]:
+		"""seconds since the source was last known to be good, or None if it never was"""
+		try:
+			return max(time.time() - os.path.getmtime(self.pathFor(source)), 0.0)
+		except OSError:
+			return None
+
+	def save(self, source, lines: List[str]):
+		path = self.pathFor(source)
+		temporaryPath = path + ".tmp"
+		with gzip.open(temporaryPath, "wt", encoding="utf-8", newline="\n") as file:
+			for line in lines:
+				file.write(line)
+				file.write("\n")
+		os.replace(temporaryPath, path)
+
+	def confirm(self, source, lines: List[str]):
+		"""records that the source is still good, e.g. after the server said it hasn't changed"""
+		if self.getAge(source) is None:
+			self.save(source, lines)
+		else:
+			os.utime(self.pathFor(source))
+
+	def load(self, source, ignoreAge: bool = False) -> Optional[List[str]]:
+		"""returns None if there is no copy, it is unreadable, or it is older than maxAge"""
+		age = self.getAge(source)
+		if age is None or (not ignoreAge and self.maxAge is not None and age > self.maxAge):
+			return None
+		try:
+			with gzip.open(self.pathFor(source), "rt", encoding="utf-8", newline="\n") as file:
+				return file.read().split("\n")[:-1]
+		except (OSError, EOFError, UnicodeDecodeError):
+			return None
+
+
+def parseHttpDate(value: Optional[str]) -> Optional[float]:
+	try:
+		return parsedate_to_datetime(value).timestamp()
+	except (TypeError, ValueError):
+		return None
+
+
+def getFreshness(headers) -> Optional[float]:
+	"""
+	how many seconds a response stays fresh, going by Cache-Control: max-age or else Expires
+	0 if it must not be reused without asking again, or None if the server didn't say
+	"""
+	directives = [directive.strip().lower() for directive in headers.get("Cache-Control", "").split(",")]
+	if "no-cache" in directives or "no-store" in directives:
+		return 0.0
+	for directive in directives:
+		(name, _, value) = directive.partition("=")
+		if name == "max-age":
+			try:
+				return max(float(value.strip('"')), 0.0)
+			except ValueError:
+				return None
+	expires = parseHttpDate(headers.get("Expires"))
+	if expires is None:
+		# an Expires that isn't a date, such as 0, means already expired
+		return 0.0 if "Expires" in headers else None
+	date = parseHttpDate(headers.get("Date"))
+	return max(expires - (date if date is not None else time.time()), 0.0)
+
+
+def createConditionalHeaders(entry: Optional[CacheEntry]) -> dict:
+	headers = {}
+	if entry is None:
+		return headers
+	if entry.etag is not None:
+		headers["If-None-Match"] = entry.etag
+	if entry.lastModified is not None:
+		headers["If-Modified-Since"] = entry.lastModified
+	return headers
+
+
+try:
+	import resource
+except ImportError:  # not available on Windows
+	resource = None
+
+
+def getPeakRss() -> Optional[int]:
+	"""peak resident set size of this process in bytes, or None where it can't be measured"""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS reports bytes
+	return peak if sys.platform == "darwin" else peak * 1024
+
+
+def getCurrentRss() -> Optional[int]:
+	"""resident set size of this process right now in bytes, or None where it can't be measured (only Linux has /proc)"""
+	try:
+		with open("/proc/self/statm", "r") as file:
+			residentPages = int(file.read().split()[1])
+	except (OSError, ValueError, IndexError):
+		return None
+	return residentPages * os.sysconf("SC_PAGE_SIZE")
+
+
+class SourceStatistics:
+	"""filled in while a single source is downloaded and parsed"""
+
+	def __init__(self) -> None:
+		self.seconds = 0.0
+		self.bytesDownloaded = 0
+		self.linesIn = 0
+		self.linesOut = 0
+		self.notModified = False
+		self.failed = False
+		self.fromArchive = False
+		# seconds the server said the source stays fresh, if it said
+		self.freshFor: Optional[float] = None
+
+	def toDict(self) -> dict:
+		return {
+			"seconds": self.seconds,
+			"bytesDownloaded": self.bytesDownloaded,
+			"linesIn": self.linesIn,
+			"linesOut": self.linesOut,
+			"notModified": self.notModified,
+			"failed": self.failed,
+			"fromArchive": self.fromArchive,
+			"freshFor": self.freshFor,
+		}
+
+
+class StageStatistics:
+	def __init__(self, name: str) -> None:
+		self.name = name
+		self.seconds = 0.0
+		self.linesIn: Optional[int] = None
+		self.linesOut: Optional[int] = None
+		self.rssBefore: Optional[int] = None
+		self.rssAfter: Optional[int] = None
+		# the process's peak so far when the stage ended, which later stages repeat
+		self.peakRss: Optional[int] = None
+		# how much the stage raised the process's peak, which is 0 for every stage but those that set a new one
+		self.peakRssGrowth: Optional[int] = None
+		# None if another stage ran at the same time, as Python only traces one peak for the whole process
+		self.peakTracedBytes: Optional[int] = None
+		self.overlapped = False
+
+	def toDict(self) -> dict:
+		return {
+			"name": self.name,
+			"seconds": self.seconds,
+			"linesIn": self.linesIn,
+			"linesOut": self.linesOut,
+			"rssBefore": self.rssBefore,
+			"rssAfter": self.rssAfter,
+			"peakRss": self.peakRss,
+			"peakRssGrowth": self.peakRssGrowth,
+			"peakTracedBytes": self.peakTracedBytes,
+		}
+
+
+class RunReport:
+	"""records the time, data and memory used by each source and each stage of a run"""
+
+	def __init__(self, traceMemory: bool = False) -> None:
+		self._traceMemory = traceMemory
+		self._startedAt = time.time()
+		self._startedCounter = time.perf_counter()
+		self._stages: List[StageStatistics] = []
+		self._sources: Dict[str, SourceStatistics] = {}
+		self._activeStages: List[StageStatistics] = []
+		self._lock = threading.Lock()
+		if traceMemory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	@property
+	def stages(self) -> List[StageStatistics]:
+		return self._stages
+
+	@property
+	def sources(self) -> Dict[str, SourceStatistics]:
+		return self._sources
+
+	@contextmanager
+	def stage(self, name: str, linesIn: Optional[int] = None):
+		"""
+		times the body of a with block, which may set linesOut on the yielded StageStatistics
+		stages may run at the same time in different threads, e.g. one per target
+		"""
+		statistics = StageStatistics(name)
+		statistics.linesIn = linesIn
+		statistics.rssBefore = getCurrentRss()
+		peakBefore = getPeakRss()
+		with self._lock:
+			# the traced peak is only reset when no other stage is measuring it
+			if self._traceMemory and len(self._activeStages) == 0:
+				tracemalloc.reset_peak()
+			for active in self._activeStages:
+				active.overlapped = True
+			statistics.overlapped = len(self._activeStages) > 0
+			self._activeStages.append(statistics)
+		start = time.perf_counter()
+		try:
+			yield statistics
+		finally:
+			statistics.seconds = time.perf_counter() - start
+			statistics.rssAfter = getCurrentRss()
+			statistics.peakRss = getPeakRss()
+			if peakBefore is not None and statistics.peakRss is not None:
+				statistics.peakRssGrowth = statistics.peakRss - peakBefore
+			with self._lock:
+				self._activeStages.remove(statistics)
+				if self._traceMemory and not statistics.overlapped:
+					statistics.peakTracedBytes = tracemalloc.get_traced_memory()[1]
+				self._stages.append(statistics)
+
+	def addSource(self, name: str, statistics: SourceStatistics):
+		with self._lock:
+			self._sources[name] = statistics
+
+	def toDict(self) -> dict:
+		return {
+			"startedAt": self._startedAt,
+			"seconds": time.perf_counter() - self._startedCounter,
+			"peakRss": getPeakRss(),
+			"stages": [stage.toDict() for stage in self._stages],
+			"sources": {name: statistics.toDict() for (name, statistics) in self._sources.items()},
+		}
+
+	def writeJson(self, path: str):
+		writeAtomically(path, json.dumps(self.toDict(), indent="\t"))
+
+	def writePrometheus(self, path: str):
+		"""writes a file for node_exporter's textfile collector"""
+		writeAtomically(path, formatPrometheus(self.toDict()))
+
+
+def escapeLabel(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatPrometheus(report: dict) -> str:
+	metrics = [
+		("pyhosts_last_run_timestamp_seconds", "when the last run started", [("", report["startedAt"])]),
+		("pyhosts_run_duration_seconds", "how long the last run took", [("", report["seconds"])]),
+		(
+			"pyhosts_stage_duration_seconds",
+			"how long each stage of the last run took",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["seconds"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_lines_out",
+			"how many lines each stage of the last run produced",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["linesOut"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_rss_after_bytes",
+			"resident memory when each stage of the last run ended",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["rssAfter"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_peak_rss_growth_bytes",
+			"how much each stage of the last run raised the peak resident memory",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["peakRssGrowth"]) for stage in report["stages"]],
+		),
+	]
+	sourceMetrics = [
+		("pyhosts_source_duration_seconds", "how long each source took to download and parse", "seconds"),
+		("pyhosts_source_bytes_downloaded", "how many bytes were downloaded for each source", "bytesDownloaded"),
+		("pyhosts_source_lines", "how many domains each source contributed", "linesOut"),
+		("pyhosts_source_failed", "1 if the source could not be downloaded", "failed"),
+		("pyhosts_source_from_archive", "1 if the source's last known good copy was used instead", "fromArchive"),
+	]
+	for metric, help, key in sourceMetrics:
+		values = [('{{source="{}"}}'.format(escapeLabel(name)), float(source[key])) for (name, source) in report["sources"].items()]
+		metrics.append((metric, help, values))
+	if report["peakRss"] is not None:
+		metrics.append(("pyhosts_peak_rss_bytes", "peak resident memory of the last run", [("", report["peakRss"])]))
+	lines: List[str] = []
+	for metric, help, values in metrics:
+		lines.append("# HELP {} {}".format(metric, help))
+		lines.append("# TYPE {} gauge".format(metric))
+		for labels, value in values:
+			if value is not None:
+				lines.append("{}{} {}".format(metric, labels, value))
+	return "\n".join(lines) + "\n"
+
+
+def writeAtomically(path: str, text: str):
+	"""readers such as the textfile collector must never see a half-written file"""
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "w", encoding="utf-8") as file:
+		file.write(text)
+	os.replace(temporaryPath, path)
+
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 6 * 3600
+
+
+class CircuitBreaker:
+	"""
+	skips a source for a cooldown once it has failed threshold runs in a row, rather than waiting on it every run
+	after the cooldown the source is tried once more, and one more failure skips it again
+	the failures are kept between runs in a JSON file
+	"""
+
+	def __init__(self, path: str, threshold: int = DEFAULT_FAILURE_THRESHOLD, cooldown: float = DEFAULT_COOLDOWN) -> None:
+		self._path = path
+		self._threshold = threshold
+		self._cooldown = cooldown
+		self._states: Dict[str, dict] = {}
+		try:
+			with open(path, "r", encoding="utf-8") as file:
+				self._states = json.load(file)
+		except (OSError, ValueError):
+			pass
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def getOpenUntil(self, source) -> Optional[float]:
+		"""when the source will be tried again, or None if it isn't being skipped"""
+		state = self._states.get(source.url)
+		if state is None or state.get("openUntil") is None or state["openUntil"] <= time.time():
+			return None
+		return state["openUntil"]
+
+	def check(self, source):
+		"""raises CircuitOpenError if the source should be skipped"""
+		openUntil = self.getOpenUntil(source)
+		if openUntil is not None:
+			raise CircuitOpenError(source, self._states[source.url]["failures"], openUntil)
+
+	def recordSuccess(self, source):
+		self._states.pop(source.url, None)
+
+	def recordFailure(self, source):
+		state = self._states.setdefault(source.url, {"failures": 0, "openUntil": None})
+		state["failures"] += 1
+		if state["failures"] >= self._threshold:
+			state["openUntil"] = time.time() + self._cooldown
+
+	def save(self):
+		writeAtomically(self.path, json.dumps(self._states, indent="\t"))
+
+
+class ControlRunner:
+	"""runs a server's control command, e.g. unbound-control, giving it input on stdin"""
+
+	def run(self, command: List[str], input: Optional[str]):
+		try:
+			subprocess.run(command, input=input, capture_output=True, text=True, check=True)
+		except subprocess.CalledProcessError as e:
+			raise ControlCommandError(command, e.stderr or e.stdout or "exit status {}".format(e.returncode))
+		except OSError as e:
+			raise ControlCommandError(command, str(e))
+
+
+class Delta:
+	"""the domains added and removed since the previous run, each in the order they were listed"""
+
+	def __init__(self, added: List[str], removed: List[str]) -> None:
+		self._added = added
+		self._removed = removed
+
+	@property
+	def added(self) -> List[str]:
+		return self._added
+
+	@property
+	def removed(self) -> List[str]:
+		return self._removed
+
+	def isEmpty(self) -> bool:
+		return len(self.added) == 0 and len(self.removed) == 0
+
+
+def computeDelta(previous: List[str], current: List[str]) -> Delta:
+	previousSet = set(previous)
+	currentSet = set(current)
+	return Delta([domain for domain in current if domain not in previousSet], [domain for domain in previous if domain not in currentSet])
+
+
+class DeltaWriter:
+	"""
+	keeps the domains each target was last written with in a directory, and writes what changed since then
+	to <name>.add and <name>.remove, optionally applying them to the running server with a ControlRunner
+	"""
+
+	def __init__(self, directory: str, runner: Optional[ControlRunner] = None) -> None:
+		self._directory = directory
+		self._runner = runner
+		os.makedirs(directory, exist_ok=True)
+
+	@property
+	def directory(self) -> str:
+		return self._directory
+
+	def pathFor(self, name: str, extension: str) -> str:
+		return os.path.join(self.directory, "{}.{}".format(name, extension))
+
+	def isAppliedInPlace(self, name: str, serverFormatter) -> bool:
+		"""true if the server keeps the output up to date itself from the deltas applied to it, once its domains are remembered"""
+		return (
+			self._runner is not None
+			and serverFormatter.supportsDelta
+			and serverFormatter.deltaUpdatesOutput
+			and os.path.exists(self.pathFor(name, "domains"))
+		)
+
+	def loadPrevious(self, name: str) -> Optional[List[str]]:
+		"""returns None if the target has not been written before"""
+		try:
+			with open(self.pathFor(name, "domains"), "r", encoding="utf-8") as file:
+				return file.read().splitlines()
+		except FileNotFoundError:
+			return None
+
+	def write(self, name: str, serverFormatter, domains: List[str]) -> Optional[Delta]:
+		"""
+		the domains are only remembered once the delta has been written and applied,
+		so a failed control command is retried with the same delta next run
+		the first run only remembers the domains, as the server loads them from the output that was just written
+		"""
+		if not serverFormatter.supportsDelta:
+			printError("no delta written for {}, it can't be updated while running".format(serverFormatter.name))
+			return None
+		previous = self.loadPrevious(name)
+		if previous is None:
+			printError("no previous domains for {}, they are remembered for the next delta".format(name))
+			previous = domains
+		delta = computeDelta(previous, domains)
+		additions = serverFormatter.formatAdditions(delta.added)
+		removals = serverFormatter.formatRemovals(delta.removed)
+		writeAtomically(self.pathFor(name, "add"), "".join(line + "\n" for line in additions))
+		writeAtomically(self.pathFor(name, "remove"), "".join(line + "\n" for line in removals))
+		printError(
+			"delta for {}: {} added, {} removed, written to {}".format(name, len(delta.added), len(delta.removed), os.path.abspath(self.directory))
+		)
+		if self._runner is not None and not delta.isEmpty():
+			for command, input in serverFormatter.getControlCommands(additions, removals):
+				self._runner.run(command, input)
+			printError("delta applied to {}".format(serverFormatter.name))
+		writeAtomically(self.pathFor(name, "domains"), "".join(domain + "\n" for domain in domains))
+		return delta
+
+
+class DomainStore:
+	"""
+	keeps every source's domains between runs in an SQLite database, with how many sources list each domain
+	a changed source only adds and removes the domains that differ from last time, so the merged set
+	and the whitelist result are updated in time proportional to the change rather than to every domain
+	domains keep the order in which they were first listed, like removeDupes
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		self._connection = sqlite3.connect(path)
+		self._connection.executescript(
+			"""
+			CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY AUTOINCREMENT, domain TEXT NOT NULL UNIQUE, refs INTEGER NOT NULL, rule TEXT);
+			CREATE INDEX IF NOT EXISTS whitelistedDomains ON domains (rule) WHERE rule IS NOT NULL;
+			CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS sourceDomains (source TEXT NOT NULL, domain TEXT NOT NULL, PRIMARY KEY (source, domain)) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS whitelist (position INTEGER PRIMARY KEY, rule TEXT NOT NULL);
+			"""
+		)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exceptionType, *args):
+		"""keeps the changes only if the whole run succeeded"""
+		if exceptionType is None:
+			self._connection.commit()
+		else:
+			self._connection.rollback()
+		self._connection.close()
+
+	def getSourceKeys(self) -> List[str]:
+		return [row[0] for row in self._connection.execute("SELECT source FROM sources")]
+
+	def updateSource(self, key: str, lines: List[str], findRule: Callable[[str], Optional[str]]) -> Tuple[int, int]:
+		"""replaces what the source listed last time with lines, returning how many domains it added and removed"""
+		stored = set(row[0] for row in self._connection.execute("SELECT domain FROM sourceDomains WHERE source = ?", (key,)))
+		listed = OrderedDict.fromkeys(lines)
+		added = [domain for domain in listed if domain not in stored]
+		removed = [domain for domain in stored if domain not in listed]
+		cursor = self._connection.cursor()
+		if len(listed) > 0:
+			cursor.execute("INSERT OR IGNORE INTO sources (source) VALUES (?)", (key,))
+		else:
+			cursor.execute("DELETE FROM sources WHERE source = ?", (key,))
+		cursor.executemany("INSERT INTO sourceDomains (source, domain) VALUES (?, ?)", ((key, domain) for domain in added))
+		cursor.executemany(
+			"INSERT INTO domains (domain, refs, rule) VALUES (?, 1, ?) ON CONFLICT (domain) DO UPDATE SET refs = refs + 1",
+			((domain, findRule(domain)) for domain in added),
+		)
+		cursor.executemany("DELETE FROM sourceDomains WHERE source = ? AND domain = ?", ((key, domain) for domain in removed))
+		cursor.executemany("UPDATE domains SET refs = refs - 1 WHERE domain = ?", ((domain,) for domain in removed))
+		cursor.executemany("DELETE FROM domains WHERE domain = ? AND refs <= 0", ((domain,) for domain in removed))
+		return (len(added), len(removed))
+
+	def removeSource(self, key: str) -> int:
+		"""forgets a source that is no longer configured, returning how many domains it removed"""
+		return self.updateSource(key, [], lambda domain: None)[1]
+
+	def updateWhitelist(self, whitelist: List[str], findRule: Callable[[str], Optional[str]]) -> bool:
+		"""
+		checks every stored domain against the whitelist again, but only if it changed since the last run
+		returns true if it changed
+		"""
+		stored = [row[0] for row in self._connection.execute("SELECT rule FROM whitelist ORDER BY position")]
+		if stored == whitelist:
+			return False
+		cursor = self._connection.cursor()
+		cursor.execute("DELETE FROM whitelist")
+		cursor.executemany("INSERT INTO whitelist (position, rule) VALUES (?, ?)", enumerate(whitelist))
+		rules = [(findRule(domain), id) for (id, domain) in self._connection.execute("SELECT id, domain FROM domains")]
+		cursor.executemany("UPDATE domains SET rule = ? WHERE id = ?", rules)
+		return True
+
+	def countDomains(self) -> int:
+		return self._connection.execute("SELECT COUNT(*) FROM domains").fetchone()[0]
+
+	def countWhitelisted(self) -> Dict[str, int]:
+		"""how many domains each whitelist rule saves"""
+		return dict(self._connection.execute("SELECT rule, COUNT(*) FROM domains WHERE rule IS NOT NULL GROUP BY rule"))
+
+	def getBlockedDomains(self) -> Iterator[str]:
+		"""every domain listed by a source and not whitelisted, in the order they were first listed"""
+		for row in self._connection.execute("SELECT domain FROM domains WHERE rule IS NULL ORDER BY id"):
+			yield row[0]
+
+
+class SourceIndex:
+	"""
+	which sources listed each domain in the run that built it, and the whitelist that run used
+	lookups are batched, so thousands of domains and their parents take a handful of queries
+	"""
+
+	# how many names go in one "IN (...)" query, below SQLite's limit on parameters
+	BATCH_SIZE = 500
+
+	def __init__(self, path: str) -> None:
+		if not os.path.exists(path):
+			raise FileNotFoundError(path)
+		self._path = path
+		self._connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(path))), uri=True)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self._connection.close()
+
+	def getWhitelist(self) -> List[str]:
+		return [row[0] for row in self._connection.execute("SELECT rule FROM whitelist ORDER BY position")]
+
+	def findSources(self, domains: Iterable[str]) -> Dict[str, List[str]]:
+		"""maps each of the domains that was listed to the names of the sources that listed it, in source order"""
+		domains = list(set(domains))
+		found: Dict[str, List[str]] = {}
+		for start in range(0, len(domains), SourceIndex.BATCH_SIZE):
+			batch = domains[start : start + SourceIndex.BATCH_SIZE]
+			query = (
+				"SELECT listings.domain, sources.name FROM listings JOIN sources ON sources.id = listings.sourceId"
+				" WHERE listings.domain IN ({}) ORDER BY listings.sourceId".format(",".join("?" * len(batch)))
+			)
+			for domain, name in self._connection.execute(query, batch):
+				found.setdefault(domain, []).append(name)
+		return found
+
+
+def writeSourceIndex(path: str, listings: List[Tuple[str, List[str]]], whitelist: List[str]):
+	"""builds the index for (source name, lines) pairs beside the old one, then replaces it in one go"""
+	temporaryPath = path + ".tmp"
+	if os.path.exists(temporaryPath):
+		os.remove(temporaryPath)
+	connection = sqlite3.connect(temporaryPath)
+	try:
+		connection.executescript(
+			"""
+			CREATE TABLE sources (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+			CREATE TABLE listings (domain TEXT NOT NULL, sourceId INTEGER NOT NULL, PRIMARY KEY (domain, sourceId)) WITHOUT ROWID;
+			CREATE TABLE whitelist (position INTEGER PRIMARY KEY, rule TEXT NOT NULL);
+			"""
+		)
+		for sourceId, (name, lines) in enumerate(listings):
+			connection.execute("INSERT INTO sources (id, name) VALUES (?, ?)", (sourceId, name))
+			connection.executemany("INSERT OR IGNORE INTO listings (domain, sourceId) VALUES (?, ?)", ((line, sourceId) for line in lines))
+		connection.executemany("INSERT INTO whitelist (position, rule) VALUES (?, ?)", enumerate(whitelist))
+		connection.commit()
+	finally:
+		connection.close()
+	os.replace(temporaryPath, path)
+
+
+def getParentDomains(domain: str) -> Iterator[str]:
+	"""
+	yields every parent of a domain, nearest first
+	e.g. a.b.example.com gives b.example.com, example.com, com
+	"""
+	index = domain.find(".")
+	while index != -1:
+		yield domain[index + 1 :]
+		index = domain.find(".", index + 1)
+
+
+def isSuffixRule(rule: str) -> bool:
+	"""*.example.com and .example.com both cover example.com and every subdomain of it"""
+	return rule.startswith("*.") or rule.startswith(".")
+
+
+class DomainTrie:
+	"""stores domains label by label from the right, so a.tracker.com and b.tracker.com share com -> tracker"""
+
+	# key marking that the path to a node is itself a domain, labels are never None
+	_BLOCKED = None
+
+	def __init__(self) -> None:
+		self._root = {}
+
+	def add(self, domain: str):
+		node = self._root
+		for label in reversed(domain.split(".")):
+			node = node.setdefault(label, {})
+		node[DomainTrie._BLOCKED] = True
+
+	def hasBlockedParent(self, domain: str) -> bool:
+		"""true if any parent of the domain (but not the domain itself) has been added"""
+		node = self._root
+		labels = domain.split(".")
+		for label in reversed(labels[1:]):
+			node = node.get(label)
+			if node is None:
+				return False
+			if DomainTrie._BLOCKED in node:
+				return True
+		return False
+
+
+def collapseSubdomains(domains: List[str]) -> List[str]:
+	"""drops every domain whose parent is also in the list, keeping the order of the rest"""
+	trie = DomainTrie()
+	for domain in domains:
+		trie.add(domain)
+	return [domain for domain in domains if not trie.hasBlockedParent(domain)]
+
+
+# magic, number of domains, domains per block, number of blocks, where the block index starts
+SNAPSHOT_HEADER = struct.Struct("<8sIIIQ")
+SNAPSHOT_MAGIC = b"PYHOSTS1"
+SNAPSHOT_OFFSET = struct.Struct("<Q")
+DEFAULT_BLOCK_SIZE = 16
+
+
+def toKey(domain: str) -> bytes:
+	"""a.example.com becomes com.example.a, so that domains under the same parent sort next to each other"""
+	return ".".join(reversed(domain.split("."))).encode("utf-8")
+
+
+def fromKey(key: bytes) -> str:
+	return ".".join(reversed(key.decode("utf-8").split(".")))
+
+
+def encodeVarint(number: int) -> bytes:
+	encoded = bytearray()
+	while number >= 0x80:
+		encoded.append((number & 0x7F) | 0x80)
+		number >>= 7
+	encoded.append(number)
+	return bytes(encoded)
+
+
+def decodeVarint(buffer, position: int) -> Tuple[int, int]:
+	"""returns the number and the position after it"""
+	number = 0
+	shift = 0
+	while True:
+		byte = buffer[position]
+		position += 1
+		number |= (byte & 0x7F) << shift
+		if byte < 0x80:
+			return (number, position)
+		shift += 7
+
+
+def commonPrefixLength(first: bytes, second: bytes) -> int:
+	length = min(len(first), len(second))
+	for index in range(length):
+		if first[index] != second[index]:
+			return index
+	return length
+
+
+def writeSnapshot(domains: Iterable[str], path: str, blockSize: int = DEFAULT_BLOCK_SIZE) -> int:
+	"""
+	writes the domains as sorted reversed-label keys, in blocks of blockSize keys followed by an index of block offsets
+	each key only stores what differs from the one before it, except the first key of a block,
+	which is stored whole so a reader can binary search the blocks
+	returns the number of domains written
+	"""
+	keys: List[bytes] = sorted(set(toKey(domain) for domain in domains))
+	blockOffsets: List[int] = []
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "wb") as file:
+		file.write(b"\0" * SNAPSHOT_HEADER.size)
+		previous = b""
+		for index, key in enumerate(keys):
+			if index % blockSize == 0:
+				blockOffsets.append(file.tell())
+				previous = b""
+			shared = commonPrefixLength(previous, key)
+			file.write(encodeVarint(shared) + encodeVarint(len(key) - shared) + key[shared:])
+			previous = key
+		indexOffset = file.tell()
+		for offset in blockOffsets:
+			file.write(SNAPSHOT_OFFSET.pack(offset))
+		file.seek(0)
+		file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(keys), blockSize, len(blockOffsets), indexOffset))
+	os.replace(temporaryPath, path)
+	return len(keys)
+
+
+class DomainSetReader:
+	"""
+	answers lookups against a snapshot written by writeSnapshot, reading only the few blocks each lookup touches
+	the file is memory mapped, so many processes can share one copy of it through the page cache
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		with open(path, "rb") as file:
+			self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._map) < SNAPSHOT_HEADER.size:
+			self._map.close()
+			raise SnapshotFormatError(path)
+		(magic, self._count, self._blockSize, self._blockCount, self._indexOffset) = SNAPSHOT_HEADER.unpack_from(self._map, 0)
+		if magic != SNAPSHOT_MAGIC or self._indexOffset + self._blockCount * SNAPSHOT_OFFSET.size > len(self._map):
+			self._map.close()
+			raise SnapshotFormatError(path)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._map.close()
+
+	def blockOffset(self, block: int) -> int:
+		return SNAPSHOT_OFFSET.unpack_from(self._map, self._indexOffset + block * SNAPSHOT_OFFSET.size)[0]
+
+	def firstKey(self, block: int) -> bytes:
+		(_, position) = decodeVarint(self._map, self.blockOffset(block))
+		(length, position) = decodeVarint(self._map, position)
+		return self._map[position : position + length]
+
+	def containsKey(self, key: bytes) -> bool:
+		if self._blockCount == 0:
+			return False
+		# the last block whose first key is not after the key
+		(low, high) = (0, self._blockCount - 1)
+		while low < high:
+			middle = (low + high + 1) // 2
+			if self.firstKey(middle) <= key:
+				low = middle
+			else:
+				high = middle - 1
+		position = self.blockOffset(low)
+		entries = min(self._blockSize, self._count - low * self._blockSize)
+		current = b""
+		for _ in range(entries):
+			(shared, position) = decodeVarint(self._map, position)
+			(length, position) = decodeVarint(self._map, position)
+			current = current[:shared] + self._map[position : position + length]
+			position += length
+			if current == key:
+				return True
+			if current > key:
+				return False
+		return False
+
+	def contains(self, domain: str) -> bool:
+		"""true if exactly this domain is in the snapshot"""
+		return self.containsKey(toKey(normalizeQuery(domain)))
+
+	def findBlockingDomain(self, domain: str) -> Optional[str]:
+		"""returns the domain itself or its nearest parent in the snapshot, or None if neither is"""
+		domain = normalizeQuery(domain)
+		if self.contains(domain):
+			return domain
+		for parent in getParentDomains(domain):
+			if self.contains(parent):
+				return parent
+		return None
+
+	def isBlocked(self, domain: str) -> bool:
+		"""true if the domain or any of its parents is in the snapshot"""
+		return self.findBlockingDomain(domain) is not None
+
+	def __iter__(self):
+		"""every domain in key order, decoding the whole file"""
+		position = SNAPSHOT_HEADER.size
+		current = b""
+		for _ in range(self._count):
+			(shared, position) = decodeVarint(self._map, position)
+			(length, position) = decodeVarint(self._map, position)
+			current = current[:shared] + self._map[position : position + length]
+			position += length
+			yield fromKey(current)
+
+
+def normalizeQuery(domain: str) -> str:
+	"""lookups may come straight from logs, e.g. Example.COM."""
+	return domain.strip().rstrip(".").lower()
+
+
+# magic, number of domains, number of bits, number of hashes, the false positive rate it was built for
+BLOOM_HEADER = struct.Struct("<8sQQId")
+BLOOM_MAGIC = b"PYBLOOM1"
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+def getSize(count: int, falsePositiveRate: float) -> Tuple[int, int]:
+	"""the number of bits and of hashes that give the false positive rate for count domains"""
+	bitCount = max(math.ceil(-count * math.log(falsePositiveRate) / math.log(2) ** 2), 8)
+	hashCount = max(round(bitCount / max(count, 1) * math.log(2)), 1)
+	return (bitCount, hashCount)
+
+
+def getBitIndexes(domain: str, bitCount: int, hashCount: int) -> Iterable[int]:
+	"""
+	two 64-bit halves of one BLAKE2b digest stand in for every hash, as h1 + i * h2 (Kirsch and Mitzenmacher)
+	any other reader of the file has to hash the same way, which only needs a BLAKE2b implementation
+	"""
+	digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=16).digest()
+	(first, second) = struct.unpack("<QQ", digest)
+	return ((first + index * second) % bitCount for index in range(hashCount))
+
+
+def writeBloomFilter(domains: Iterable[str], path: str, falsePositiveRate: float = DEFAULT_FALSE_POSITIVE_RATE) -> Tuple[int, int]:
+	"""
+	writes a Bloom filter of the domains, sized for falsePositiveRate, after a header giving its size
+	bit i is bit i % 8 of byte i // 8
+	returns the number of domains and the size of the file in bytes
+	"""
+	domains = set(normalizeQuery(domain) for domain in domains)
+	(bitCount, hashCount) = getSize(len(domains), falsePositiveRate)
+	bits = bytearray((bitCount + 7) // 8)
+	for domain in domains:
+		for index in getBitIndexes(domain, bitCount, hashCount):
+			bits[index >> 3] |= 1 << (index & 7)
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "wb") as file:
+		file.write(BLOOM_HEADER.pack(BLOOM_MAGIC, len(domains), bitCount, hashCount, falsePositiveRate))
+		file.write(bits)
+	os.replace(temporaryPath, path)
+	return (len(domains), BLOOM_HEADER.size + len(bits))
+
+
+class BloomFilterReader:
+	"""
+	answers whether a domain is probably in a filter written by writeBloomFilter, touching only a few bytes per lookup
+	false means certainly not listed, true means listed or, at about the false positive rate, a false alarm
+	the file is memory mapped, so many processes can share one copy of it through the page cache
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		with open(path, "rb") as file:
+			self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._map) < BLOOM_HEADER.size:
+			self._map.close()
+			raise BloomFilterFormatError(path)
+		(magic, self._count, self._bitCount, self._hashCount, self._falsePositiveRate) = BLOOM_HEADER.unpack_from(self._map, 0)
+		if magic != BLOOM_MAGIC or self._bitCount == 0 or BLOOM_HEADER.size + (self._bitCount + 7) // 8 > len(self._map):
+			self._map.close()
+			raise BloomFilterFormatError(path)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	@property
+	def falsePositiveRate(self) -> float:
+		return self._falsePositiveRate
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._map.close()
+
+	def containsKey(self, domain: str) -> bool:
+		for index in getBitIndexes(domain, self._bitCount, self._hashCount):
+			if not self._map[BLOOM_HEADER.size + (index >> 3)] & (1 << (index & 7)):
+				return False
+		return True
+
+	def mightContain(self, domain: str) -> bool:
+		"""true if exactly this domain is probably in the filter"""
+		return self.containsKey(normalizeQuery(domain))
+
+	def mightBeBlocked(self, domain: str) -> bool:
+		"""true if the domain or any of its parents is probably in the filter, with a false alarm more likely for each parent"""
+		domain = normalizeQuery(domain)
+		return self.containsKey(domain) or any(self.containsKey(parent) for parent in getParentDomains(domain))
+
+
+# roughly what a str and the list slot and tuple holding it cost on top of its characters, in bytes
+ENTRY_OVERHEAD = 120
+# how many runs are merged at once, to stay well below the limit on open files
+MERGE_WIDTH = 64
+
+
+def writeRun(directory: str, entries: Iterable[Tuple[str, int]], runNumber: int) -> str:
+	"""writes (domain, position) entries in the order given, one 'position<tab>domain' per line"""
+	path = os.path.join(directory, "run{}.txt".format(runNumber))
+	with open(path, "w", encoding="utf-8", newline="\n") as file:
+		for domain, position in entries:
+			file.write("{}\t{}\n".format(position, domain))
+	return path
+
+
+def readRun(path: str) -> Iterator[Tuple[str, int]]:
+	with open(path, "r", encoding="utf-8", newline="\n") as file:
+		for line in file:
+			(position, _, domain) = line[:-1].partition("\t")
+			yield (domain, int(position))
+
+
+def byPosition(entry: Tuple[str, int]) -> int:
+	return entry[1]
+
+
+class ExternalDeduplicator:
+	"""
+	removes duplicates like removeDupes, keeping the first of each domain in the original order,
+	while holding no more than about memoryBudget bytes of domains at once
+
+	1. the lines are cut into runs that fit the budget, each sorted by domain and written to a temporary file
+	2. the runs are merged, keeping only the earliest position of each domain, into runs sorted by position
+	3. those runs are merged by position, which gives back the original order
+	"""
+
+	def __init__(self, memoryBudget: int, directory: Optional[str] = None) -> None:
+		self._memoryBudget = memoryBudget
+		self._directory = directory
+		self._totalCount = 0
+		self._uniqueCount = 0
+		self._runCount = 0
+
+	@property
+	def totalCount(self) -> int:
+		return self._totalCount
+
+	@property
+	def uniqueCount(self) -> int:
+		return self._uniqueCount
+
+	@property
+	def runCount(self) -> int:
+		"""how many temporary files were written, 0 if everything fit in the budget"""
+		return self._runCount
+
+	def readChunks(self, entries: Iterator[Tuple[str, int]]) -> Iterator[List[Tuple[str, int]]]:
+		"""
+		groups entries into lists of half the memory budget,
+		as the next list is filled while the previous one is still being written out
+		"""
+		chunk: List[Tuple[str, int]] = []
+		chunkSize = 0
+		for entry in entries:
+			chunk.append(entry)
+			chunkSize += ENTRY_OVERHEAD + len(entry[0])
+			if chunkSize >= self._memoryBudget // 2:
+				yield chunk
+				chunk = []
+				chunkSize = 0
+		if len(chunk) > 0:
+			yield chunk
+
+	def spill(self, directory: str, chunk: List[Tuple[str, int]], key=None) -> str:
+		chunk.sort(key=key)
+		self._runCount += 1
+		return writeRun(directory, chunk, self._runCount)
+
+	def mergeRuns(self, directory: str, paths: List[str], key=None) -> Iterator[Tuple[str, int]]:
+		"""merges the runs in passes of MERGE_WIDTH until one pass can merge what is left"""
+		while len(paths) > MERGE_WIDTH:
+			mergedPaths = []
+			for start in range(0, len(paths), MERGE_WIDTH):
+				group = paths[start : start + MERGE_WIDTH]
+				self._runCount += 1
+				mergedPaths.append(writeRun(directory, heapq.merge(*[readRun(path) for path in group], key=key), self._runCount))
+				for path in group:
+					os.remove(path)
+			paths = mergedPaths
+		return heapq.merge(*[readRun(path) for path in paths], key=key)
+
+	def keepFirstOfEach(self, entries: Iterator[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+		"""the entries are sorted by domain then position, so the first of each domain is its earliest"""
+		previous = None
+		for domain, position in entries:
+			if domain != previous:
+				self._uniqueCount += 1
+				previous = domain
+				yield (domain, position)
+
+	def countLines(self, lines: Iterable[str]) -> Iterator[Tuple[str, int]]:
+		for line in lines:
+			self._totalCount += 1
+			yield (line, self._totalCount)
+
+	def deduplicate(self, lines: Iterable[str]) -> Iterator[str]:
+		with tempfile.TemporaryDirectory(prefix="pyhosts-", dir=self._directory) as directory:
+			sortedRuns: List[str] = []
+			pending = None
+			for chunk in self.readChunks(self.countLines(lines)):
+				if pending is not None:
+					sortedRuns.append(self.spill(directory, pending))
+				pending = chunk
+			if pending is None:
+				return
+			if len(sortedRuns) == 0:
+				# everything fit in the budget, so there is nothing to spill
+				uniqueLines = OrderedDict.fromkeys(domain for (domain, _) in pending)
+				self._uniqueCount = len(uniqueLines)
+				yield from uniqueLines
+				return
+			sortedRuns.append(self.spill(directory, pending))
+			pending = None
+			merged = self.mergeRuns(directory, sortedRuns)
+			positionRuns = [self.spill(directory, chunk, byPosition) for chunk in self.readChunks(self.keepFirstOfEach(merged))]
+			for domain, _ in self.mergeRuns(directory, positionRuns, byPosition):
+				yield domain
+
+
+# the kinds of list a source publishes, which decide how its lines are parsed
+PLAIN = "plain"  # one domain per line
+HOSTS = "hosts"  # "0.0.0.0 domain", or one domain per line
+HOSTS_WITH_COMMENTS = "hosts with comments"  # "0.0.0.0 domain #comment", skipping anything mentioning localhost
+
+
+class Trigger:
+	"""
+	something that makes a line behave differently under normalize, isValid and format than under transformLines
+	isPresent is a cheap test of the whole payload, so that the pattern is only searched for when needed
+	"""
+
+	def __init__(self, isPresent: Callable[[bytes], bool], pattern: bytes) -> None:
+		self._isPresent = isPresent
+		self._pattern = pattern
+
+	@property
+	def pattern(self) -> bytes:
+		return self._pattern
+
+	def isPresent(self, payload: bytes) -> bool:
+		return self._isPresent(payload)
+
+
+# isValid rejects localhost, and MVPS.format drops anything mentioning it
+LOCALHOST = Trigger(lambda payload: b"localhost" in payload, rb"localhost")
+# isValid rejects double dots, unless normalize removed one of them
+DOUBLE_DOTS = Trigger(lambda payload: b".." in payload, rb"\.\.")
+# format removes every '0.0.0.0 ', transformLines only removes it from the start of a line
+INNER_HOSTS_PREFIX = Trigger(lambda payload: payload.count(b"0.0.0.0 ") != payload.count(b"\n0.0.0.0 "), rb"(?<!\n)0\.0\.0\.0 ")
+# format turns '0.0.0.0 ' on its own (or followed by a comment, for MVPS) into an empty line, which transformLines would drop
+EMPTY_HOSTS_ENTRY = Trigger(
+	lambda payload: b"\n0.0.0.0 \n" in payload or b"\n0.0.0.0 .\n" in payload or b"\n0.0.0.0 #" in payload,
+	rb"(?<=\n)0\.0\.0\.0 (?=\.?\n|#)",
+)
+
+# dialect -> (what transformLines can't handle, whether format removes '0.0.0.0 ', whether format cuts lines at '#')
+dialects = {
+	PLAIN: ([LOCALHOST, DOUBLE_DOTS], False, False),
+	HOSTS: ([LOCALHOST, DOUBLE_DOTS, INNER_HOSTS_PREFIX, EMPTY_HOSTS_ENTRY], True, False),
+	HOSTS_WITH_COMMENTS: ([LOCALHOST, DOUBLE_DOTS, INNER_HOSTS_PREFIX, EMPTY_HOSTS_ENTRY], True, True),
+}
+
+_commentLines = re.compile(rb"\n#[^\n]*")
+_comments = re.compile(rb"#[^\n]*")
+# str.splitlines treats these as line breaks too, bytes.split doesn't
+_unusualLineBreaks = re.compile(rb"[\r\v\f\x1c\x1d\x1e]")
+_asciiSample = "#.0 az\n"
+
+
+def isAsciiCompatible(encoding: Optional[str]) -> bool:
+	"""true if the encoding decodes plain ASCII to itself, unlike e.g. UTF-16"""
+	if encoding is None:
+		return True
+	try:
+		return _asciiSample.encode("ascii").decode(encoding) == _asciiSample
+	except (LookupError, UnicodeDecodeError):
+		return False
+
+
+def findTriggeredLines(payload: bytes, triggers: List[Trigger]) -> List[tuple]:
+	"""returns the (start, end) of every line containing a trigger, in order"""
+	present = [trigger.pattern for trigger in triggers if trigger.isPresent(payload)]
+	if len(present) == 0:
+		return []
+	lines = []
+	for match in re.finditer(b"|".join(present), payload):
+		start = payload.rfind(b"\n", 0, match.start()) + 1
+		if len(lines) > 0 and lines[-1][0] == start:
+			continue
+		lines.append((start, payload.find(b"\n", match.start())))
+	return lines
+
+
+def transformLines(segment: bytes, removeHostsPrefix: bool, cutComments: bool) -> List[str]:
+	"""
+	does to every line of the segment at once what normalize, isValid and format do line by line
+	the segment must start and end with a newline, and contain no triggered lines
+	"""
+	segment = segment.replace(b".\n", b"\n").replace(b"\n.", b"\n")
+	hasComments = b"#" in segment
+	if hasComments:
+		segment = _commentLines.sub(b"", segment)
+	if removeHostsPrefix:
+		segment = segment.replace(b"\n0.0.0.0 ", b"\n")
+	if cutComments and hasComments:
+		segment = _comments.sub(b"", segment)
+	return list(filter(None, segment.decode("ascii").split("\n")))
+
+
+def parsePayload(
+	payload: bytes, encoding: Optional[str], dialect: Optional[str], parseLines: Callable[[List[str]], List[str]]
+) -> Optional[List[str]]:
+	"""
+	normalizes, validates and formats a whole downloaded list with a handful of passes over its bytes, instead of line by line
+	lines that transformLines can't handle exactly are found up front and given to parseLines,
+	the original parser (normalize, isValid, then the source's format)
+	returns None when the payload can't be parsed this way (no dialect, non-ASCII text, unusual line breaks)
+	otherwise the result is identical to parseLines(payload.decode(encoding).splitlines())
+	"""
+	if dialect not in dialects or not payload.isascii() or not isAsciiCompatible(encoding):
+		return None
+	(triggers, removeHostsPrefix, cutComments) = dialects[dialect]
+	payload = b"\n" + payload.lower().replace(b"\r\n", b"\n") + b"\n"
+	if _unusualLineBreaks.search(payload):
+		return None
+	parsed: List[str] = []
+	segmentStart = 0
+	for lineStart, lineEnd in findTriggeredLines(payload, triggers):
+		parsed.extend(transformLines(payload[segmentStart:lineStart], removeHostsPrefix, cutComments))
+		parsed.extend(parseLines([payload[lineStart:lineEnd].decode("ascii")]))
+		segmentStart = lineEnd
+	parsed.extend(transformLines(payload[segmentStart:], removeHostsPrefix, cutComments))
+	return parsed
+
+
+DEFAULT_CONNECTIONS_PER_HOST = 4
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+# the longest a whole download may take, for a server that keeps sending a little at a time
+DEFAULT_DOWNLOAD_TIMEOUT = 300.0
+DEFAULT_RETRIES = 2
+# seconds, doubled for every retry
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# rate limits and server errors are worth retrying, anything else will fail the same way again
+RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# what every gzip file starts with
+GZIP_MAGIC = b"\x1f\x8b"
+# payloads bigger than this are cut into pieces of about this size, which are parsed at the same time
+PARSE_CHUNK_SIZE = 4 * 1024 * 1024
+# how much of a body is read at a time, between checks of the download timeout
+BODY_CHUNK_SIZE = 64 * 1024
+
+
 def getSources():
 	return [
 		MVPS(),
@@ -186,32 +1605,457 @@ def normalize(line: str) -> str:
 	return line
 
 
-def downloadSource(session: requests.Session, source) -> List[str]:
-	response = session.get(source.url)
-	if response.status_code != 200:
-		printError("downloading '{}' gave HTTP status code {}", source, response.status_code)
-	return response.text.splitlines()
+class DownloadPolicy:
+	"""
+	how long to wait for a source, and how often to try it again
+	readTimeout is the longest wait for any single read from the server, and downloadTimeout for reading the whole body,
+	so a source takes at most about (retries + 1) * (connectTimeout + readTimeout + downloadTimeout) plus the backoff before it fails
+	"""
+
+	def __init__(
+		self,
+		connectTimeout: float = DEFAULT_CONNECT_TIMEOUT,
+		readTimeout: float = DEFAULT_READ_TIMEOUT,
+		retries: int = DEFAULT_RETRIES,
+		backoff: float = DEFAULT_BACKOFF,
+		downloadTimeout: float = DEFAULT_DOWNLOAD_TIMEOUT,
+	) -> None:
+		self._connectTimeout = connectTimeout
+		self._readTimeout = readTimeout
+		self._downloadTimeout = downloadTimeout
+		self._retries = retries
+		self._backoff = backoff
+
+	@property
+	def timeout(self) -> Tuple[float, float]:
+		return (self._connectTimeout, self._readTimeout)
+
+	@property
+	def downloadTimeout(self) -> float:
+		return self._downloadTimeout
+
+	@property
+	def retries(self) -> int:
+		return self._retries
+
+	def getDelay(self, attempt: int) -> float:
+		"""a random wait of up to backoff * 2^attempt seconds, so that workers retrying the same host spread out"""
+		return random.uniform(0, min(self._backoff * 2**attempt, MAX_BACKOFF))
+
+
+def downloadSource(session: requests.Session, source, headers=None, stream=False, policy=None) -> requests.Response:
+	"""
+	returns a 200 or 304 response, retrying connection errors, timeouts and retriable status codes
+	raises DownloadError for any other status code, rather than letting an error page be parsed as domains
+	unless stream is true the body has been read, within the policy's download timeout, before the response is returned
+	"""
+	policy = policy if policy is not None else DownloadPolicy()
+	for attempt in range(policy.retries + 1):
+		isLastAttempt = attempt == policy.retries
+		try:
+			response = session.get(source.url, headers=headers, stream=True, timeout=policy.timeout)
+			if response.status_code == 200 and not stream:
+				# what the content property would have stored after reading the body itself
+				response._content = BodyReader(source, response, policy.downloadTimeout).readall()
+		except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, DownloadTimeoutError) as e:
+			if isLastAttempt:
+				raise
+			printError("downloading '{}' failed ({}), trying again".format(source, type(e).__name__))
+		else:
+			if response.status_code in (200, 304):
+				return response
+			response.close()
+			if isLastAttempt or response.status_code not in RETRIABLE_STATUS_CODES:
+				raise DownloadError(source, response.status_code)
+			printError("downloading '{}' gave HTTP status code {}, trying again".format(source, response.status_code))
+		time.sleep(policy.getDelay(attempt))
+
+
+class BodyReader(io.RawIOBase):
+	"""
+	the body of a streamed response as a binary stream, unpacked from any Content-Encoding,
+	which raises DownloadTimeoutError once downloadTimeout seconds have passed since it was created,
+	something the read timeout alone never does for a server that keeps sending a little at a time
+	errors from urllib3 are raised as the requests errors that iter_content would raise
+	"""
+
+	def __init__(self, source, response: requests.Response, downloadTimeout: float) -> None:
+		self._source = source
+		self._response = response
+		self._downloadTimeout = downloadTimeout
+		self._deadline = time.monotonic() + downloadTimeout
+		# read1 returns whatever has arrived rather than waiting for a whole buffer, where urllib3 is new enough to have it
+		self._read = response.raw.read1 if hasattr(response.raw, "read1") else response.raw.read
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		if time.monotonic() > self._deadline:
+			self._response.close()
+			raise DownloadTimeoutError(self._source, self._downloadTimeout)
+		try:
+			data = self._read(len(buffer), decode_content=True)
+		except ProtocolError as e:
+			raise requests.exceptions.ChunkedEncodingError(e)
+		except DecodeError as e:
+			raise requests.exceptions.ContentDecodingError(e)
+		except ReadTimeoutError as e:
+			raise requests.ConnectionError(e)
+		buffer[: len(data)] = data
+		return len(data)
+
+	def readall(self) -> bytes:
+		return b"".join(iter(lambda: self.read(BODY_CHUNK_SIZE), b""))
+
+
+def parseSource(source, downloadedLines) -> List[str]:
+	normalizedLines = map(normalize, downloadedLines)
+	wantedLines = filter(isValid, normalizedLines)
+	return list(source.format(wantedLines))
+
+
+def readPayload(response: requests.Response) -> Tuple[bytes, Optional[str]]:
+	"""
+	the body and its encoding, unpacking a gzip file that was sent as it is (e.g. a .gz source)
+	a body is taken to be a gzip file if it starts with GZIP_MAGIC, whatever its URL or Content-Type, as streamSource does too
+	a body sent with Content-Encoding: gzip or deflate has already been unpacked by requests
+	"""
+	content = response.content
+	if content.startswith(GZIP_MAGIC):
+		return (gzip.decompress(content), "utf-8")
+	return (content, response.encoding)
+
+
+def countPayloadLines(content: bytes) -> int:
+	"""the number of lines in the payload, counted as streamSource counts them"""
+	return content.count(b"\n") + (0 if content.endswith(b"\n") or len(content) == 0 else 1)
+
+
+def parseResponse(source, response: requests.Response, payload=None) -> List[str]:
+	"""
+	parses the raw bytes in one pass where the source's dialect allows, otherwise line by line
+	payload is what readPayload gave for the response, if it was read already
+	"""
+	(content, encoding) = payload if payload is not None else readPayload(response)
+	parsed = parsePayload(content, encoding, source.dialect, lambda lines: parseSource(source, lines))
+	if parsed is not None:
+		return parsed
+	return parseSource(source, decodeContent(content, encoding or response.apparent_encoding).splitlines())
+
+
+def decodeContent(content: bytes, encoding: Optional[str]) -> str:
+	"""what response.text gives, where an encoding of None is only passed for ASCII content"""
+	try:
+		return str(content, encoding or "utf-8", errors="replace")
+	except (LookupError, TypeError):
+		return str(content, errors="replace")
+
+
+def parseContent(source, content: bytes, encoding: Optional[str]) -> List[str]:
+	"""like parseResponse, for a payload that was sent to another process without its response"""
+	parsed = parsePayload(content, encoding, source.dialect, lambda lines: parseSource(source, lines))
+	if parsed is not None:
+		return parsed
+	return parseSource(source, decodeContent(content, encoding).splitlines())
+
+
+def parseChunk(source, content: bytes, encoding: Optional[str]) -> bytes:
+	"""runs in a worker process, and returns one line per formatted line as bytes, which pickle far faster than a list"""
+	return "".join(line + "\n" for line in parseContent(source, content, encoding)).encode("utf-8", "surrogatepass")
+
+
+def splitPayload(payload: bytes, chunkSize: int) -> List[bytes]:
+	"""cuts the payload just after a newline every chunkSize bytes or so"""
+	chunks = []
+	start = 0
+	while len(payload) - start > chunkSize:
+		end = payload.find(b"\n", start + chunkSize)
+		if end == -1:
+			break
+		chunks.append(payload[start : end + 1])
+		start = end + 1
+	chunks.append(payload[start:])
+	return chunks
+
+
+def getProcessContext():
+	"""
+	forkserver where the platform has it, otherwise spawn, as workers are started from download threads
+	and forking a process that has other threads running can deadlock the child
+	"""
+	method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+	return multiprocessing.get_context(method)
+
+
+class ParsePool:
+	"""
+	parses downloaded sources in other processes, cutting large sources into chunks so they use every core too
+	the workers import the main module again, so a script that uses it has to guard its entry point with if __name__ == "__main__"
+	"""
+
+	def __init__(self, processes: int) -> None:
+		self._processes = processes
+		self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=getProcessContext())
+
+	@property
+	def processes(self) -> int:
+		return self._processes
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self._executor.shutdown()
+
+	def parse(self, source, response: requests.Response, payload=None) -> List[str]:
+		"""like parseResponse, in the pool's processes"""
+		(content, encoding) = payload if payload is not None else readPayload(response)
+		if encoding is None and not content.isascii():
+			# guessed once for the whole payload, as each chunk might be guessed differently
+			encoding = response.apparent_encoding
+		# lines can only be found by their newline bytes in encodings that keep ASCII as it is
+		chunks = splitPayload(content, PARSE_CHUNK_SIZE) if isAsciiCompatible(encoding) else [content]
+		futures = [self._executor.submit(parseChunk, source, chunk, encoding) for chunk in chunks]
+		lines: List[str] = []
+		for future in futures:
+			lines.extend(future.result().decode("utf-8", "surrogatepass").split("\n")[:-1])
+		return lines
+
+
+def fetchSource(session: requests.Session, source, cache=None, statistics=None, parsePool=None, archive=None, policy=None) -> List[str]:
+	"""
+	downloads a single source, then normalizes and validates its lines
+	with a cache, a source that has not changed upstream (HTTP 304) reuses its cached lines without parsing
+	with an archive, the lines are kept as the source's last known good copy
+	"""
+	statistics = statistics if statistics is not None else SourceStatistics()
+	start = time.perf_counter()
+	cached = cache.load(source) if cache is not None else None
+	response = downloadSource(session, source, createConditionalHeaders(cached), policy=policy)
+	statistics.freshFor = getFreshness(response.headers)
+	response.content
+	# what came over the network once the whole body has been read, which is less than its length if it was compressed
+	statistics.bytesDownloaded = response.raw.tell()
+	if cached is not None and response.status_code == 304:
+		statistics.notModified = True
+		statistics.linesOut = len(cached.lines)
+		statistics.seconds = time.perf_counter() - start
+		if archive is not None:
+			archive.confirm(source, cached.lines)
+		return cached.lines
+	payload = readPayload(response)
+	formattedLines = parsePool.parse(source, response, payload) if parsePool is not None else parseResponse(source, response, payload)
+	# counted after unpacking, so a .gz source counts its lines rather than newline bytes in the compressed body
+	statistics.linesIn = countPayloadLines(payload[0])
+	statistics.linesOut = len(formattedLines)
+	statistics.seconds = time.perf_counter() - start
+	if cache is not None and response.status_code == 200:
+		entry = CacheEntry(response.headers.get("ETag"), response.headers.get("Last-Modified"), formattedLines)
+		if entry.isConditional():
+			cache.save(source, entry)
+	if archive is not None and response.status_code == 200:
+		archive.save(source, formattedLines)
+	return formattedLines
+
+
+def countLines(lines: Iterable[str], statistics: SourceStatistics) -> Iterator[str]:
+	for line in lines:
+		statistics.linesIn += 1
+		yield line
+
+
+def streamSource(session: requests.Session, source, cache=None, statistics=None, policy=None) -> Iterator[str]:
+	"""like fetchSource, but parses the response line by line as it arrives instead of holding all of it"""
+	statistics = statistics if statistics is not None else SourceStatistics()
+	policy = policy if policy is not None else DownloadPolicy()
+	cached = cache.load(source) if cache is not None else None
+	with downloadSource(session, source, createConditionalHeaders(cached), stream=True, policy=policy) as response:
+		if cached is not None and response.status_code == 304:
+			statistics.notModified = True
+			yield from cached.lines
+			return
+		body = io.BufferedReader(BodyReader(source, response, policy.downloadTimeout), BODY_CHUNK_SIZE)
+		# the same rule as readPayload, looking at the first bytes without taking them from the body
+		if body.peek(len(GZIP_MAGIC)).startswith(GZIP_MAGIC):
+			unpacked = io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding="utf-8", errors="replace")
+		else:
+			unpacked = io.TextIOWrapper(body, encoding=response.encoding or "utf-8", errors="replace")
+		downloadedLines = countLines((line.rstrip("\n") for line in unpacked), statistics)
+		formattedLines = source.format(filter(isValid, map(normalize, downloadedLines)))
+		if cache is None or response.status_code != 200:
+			yield from formattedLines
+		else:
+			# the cache needs this source's lines, which is still far less than every source's
+			keptLines: List[str] = []
+			for line in formattedLines:
+				keptLines.append(line)
+				yield line
+			entry = CacheEntry(response.headers.get("ETag"), response.headers.get("Last-Modified"), keptLines)
+			if entry.isConditional():
+				cache.save(source, entry)
+		statistics.bytesDownloaded = response.raw.tell()
+
+
+def createSession(sources, connectionsPerHost: int) -> requests.Session:
+	"""
+	creates a session whose connection pools are shared between worker threads
+	sources on the same host (e.g. v.firebog.net) reuse the same keep-alive pool
+	pool_block caps the number of simultaneous connections to any one host
+	"""
+	hostCount = len(set(urlparse(source.url).netloc for source in sources))
+	adapter = HTTPAdapter(pool_connections=max(hostCount, 1), pool_maxsize=connectionsPerHost, pool_block=True)
+	session = requests.Session()
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+
+def loadFromArchive(source, archive, statistics: SourceStatistics, ignoreAge: bool = False) -> Optional[List[str]]:
+	"""the source's last known good lines, or None if there are none young enough"""
+	lines = archive.load(source, ignoreAge)
+	age = archive.getAge(source)
+	if lines is None:
+		if age is None:
+			printError("no last known good copy of '{}'".format(source))
+		else:
+			printError("last known good copy of '{}' is {:.1f} hours old, too old to use".format(source, age / 3600))
+		return None
+	statistics.fromArchive = True
+	statistics.linesOut = len(lines)
+	printError("using last known good copy of '{}' from {:.1f} hours ago".format(source, age / 3600))
+	return lines
 
 
-def downloadSources(sources) -> List[str]:
-	"""downloads lists of domain names from the sources, then normalizes and validates them"""
+def loadArchivedSources(sources, archive, report=None) -> Iterator[Tuple[object, Optional[List[str]], SourceStatistics]]:
+	"""like fetchSources, but takes every source from its last known good copy, however old, without using the network"""
 	if len(sources) == 0:
 		raise NoSourcesConfiguredError()
+	printError("loading {} {} from {}".format(len(sources), "source" if len(sources) == 1 else "sources", archive.directory))
+	for source in sources:
+		statistics = SourceStatistics()
+		if report is not None:
+			report.addSource(source.name, statistics)
+		lines = loadFromArchive(source, archive, statistics, ignoreAge=True)
+		statistics.failed = lines is None
+		if lines is not None:
+			printError(createSourceDownloadSummary(source, len(lines)))
+		yield (source, lines, statistics)
+
+
+def fetchSources(
+	sources,
+	workers: int = 1,
+	connectionsPerHost: int = DEFAULT_CONNECTIONS_PER_HOST,
+	cache=None,
+	report=None,
+	parsePool=None,
+	archive=None,
+	policy=None,
+	breaker=None,
+) -> Iterator[Tuple[object, Optional[List[str]], SourceStatistics]]:
+	"""
+	yields (source, lines, statistics) for every source in source order, with lines None if the download failed
+	up to 'workers' sources are downloaded at once, and with a ParsePool parsed in other processes
+	with an archive, a source that fails falls back to its last known good copy, if that is young enough
+	with a CircuitBreaker, a source that keeps failing is skipped for a while
+	"""
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
+	with createSession(sources, connectionsPerHost) as session:
+		printError("begin downloading from {} {}".format(len(sources), "source" if len(sources) == 1 else "sources"))
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			allStatistics = [SourceStatistics() for _ in sources]
+			futures = [
+				None
+				if breaker is not None and breaker.getOpenUntil(source) is not None
+				else executor.submit(fetchSource, session, source, cache, statistics, parsePool, archive, policy)
+				for (source, statistics) in zip(sources, allStatistics)
+			]
+			for source, future, statistics in zip(sources, futures, allStatistics):
+				if report is not None:
+					report.addSource(source.name, statistics)
+				try:
+					if future is None:
+						breaker.check(source)
+					formattedLines = future.result()
+				except Exception as e:
+					statistics.failed = True
+					printError("download failed for '{}' - '{}'".format(source, e))
+					if breaker is not None and future is not None:
+						breaker.recordFailure(source)
+					formattedLines = loadFromArchive(source, archive, statistics) if archive is not None else None
+					if formattedLines is not None:
+						printError(createSourceDownloadSummary(source, len(formattedLines)))
+					yield (source, formattedLines, statistics)
+					continue
+				if breaker is not None:
+					breaker.recordSuccess(source)
+				printError(createSourceDownloadSummary(source, len(formattedLines)))
+				yield (source, formattedLines, statistics)
+	if breaker is not None:
+		breaker.save()
+
+
+def downloadSources(
+	sources,
+	workers: int = 1,
+	connectionsPerHost: int = DEFAULT_CONNECTIONS_PER_HOST,
+	cache=None,
+	report=None,
+	parsePool=None,
+	archive=None,
+	policy=None,
+	breaker=None,
+) -> List[str]:
+	"""
+	downloads lists of domain names from the sources, then normalizes and validates them
+	results and summaries are always in source order, however many workers are used
+	"""
 	lines: List[str] = []
+	for _, formattedLines, _ in fetchSources(sources, workers, connectionsPerHost, cache, report, parsePool, archive, policy, breaker):
+		if formattedLines is not None:
+			lines.extend(formattedLines)
+	return lines
+
+
+def streamSources(sources, cache=None, report=None, policy=None, breaker=None) -> Iterator[str]:
+	"""
+	yields the lines of every source in turn, downloading them one at a time
+	each source's time includes the work done on its lines further down the stream
+	"""
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
 	with requests.Session() as session:
 		printError("begin downloading from {} {}".format(len(sources), "source" if len(sources) == 1 else "sources"))
 		for source in sources:
+			statistics = SourceStatistics()
+			if report is not None:
+				report.addSource(source.name, statistics)
+			start = time.perf_counter()
 			try:
-				downloadedLines = downloadSource(session, source)
+				if breaker is not None:
+					breaker.check(source)
+				for line in streamSource(session, source, cache, statistics, policy):
+					statistics.linesOut += 1
+					yield line
+			except CircuitOpenError as e:
+				statistics.failed = True
+				printError("download failed for '{}' - '{}'".format(source, e))
+				continue
 			except Exception as e:
+				statistics.failed = True
 				printError("download failed for '{}' - '{}'".format(source, e))
+				if breaker is not None:
+					breaker.recordFailure(source)
 				continue
-			normalizedLines = map(normalize, downloadedLines)
-			wantedLines = filter(isValid, normalizedLines)
-			formattedLines = list(source.format(wantedLines))
-			lines.extend(formattedLines)
-			printError(createSourceDownloadSummary(source, len(formattedLines)))
-	return lines
+			finally:
+				statistics.seconds = time.perf_counter() - start
+			if breaker is not None:
+				breaker.recordSuccess(source)
+			printError(createSourceDownloadSummary(source, statistics.linesOut))
+	if breaker is not None:
+		breaker.save()
 
 
 def createSourceDownloadSummary(source, count) -> str:
@@ -226,15 +2070,26 @@ def sourceToString(source) -> str:
 
 
 class BaseSource:
+	# plain sources don't change their lines in format
+	_dialect = PLAIN
+
 	@property
 	def name(self) -> str:
 		return self._name
 
+	@property
+	def dialect(self):
+		"""
+		how parsers.parsePayload should read this source, or None to always use normalize, isValid and format
+		a source that overrides format must set a dialect that does exactly the same, or None
+		"""
+		return self._dialect
+
 	@property
 	def url(self) -> str:
 		return self._url
 
-	def format(self, lines: List[str]) -> List[str]:
+	def format(self, lines: Iterable[str]) -> Iterable[str]:
 		return lines
 
 	def __str__(self) -> str:
@@ -242,20 +2097,20 @@ class BaseSource:
 
 
 class MVPS(BaseSource):
+	_dialect = HOSTS_WITH_COMMENTS
+
 	def __init__(self) -> None:
 		self._name = "MVPS"
 		self._url = "http://winhelp2002.mvps.org/hosts.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			if line.__contains__("localhost"):
 				continue
 			line = str.replace(line, "0.0.0.0 ", "")
 			line = line.partition("#")[0]  # removes trailing comment if present
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class FirebogAdGuardDNS(BaseSource):
@@ -271,17 +2126,18 @@ class FirebogPrigentAds(BaseSource):
 
 
 class FirebogPrigentCrypto(BaseSource):
+	# removes 0.0.0.0 without the space, which no dialect does
+	_dialect = None
+
 	def __init__(self) -> None:
 		self._name = "Firebog Prigent Crypto"
 		self._url = "https://v.firebog.net/hosts/Prigent-Crypto.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			line = str.replace(line, "0.0.0.0", "")
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class FirebogPrigentMalware(BaseSource):
@@ -315,17 +2171,17 @@ class OSIntDigitalSide(BaseSource):
 
 
 class PolishFiltersTeamKADHosts(BaseSource):
+	_dialect = HOSTS
+
 	def __init__(self) -> None:
 		self._name = "Polish Filters Team KAD Hosts"
 		self._url = "https://raw.githubusercontent.com/PolishFiltersTeam/KADhosts/master/KADhosts.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			line = str.replace(line, "0.0.0.0 ", "")
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class PhishingArmyBlocklistExtended(BaseSource):
@@ -334,23 +2190,87 @@ class PhishingArmyBlocklistExtended(BaseSource):
 		self._url = "https://phishing.army/download/phishing_army_blocklist_extended.txt"
 
 
-def determineServerFormatter(serverArg: str):
+# the name the examples in the README load the zone as
+DEFAULT_RPZ_ZONE = "rpz.local"
+# the TTL given to every record in the zone file and in updates
+RPZ_TTL = 300
+# the most names Windows reads from one line of the HOSTS file
+MAX_HOSTS_PER_LINE = 9
+# address=/example.com/ answers NXDOMAIN for example.com and its subdomains, local=/example.com/ too, and never asks upstream
+DNSMASQ_DIRECTIVES = ("address", "local")
+
+
+def determineServerFormatter(serverArg: str, rpzZone: str = DEFAULT_RPZ_ZONE, hostsPerLine: int = 1, dnsmasqDirective: str = DNSMASQ_DIRECTIVES[0]):
 	serverArgLower = serverArg.lower()
 	if serverArgLower == "unbound":
 		return UnboundFormatter()
 	elif serverArgLower == "bind":
 		return BindFormatter()
 	elif serverArgLower == "winhosts":
-		return WindowsHostsFileFormatter()
+		return WindowsHostsFileFormatter(hostsPerLine)
+	elif serverArgLower == "rpz":
+		return RpzFormatter(zone=rpzZone)
+	elif serverArgLower == "dnsmasq":
+		return DnsmasqFormatter(dnsmasqDirective)
 	else:
 		raise UnknownServerTypeError(serverArg)
 
 
-class BaseFormatter:
+class BaseFormatter(ABC):
 	@property
 	def name(self):
 		return self._name
 
+	@property
+	def coversSubdomains(self) -> bool:
+		"""true if the server blocks every subdomain of a listed domain, e.g. a.example.com for example.com"""
+		return self._coversSubdomains
+
+	def getHeader(self) -> List[str]:
+		"""lines written before any domains"""
+		return []
+
+	@abstractmethod
+	def formatDomain(self, domain: str) -> List[str]:
+		"""the lines that block one domain, which every server writes differently"""
+
+	@property
+	def variableLinePrefix(self) -> Optional[str]:
+		"""how a line that changes every time the output is written starts, whatever the domains, so it doesn't count as a change"""
+		return None
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		"""formats one domain at a time, so the output never has to be held in memory"""
+		yield from self.getHeader()
+		for line in rejectLocalhost(lines):
+			yield from self.formatDomain(line)
+
+	def format(self, lines: Iterable[str]) -> List[str]:
+		return list(self.stream(lines))
+
+	@property
+	def supportsDelta(self) -> bool:
+		"""
+		true if a running server can be given added and removed domains without reloading everything
+		servers that can't have nothing to add, remove or run, rather than failing if asked
+		"""
+		return False
+
+	@property
+	def deltaUpdatesOutput(self) -> bool:
+		"""true if applying a delta changes the output itself, as BIND does to a dynamic zone's file, which mustn't then be rewritten under it"""
+		return False
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		return []
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		return []
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""the commands, and what to give each one on stdin, that apply formatted removals and additions to a running server"""
+		return []
+
 	def __str__(self) -> str:
 		return self.name
 
@@ -358,43 +2278,661 @@ class BaseFormatter:
 class UnboundFormatter(BaseFormatter):
 	def __init__(self) -> None:
 		self._name = "Unbound Formatter"
+		self._coversSubdomains = True
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = 'local-zone: "{}." always_nxdomain'.format(line)
-			formatted.append(line)
-		return formatted
+	def formatDomain(self, domain: str) -> List[str]:
+		return ['local-zone: "{}." always_nxdomain'.format(domain)]
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		"""bulk input for unbound-control local_zones"""
+		return ["{}. always_nxdomain".format(domain) for domain in domains]
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		"""bulk input for unbound-control local_zones_remove"""
+		return ["{}.".format(domain) for domain in domains]
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		commands = []
+		if len(removals) > 0:
+			commands.append((["unbound-control", "local_zones_remove"], "\n".join(removals) + "\n"))
+		if len(additions) > 0:
+			commands.append((["unbound-control", "local_zones"], "\n".join(additions) + "\n"))
+		return commands
 
 
 class BindFormatter(BaseFormatter):
 	def __init__(self) -> None:
 		self._name = "BIND Formatter"
+		self._coversSubdomains = True
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = 'zone "{}" {{ type master; file "/etc/bind/zones/db.poison"; }};'.format(line)
-			formatted.append(line)
-		return formatted
+	def formatDomain(self, domain: str) -> List[str]:
+		return ['zone "{}" {{ type master; file "/etc/bind/zones/db.poison"; }};'.format(domain)]
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		"""the zone statements added to the include"""
+		return [line for domain in domains for line in self.formatDomain(domain)]
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		"""the names of the zones taken out of the include"""
+		return list(domains)
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""
+		rndc reconfig reads the include that was just written, loading the zones added to it and dropping those removed,
+		without reloading the others, so the running server and the include never disagree, however many zones changed
+		"""
+		if len(additions) == 0 and len(removals) == 0:
+			return []
+		return [(["rndc", "reconfig"], None)]
 
 
 class WindowsHostsFileFormatter(BaseFormatter):
-	def __init__(self) -> None:
+	"""
+	with hostsPerLine above 1, lists that many domains after each address, which makes the file
+	far smaller and quicker for the DNS Client service to read
+	"""
+
+	def __init__(self, hostsPerLine: int = 1) -> None:
 		self._name = "Windows Hosts File Formatter"
+		self._coversSubdomains = False
+		self._hostsPerLine = hostsPerLine
+
+	@property
+	def hostsPerLine(self) -> int:
+		return self._hostsPerLine
+
+	def getHeader(self) -> List[str]:
+		return ["127.0.0.1 localhost", "::1 localhost", ""]
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["0.0.0.0 {}".format(domain)]
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		if self.hostsPerLine == 1:
+			yield from super().stream(lines)
+			return
+		yield from self.getHeader()
+		domains = rejectLocalhost(lines)
+		while True:
+			batch = list(itertools.islice(domains, self.hostsPerLine))
+			if len(batch) == 0:
+				return
+			yield "0.0.0.0 {}".format(" ".join(batch))
+
+
+class DnsmasqFormatter(BaseFormatter):
+	"""
+	dnsmasq matches every subdomain of a listed domain, so subdomains of listed domains are always left out
+	format sees every domain and leaves them all out, stream only those that come after their parent
+	"""
+
+	def __init__(self, directive: str = DNSMASQ_DIRECTIVES[0]) -> None:
+		self._name = "dnsmasq Formatter"
+		self._coversSubdomains = True
+		self._directive = directive
+
+	@property
+	def directive(self) -> str:
+		return self._directive
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["{}=/{}/".format(self.directive, domain)]
+
+	def stream(self, lines: Iterable[str]) -> Iterator[str]:
+		"""keeps the domains written so far in a trie, which shares their parents' labels, to find their subdomains"""
+		yield from self.getHeader()
+		written = DomainTrie()
+		for domain in rejectLocalhost(lines):
+			if written.hasBlockedParent(domain):
+				continue
+			written.add(domain)
+			yield from self.formatDomain(domain)
+
+	def format(self, lines: Iterable[str]) -> List[str]:
+		return list(super().stream(collapseSubdomains(list(lines))))
+
+
+class RpzFormatter(BaseFormatter):
+	"""
+	writes a single Response Policy Zone, which BIND and Unbound load far faster than one zone per domain
+	every domain gets a CNAME to the root, which RPZ treats as NXDOMAIN, for itself and its subdomains
+	"""
+
+	def __init__(self, serial=None, zone: str = DEFAULT_RPZ_ZONE) -> None:
+		self._name = "RPZ Formatter"
+		self._coversSubdomains = True
+		# a serial given here is used for every header, otherwise each header gets a new one
+		self._fixedSerial = serial
+		self._serial = serial if serial is not None else 0
+		self._zone = zone.rstrip(".")
+
+	@property
+	def serial(self) -> int:
+		"""the serial in the last header, or 0 before any header has been written"""
+		return self._serial
+
+	def getNextSerial(self) -> int:
+		"""
+		seconds since the epoch, which increase between runs and fit the 32-bit serial until 2106,
+		and at least one more than the last serial, for a formatter reused by the daemon that writes twice in a second
+		"""
+		if self._fixedSerial is not None:
+			return self._fixedSerial
+		return max(int(time.time()), self._serial + 1)
+
+	@property
+	def zone(self) -> str:
+		"""the name the zone is loaded as, which updates need because nsupdate only takes absolute names"""
+		return self._zone
+
+	def getHeader(self) -> List[str]:
+		self._serial = self.getNextSerial()
+		return [
+			"$TTL {}".format(RPZ_TTL),
+			"@ IN SOA localhost. root.localhost. ({} 60 60 60 60)".format(self.serial),
+			"@ IN NS localhost.",
+			"",
+		]
+
+	def formatDomain(self, domain: str) -> List[str]:
+		return ["{} CNAME .".format(domain), "*.{} CNAME .".format(domain)]
+
+	@property
+	def variableLinePrefix(self) -> Optional[str]:
+		"""the SOA record, whose serial is new every time"""
+		return "@ IN SOA "
+
+	@property
+	def supportsDelta(self) -> bool:
+		return True
+
+	@property
+	def deltaUpdatesOutput(self) -> bool:
+		return True
+
+	def formatUpdate(self, action: str, domains: List[str]) -> List[str]:
+		"""an nsupdate script, which BIND applies to the zone as an incremental (IXFR) change and bumps the serial for"""
+		if len(domains) == 0:
+			return []
+		lines = ["zone {}.".format(self.zone)]
+		for domain in domains:
+			for name in (domain, "*." + domain):
+				if action == "add":
+					lines.append("update add {}.{}. {} CNAME .".format(name, self.zone, RPZ_TTL))
+				else:
+					lines.append("update delete {}.{}. CNAME".format(name, self.zone))
+		lines.append("send")
+		return lines
+
+	def formatAdditions(self, domains: List[str]) -> List[str]:
+		return self.formatUpdate("add", domains)
+
+	def formatRemovals(self, domains: List[str]) -> List[str]:
+		return self.formatUpdate("delete", domains)
+
+	def getControlCommands(self, additions: List[str], removals: List[str]) -> List[Tuple[List[str], Optional[str]]]:
+		"""nsupdate -l uses the session key BIND creates for local updates, which the zone only accepts with update-policy local"""
+		return [(["nsupdate", "-l"], "\n".join(lines) + "\n") for lines in (removals, additions) if len(lines) > 0]
+
+
+def rejectLocalhost(lines: Iterable[str]) -> Iterator[str]:
+	"""blocking localhost would break the machine, so it is an error for any source to list it"""
+	for line in lines:
+		if line == "localhost":
+			raise LocalhostFoundError()
+		yield line
+
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+GZIP_LEVEL = 9
+# well past the point where higher levels cost far more time than they save bytes
+ZSTD_LEVEL = 12
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def getCompression(filename: str) -> Optional[str]:
+	"""how a file is compressed going by its extension, e.g. blackhole.txt.gz, or None for plain text"""
+	for extension, compression in COMPRESSIONS.items():
+		if filename.endswith(extension):
+			return compression
+	return None
+
+
+def isCompressionAvailable(compression: Optional[str]) -> bool:
+	return compression != "zstd" or zstandard is not None
+
+
+def createCompressor(file, compression: str):
+	"""
+	a binary stream that compresses what is written to it into file, and leaves file open when it is closed
+	gzip leaves the name and time out of its header, so the same lines always give the same bytes
+	"""
+	if compression == "gzip":
+		return gzip.GzipFile(filename="", mode="wb", fileobj=file, compresslevel=GZIP_LEVEL, mtime=0)
+	return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=False)
+
+
+def hashFile(path: str) -> bytes:
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+			digest.update(block)
+	return digest.digest()
+
+
+def openText(path: str, compression: Optional[str]):
+	"""reads back text written by AtomicOutputFile, unpacking it if it was compressed"""
+	if compression == "gzip":
+		return gzip.open(path, "rt", encoding="utf-8", errors="surrogateescape", newline="\n")
+	if compression == "zstd":
+		return io.TextIOWrapper(
+			zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8", errors="surrogateescape", newline="\n"
+		)
+	return open(path, "r", errors="surrogateescape")
+
+
+def isSameContent(first: str, second: str, compression: Optional[str] = None, ignoredPrefix: Optional[str] = None) -> bool:
+	"""
+	compares sizes first, so that only files that might be the same are hashed
+	with ignoredPrefix, compares the unpacked text line by line instead, leaving out lines that start with it in either file
+	"""
+	if ignoredPrefix is not None:
+		with openText(first, compression) as firstFile, openText(second, compression) as secondFile:
+			firstLines = (line for line in firstFile if not line.startswith(ignoredPrefix))
+			secondLines = (line for line in secondFile if not line.startswith(ignoredPrefix))
+			return all(firstLine == secondLine for (firstLine, secondLine) in itertools.zip_longest(firstLines, secondLines))
+	if os.path.getsize(first) != os.path.getsize(second):
+		return False
+	return hashFile(first) == hashFile(second)
+
+
+def copyOwnership(source: str, destination: str):
+	"""
+	gives destination the permissions of source, and its owner and group where allowed, before destination replaces it,
+	so that e.g. a root:bind 0640 include stays that way rather than taking the umask's
+	"""
+	status = os.stat(source)
+	if hasattr(os, "chown"):
+		try:
+			os.chown(destination, status.st_uid, status.st_gid)
+		except PermissionError:
+			# only root can give a file to another user, but anyone can give it a group they are in
+			try:
+				os.chown(destination, -1, status.st_gid)
+			except PermissionError:
+				pass
+	# after chown, which can clear the setuid and setgid bits
+	os.chmod(destination, stat.S_IMODE(status.st_mode))
+
+
+def syncDirectory(directory: str):
+	"""makes the rename itself survive a crash, where the platform allows opening a directory"""
+	if not hasattr(os, "O_DIRECTORY"):
+		return
+	descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+	try:
+		os.fsync(descriptor)
+	finally:
+		os.close(descriptor)
 
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = ["127.0.0.1 localhost", "::1 localhost", ""]
-		for line in lines:
-			if line == "localhost":
-				raise LocalhostFoundError()
-			line = "0.0.0.0 {}".format(line)
-			formatted.append(line)
-		return formatted
+
+class AtomicOutputFile:
+	"""
+	writes text to a temporary file beside filename, compressed if its extension asks for it,
+	then flushes it to disk and renames it over filename, so that a crash or a full disk never leaves half a file behind
+	if the new file has the same content as the old one, the old one is kept as it is and changed is false,
+	where lines starting with ignoredPrefix (such as a serial that changes every time) don't count
+	a file that is replaced keeps its permissions, and its owner and group where allowed
+	"""
+
+	def __init__(self, filename: str, bufferSize: int, ignoredPrefix: Optional[str] = None) -> None:
+		self._filename = filename
+		self._ignoredPrefix = ignoredPrefix
+		self._temporaryPath = filename + ".tmp"
+		self._bufferSize = bufferSize
+		self._file = None
+		self._compressor = None
+		self._text = None
+		self._changed = False
+
+	@property
+	def filename(self) -> str:
+		return self._filename
+
+	@property
+	def changed(self) -> bool:
+		return self._changed
+
+	def __enter__(self):
+		compression = getCompression(self._filename)
+		self._file = open(self._temporaryPath, "wb", buffering=self._bufferSize)
+		if compression is None:
+			# the same as open(filename, "w") would give
+			self._text = io.TextIOWrapper(self._file)
+		else:
+			self._compressor = createCompressor(self._file, compression)
+			self._text = io.TextIOWrapper(self._compressor, encoding="utf-8", newline="\n")
+		return self._text
+
+	def finish(self, keep: bool):
+		"""flushes every layer down to the temporary file, and on to the disk if it is going to be kept"""
+		try:
+			self._text.flush()
+			self._text.detach()
+			if self._compressor is not None:
+				self._compressor.close()
+			self._file.flush()
+			if keep:
+				os.fsync(self._file.fileno())
+		finally:
+			self._file.close()
+
+	def __exit__(self, exceptionType, *args):
+		try:
+			self.finish(exceptionType is None)
+		except BaseException:
+			os.remove(self._temporaryPath)
+			raise
+		if exceptionType is not None:
+			os.remove(self._temporaryPath)
+			return
+		if os.path.exists(self._filename):
+			if isSameContent(self._temporaryPath, self._filename, getCompression(self._filename), self._ignoredPrefix):
+				os.remove(self._temporaryPath)
+				return
+			copyOwnership(self._filename, self._temporaryPath)
+		os.replace(self._temporaryPath, self._filename)
+		syncDirectory(os.path.dirname(os.path.abspath(self._filename)))
+		self._changed = True
+
+
+# minutes
+DEFAULT_REFRESH_INTERVAL = 60
+# however briefly a server says a source stays fresh, it isn't downloaded more often than this, in seconds
+MIN_REFRESH_INTERVAL = 5 * 60
+# nor less often than this, however long it says
+MAX_REFRESH_INTERVAL = 24 * 3600
+
+
+class RefreshSchedule:
+	"""
+	when each source is next due, from how long its server said it stays fresh (Cache-Control or Expires),
+	or the default interval if it didn't say or the download failed
+	times are from time.monotonic(), like the wait between refreshes, so that setting the clock doesn't move them
+	"""
+
+	def __init__(self, defaultInterval: float) -> None:
+		self._defaultInterval = defaultInterval
+		self._due: Dict[str, float] = {}
+
+	def getDue(self, sources, now: float) -> List:
+		"""the sources due at now, including any that haven't been downloaded yet"""
+		return [source for source in sources if self._due.get(source.url, now) <= now]
+
+	def getNextDue(self) -> Optional[float]:
+		return min(self._due.values()) if len(self._due) > 0 else None
+
+	def schedule(self, source, freshFor: Optional[float], now: float) -> float:
+		"""sets when the source is next due, returning the interval in seconds"""
+		interval = self._defaultInterval if freshFor is None else min(max(freshFor, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+		self._due[source.url] = now + interval
+		return interval
+
+
+class DomainSet:
+	"""
+	the merged domains of every source held in memory, with how many sources list each domain,
+	so that a refreshed source only adds and removes what changed in it rather than merging every source again
+	domains keep the order in which they were first listed, like DomainStore
+	"""
+
+	def __init__(self) -> None:
+		self._sources: Dict[str, Dict[str, None]] = {}
+		self._counts: Dict[str, int] = {}
+
+	def __len__(self) -> int:
+		return len(self._counts)
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self._counts)
+
+	def updateSource(self, key: str, lines: Iterable[str]) -> bool:
+		"""replaces what the source listed last time with lines, returning true if the merged domains changed"""
+		listed = OrderedDict.fromkeys(lines)
+		stored = self._sources.get(key, {})
+		changed = False
+		for domain in listed:
+			if domain not in stored:
+				count = self._counts.get(domain, 0)
+				self._counts[domain] = count + 1
+				changed = changed or count == 0
+		for domain in stored:
+			if domain not in listed:
+				self._counts[domain] -= 1
+				if self._counts[domain] == 0:
+					del self._counts[domain]
+					changed = True
+		if len(listed) > 0:
+			self._sources[key] = listed
+		else:
+			self._sources.pop(key, None)
+		return changed
+
+
+def createStopEvent() -> threading.Event:
+	"""an event that is set by SIGTERM or Ctrl+C, so that the daemon stops between refreshes rather than midway"""
+	stopped = threading.Event()
+	for signalNumber in (signal.SIGINT, signal.SIGTERM):
+		signal.signal(signalNumber, lambda *args: stopped.set())
+	return stopped
+
+
+DEFAULT_SERVE_PORT = 8080
+# outputs that are compressed already aren't compressed again
+CONTENT_TYPES = {".gz": "application/gzip", ".zst": "application/zstd"}
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class PublishedFile:
+	"""one output held in memory as it was when it was published, with a gzip copy made once rather than per request"""
+
+	def __init__(self, path: str) -> None:
+		with open(path, "rb") as file:
+			self._content = file.read()
+		self._lastModified = formatdate(os.path.getmtime(path), usegmt=True)
+		digest = hashlib.sha256(self._content).hexdigest()
+		self._etag = '"{}"'.format(digest)
+		self._contentType = CONTENT_TYPES.get(os.path.splitext(path)[1], TEXT_CONTENT_TYPE)
+		self._gzipped = None
+		self._gzipEtag = None
+		if self._contentType == TEXT_CONTENT_TYPE:
+			self._gzipped = gzip.compress(self._content, mtime=0)
+			# a different representation needs a different strong ETag
+			self._gzipEtag = '"{}-gzip"'.format(digest)
+
+	@property
+	def lastModified(self) -> str:
+		return self._lastModified
+
+	@property
+	def contentType(self) -> str:
+		return self._contentType
+
+	def getVariant(self, acceptsGzip: bool) -> Tuple[bytes, str, bool]:
+		"""the bytes to send, their ETag, and whether they are gzip encoded"""
+		if acceptsGzip and self._gzipped is not None:
+			return (self._gzipped, self._gzipEtag, True)
+		return (self._content, self._etag, False)
+
+
+class Publisher:
+	"""the outputs being served, by the name they are served as, swapped whole so a request never sees half an update"""
+
+	def __init__(self) -> None:
+		self._files: Dict[str, PublishedFile] = {}
+		self._lock = threading.Lock()
+
+	def publish(self, path: str):
+		published = PublishedFile(path)
+		with self._lock:
+			self._files[os.path.basename(path)] = published
+		printError("serving {} as /{}".format(os.path.abspath(path), os.path.basename(path)))
+
+	def find(self, name: str) -> Optional[PublishedFile]:
+		with self._lock:
+			return self._files.get(name)
+
+
+def parseQuality(parameters: str) -> float:
+	"""the q value among a coding's parameters, e.g. q=0.5, which is 1 if there is none and 0 if it can't be parsed"""
+	for parameter in parameters.split(";"):
+		(name, _, value) = parameter.partition("=")
+		if name.strip().lower() == "q":
+			try:
+				return min(max(float(value.strip()), 0.0), 1.0)
+			except ValueError:
+				return 0.0
+	return 1.0
+
+
+def acceptsGzip(header: Optional[str]) -> bool:
+	"""
+	if Accept-Encoding allows gzip, going by its q value, or by that of * when gzip isn't listed
+	gzip;q=0 refuses gzip, and no header at all is taken to mean the client wants the file as it is
+	"""
+	if header is None:
+		return False
+	qualities: Dict[str, float] = {}
+	for item in header.split(","):
+		(coding, _, parameters) = item.partition(";")
+		coding = coding.strip().lower()
+		if coding == "x-gzip":
+			coding = "gzip"
+		if len(coding) > 0:
+			qualities[coding] = max(qualities.get(coding, 0.0), parseQuality(parameters))
+	return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def matchesEtag(header: Optional[str], etag: str) -> bool:
+	"""if If-None-Match lists the ETag, weakly compared as the header requires, or is *"""
+	if header is None:
+		return False
+	candidates = [candidate.strip() for candidate in header.split(",")]
+	return "*" in candidates or etag in [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+
+
+def parseRange(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+	"""
+	the first and last byte asked for by a single range such as bytes=0-499, bytes=500- or bytes=-500
+	None if the whole file should be sent instead, as it is for several ranges or a header that can't be parsed
+	raises ValueError if the range lies outside the file
+	"""
+	if header is None or not header.startswith("bytes=") or "," in header:
+		return None
+	(first, dash, last) = header[len("bytes=") :].strip().partition("-")
+	if dash == "" or first == last == "" or not all(part == "" or part.isdigit() for part in (first, last)):
+		return None
+	if first == "":
+		suffixLength = int(last)
+		if suffixLength == 0:
+			raise ValueError(header)
+		return (max(length - suffixLength, 0), length - 1)
+	start = int(first)
+	end = min(int(last), length - 1) if last != "" else length - 1
+	if start >= length or start > end:
+		raise ValueError(header)
+	return (start, end)
+
+
+class PublishHandler(BaseHTTPRequestHandler):
+	"""serves the published outputs with strong ETags, conditional GETs, single byte ranges and gzip"""
+
+	server_version = "pyhosts"
+
+	def log_message(self, format, *args):
+		printError("{} - {}".format(self.address_string(), format % args))
+
+	def do_HEAD(self):
+		self.respond(False)
+
+	def do_GET(self):
+		self.respond(True)
+
+	def respond(self, sendBody: bool):
+		published = self.server.publisher.find(unquote(urlparse(self.path).path).lstrip("/"))
+		if published is None:
+			self.send_error(404)
+			return
+		(content, etag, gzipped) = published.getVariant(acceptsGzip(self.headers.get("Accept-Encoding")))
+		if matchesEtag(self.headers.get("If-None-Match"), etag):
+			self.send_response(304)
+			self.sendValidators(published, etag)
+			self.end_headers()
+			return
+		byteRange = None
+		ifRange = self.headers.get("If-Range")
+		if ifRange is None or ifRange == etag:
+			try:
+				byteRange = parseRange(self.headers.get("Range"), len(content))
+			except ValueError:
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */{}".format(len(content)))
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+		if byteRange is None:
+			self.send_response(200)
+			body = content
+		else:
+			(start, end) = byteRange
+			self.send_response(206)
+			self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(content)))
+			body = content[start : end + 1]
+		self.send_header("Content-Type", published.contentType)
+		if gzipped:
+			self.send_header("Content-Encoding", "gzip")
+		self.send_header("Content-Length", str(len(body)))
+		self.sendValidators(published, etag)
+		self.end_headers()
+		if sendBody:
+			self.wfile.write(body)
+
+	def sendValidators(self, published: PublishedFile, etag: str):
+		self.send_header("ETag", etag)
+		self.send_header("Last-Modified", published.lastModified)
+		self.send_header("Accept-Ranges", "bytes")
+		self.send_header("Vary", "Accept-Encoding")
+
+
+def startServer(publisher: Publisher, host: str, port: int) -> ThreadingHTTPServer:
+	"""serves the publisher's outputs from a background thread until shutdown() is called"""
+	server = ThreadingHTTPServer((host, port), PublishHandler)
+	server.daemon_threads = True
+	server.publisher = publisher
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	printError("serving on http://{}:{}/".format(host or "0.0.0.0", server.server_port))
+	return server
+
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+# in hours, a week of failed downloads is as long as a source's last known good copy is trusted
+DEFAULT_MAX_ARCHIVE_AGE = 7 * 24
+# what the blacklist file is stored as in a DomainStore, which can't clash with a source's url
+BLACKLIST_KEY = "blacklist.txt"
 
 
 def combineWithScriptDirectory(filename):
@@ -428,6 +2966,110 @@ def removeDupes(lines: List[str]) -> List[str]:
 	return list(OrderedDict.fromkeys(lines))
 
 
+class WhitelistIndex:
+	"""exact rules are looked up in a set, suffix rules (*.example.com or .example.com) by walking a domain's parents"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		self._exact = set()
+		self._suffixes = {}
+		for rule in whitelist:
+			if isSuffixRule(rule):
+				self._suffixes[rule.lstrip("*.")] = rule
+			else:
+				self._exact.add(rule)
+
+	def findRule(self, domain: str) -> Optional[str]:
+		"""returns the whitelist rule that spares the domain, or None if it should stay blocked"""
+		if domain in self._exact:
+			return domain
+		if len(self._suffixes) == 0:
+			return None
+		if domain in self._suffixes:
+			return self._suffixes[domain]
+		for parent in getParentDomains(domain):
+			if parent in self._suffixes:
+				return self._suffixes[parent]
+		return None
+
+
+def removeWhitelisted(lines: List[str], whitelist: List[str]) -> Tuple[List[str], List[str], int]:
+	"""
+	removes whitelisted domains in a single pass, keeping the order of the rest
+	returns the remaining lines, the whitelist rules that saved at least one domain, and how many domains were saved
+	"""
+	index = WhitelistIndex(whitelist)
+	remaining: List[str] = []
+	usedRules = set()
+	savedCount = 0
+	for line in lines:
+		rule = index.findRule(line)
+		if rule is None:
+			remaining.append(line)
+		else:
+			usedRules.add(rule)
+			savedCount += 1
+	savedVia = [rule for rule in removeDupes(whitelist) if rule in usedRules]
+	return (remaining, savedVia, savedCount)
+
+
+class WhitelistFilter:
+	"""drops whitelisted domains from a stream as they go past, remembering which rules saved them"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		self._whitelist = whitelist
+		self._index = WhitelistIndex(whitelist)
+		self._usedRules = set()
+		self._totalCount = 0
+		self._savedCount = 0
+
+	@property
+	def totalCount(self) -> int:
+		return self._totalCount
+
+	@property
+	def savedCount(self) -> int:
+		return self._savedCount
+
+	@property
+	def savedVia(self) -> List[str]:
+		return [rule for rule in removeDupes(self._whitelist) if rule in self._usedRules]
+
+	def isWhitelisted(self, line: str) -> bool:
+		rule = self._index.findRule(line)
+		if rule is None:
+			return False
+		self._usedRules.add(rule)
+		self._savedCount += 1
+		return True
+
+	def filter(self, lines: Iterable[str]) -> Iterator[str]:
+		for line in lines:
+			self._totalCount += 1
+			if not self.isWhitelisted(line):
+				yield line
+
+
+class UniqueDomainFilter(WhitelistFilter):
+	"""drops duplicate and whitelisted domains from a stream as they go past, holding only the domains seen so far"""
+
+	def __init__(self, whitelist: List[str]) -> None:
+		super().__init__(whitelist)
+		self._seen = set()
+
+	@property
+	def uniqueCount(self) -> int:
+		return len(self._seen)
+
+	def filter(self, lines: Iterable[str]) -> Iterator[str]:
+		for line in lines:
+			self._totalCount += 1
+			if line in self._seen:
+				continue
+			self._seen.add(line)
+			if not self.isWhitelisted(line):
+				yield line
+
+
 def readLines(path) -> List[str]:
 	with open(path, "r") as file:
 		if not file.readable:
@@ -435,77 +3077,804 @@ def readLines(path) -> List[str]:
 		return list(filter(lambda x: not x.startswith("#") and len(x) > 0, file.read().splitlines()))
 
 
-def writeLinesToStdOut(lines: List[str]):
-	print("\n".join(lines), file=sys.stdout)
+def writeLinesToStream(lines: Iterator[str], stream):
+	"""writes the lines separated by newlines one at a time, rather than joining them into one string first"""
+	for line in lines:
+		stream.write(line)
+		stream.write("\n")
 
 
-def writeLinesToFile(lines, filename):
-	if len(lines) > 0:
-		with open(filename, "w") as file:
-			if not file.writable:
-				raise FileWriteError(filename)
-			file.write("\n".join(lines))
+def writeLinesToStdOut(lines: Iterable[str]):
+	writeLinesToStream(iter(lines), sys.stdout)
+
+
+def writeLinesToFile(lines: Iterable[str], filename, ignoredPrefix: Optional[str] = None):
+	"""with ignoredPrefix, the file is only replaced if a line that doesn't start with it changed"""
+	lines = iter(lines)
+	firstLine = next(lines, None)
+	if firstLine is None:
+		printError("no lines to write")
+		return
+	output = AtomicOutputFile(filename, WRITE_BUFFER_SIZE, ignoredPrefix)
+	with output as file:
+		if not file.writable:
+			raise FileWriteError(filename)
+		file.write(firstLine)
+		for line in lines:
+			file.write("\n")
+			file.write(line)
+	if output.changed:
 		printError("file written to {}".format(os.path.abspath(filename)))
 	else:
-		printError("no lines to write")
+		printError("{} is unchanged, left as it is".format(os.path.abspath(filename)))
 
 
-def writeLines(lines, filename):
+def writeLines(lines, filename, ignoredPrefix: Optional[str] = None):
 	if filename is None:
 		writeLinesToStdOut(lines)
 	else:
-		writeLinesToFile(lines, filename)
+		writeLinesToFile(lines, filename, ignoredPrefix)
+
+
+def collapseForServer(lines: List[str], serverFormatter) -> List[str]:
+	"""removes subdomains of blocked domains, but only for servers that block subdomains themselves"""
+	if not serverFormatter.coversSubdomains:
+		printError("not collapsing subdomains, {} does not block them".format(serverFormatter.name))
+		return lines
+	collapsed = collapseSubdomains(lines)
+	removedCount = len(lines) - len(collapsed)
+	printError("collapsed {} subdomain(s) covered by a blocked parent ({} -> {})".format(removedCount, len(lines), len(collapsed)))
+	return collapsed
+
+
+def printWhitelistSummary(savedVia: List[str], savedCount: int):
+	if savedCount > 0:
+		printError("{} domain(s) saved via whitelisting ({})".format(savedCount, ", ".join(savedVia)))
+	else:
+		printError("no domains saving via whitelisting")
+
+
+class Target:
+	"""one output of a run, the server type to format the domains for and the file to write them to (None for stdout)"""
+
+	def __init__(self, serverFormatter, filename: Optional[str]) -> None:
+		self._serverFormatter = serverFormatter
+		self._filename = filename
+
+	@property
+	def serverFormatter(self):
+		return self._serverFormatter
+
+	@property
+	def filename(self) -> Optional[str]:
+		return self._filename
+
+	@property
+	def deltaName(self) -> str:
+		"""what this target's delta files are called"""
+		return os.path.basename(self.filename) if self.filename is not None else "stdout"
 
 
-def process(serverFormatter, filename):
-	printError("using {}".format(serverFormatter.name))
+def processStreaming(target, cache, report, memoryBudget, policy, breaker):
+	"""
+	downloads, filters, formats and writes one line at a time
+	peak memory is the set of unique domains, instead of several copies of every line
+	with a memory budget, duplicates are removed on disk instead, so not even that set is held
+	"""
+	with report.stage("stream") as stage:
+		lines = itertools.chain(loadBlacklist(), streamSources(getSources(), cache, report, policy, breaker))
+		if memoryBudget is None:
+			uniqueFilter = UniqueDomainFilter(loadWhitelist())
+			writeLines(target.serverFormatter.stream(uniqueFilter.filter(lines)), target.filename, target.serverFormatter.variableLinePrefix)
+			(totalCount, uniqueCount) = (uniqueFilter.totalCount, uniqueFilter.uniqueCount)
+		else:
+			deduplicator = ExternalDeduplicator(memoryBudget)
+			uniqueFilter = WhitelistFilter(loadWhitelist())
+			writeLines(
+				target.serverFormatter.stream(uniqueFilter.filter(deduplicator.deduplicate(lines))),
+				target.filename,
+				target.serverFormatter.variableLinePrefix,
+			)
+			(totalCount, uniqueCount) = (deduplicator.totalCount, deduplicator.uniqueCount)
+			printError("removed duplicates with {} temporary file(s)".format(deduplicator.runCount))
+		stage.linesIn = totalCount
+		stage.linesOut = uniqueCount - uniqueFilter.savedCount
+	printError("finished downloading ({} total, {} unique)".format(totalCount, uniqueCount))
+	printWhitelistSummary(uniqueFilter.savedVia, uniqueFilter.savedCount)
+
+
+def writeTarget(target, lines: List[str], stageSuffix: str, report, deltaWriter):
+	"""formats and writes the shared domains for one target, leaving them untouched for the others"""
+	if deltaWriter is not None and os.path.exists(target.filename) and deltaWriter.isAppliedInPlace(target.deltaName, target.serverFormatter):
+		printError("{} is kept up to date by the server, only the delta is applied to it".format(target.filename))
+	else:
+		with report.stage("format" + stageSuffix, len(lines)) as stage:
+			formattedForServer = target.serverFormatter.format(lines)
+			stage.linesOut = len(formattedForServer)
+		with report.stage("write" + stageSuffix, len(formattedForServer)):
+			writeLines(formattedForServer, target.filename, target.serverFormatter.variableLinePrefix)
+	if deltaWriter is not None:
+		with report.stage("delta" + stageSuffix, len(lines)) as stage:
+			delta = deltaWriter.write(target.deltaName, target.serverFormatter, lines)
+			stage.linesOut = len(delta.added) + len(delta.removed) if delta is not None else None
+
+
+def writeTargets(targets: List[Target], lines: List[str], collapse: bool, report, deltaWriter=None, sort: bool = False):
+	"""
+	writes every target from the same domains, one thread per target
+	targets whose servers block subdomains share a single collapsed copy of the domains
+	"""
+	if sort:
+		with report.stage("sort", len(lines)):
+			lines = sorted(lines)
+	collapsed = None
+	jobs = []
+	for target in targets:
+		targetLines = lines
+		if collapse and target.serverFormatter.coversSubdomains:
+			if collapsed is None:
+				with report.stage("collapse", len(lines)) as stage:
+					collapsed = collapseForServer(lines, target.serverFormatter)
+					stage.linesOut = len(collapsed)
+			targetLines = collapsed
+		elif collapse:
+			collapseForServer(lines, target.serverFormatter)
+		stageSuffix = "" if len(targets) == 1 else " {}".format(target.filename)
+		jobs.append((target, targetLines, stageSuffix))
+	if len(jobs) == 1:
+		writeTarget(*jobs[0], report, deltaWriter)
+		return
+	with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+		futures = [executor.submit(writeTarget, *job, report, deltaWriter) for job in jobs]
+		for future in futures:
+			future.result()
+
+
+def writeDomainSnapshot(lines: List[str], path: Optional[str], report):
+	"""the blocked domains, before any collapsing or formatting, for other tools to look up with DomainSetReader"""
+	if path is None:
+		return
+	with report.stage("snapshot", len(lines)) as stage:
+		stage.linesOut = writeSnapshot(lines, path)
+	printError("snapshot of {} domain(s) written to {}".format(stage.linesOut, os.path.abspath(path)))
+
+
+def writeDomainBloomFilter(lines: List[str], path: Optional[str], falsePositiveRate: float, report):
+	"""the blocked domains as a Bloom filter, for tools that can afford a false alarm but not the whole list"""
+	if path is None:
+		return
+	with report.stage("bloom", len(lines)) as stage:
+		(stage.linesOut, size) = writeBloomFilter(lines, path, falsePositiveRate)
+	printError("Bloom filter of {} domain(s) in {} bytes written to {}".format(stage.linesOut, size, os.path.abspath(path)))
+
+
+def writeDomainExports(lines: List[str], options, report):
+	writeDomainSnapshot(lines, options.snapshotPath, report)
+	writeDomainBloomFilter(lines, options.bloomPath, options.bloomFalsePositiveRate, report)
+
+
+def createDownloadPolicy(options) -> DownloadPolicy:
+	return DownloadPolicy(options.connectTimeout, options.readTimeout, options.retries, downloadTimeout=options.downloadTimeout)
+
+
+def openCircuitBreaker(options) -> Optional[CircuitBreaker]:
+	return CircuitBreaker(options.breakerPath) if options.breakerPath is not None else None
+
+
+def fetchOrLoadSources(sources, options, cache, report, parsePool, archive):
+	"""with --offline every source comes from its last known good copy, otherwise it is downloaded"""
+	if options.offline:
+		return loadArchivedSources(sources, archive, report)
+	return fetchSources(
+		sources,
+		options.workers,
+		options.connectionsPerHost,
+		cache,
+		report,
+		parsePool,
+		archive,
+		createDownloadPolicy(options),
+		openCircuitBreaker(options),
+	)
+
+
+def processInMemory(targets, options, cache, report, deltaWriter, parsePool, archive):
 	lines: List[str] = []
-	lines.extend(loadBlacklist())
-	downloaded = downloadSources(getSources())
-	lines.extend(downloaded)
-	uniqueLines = removeDupes(lines)
+	# (source name, lines) for the lookup index, which shares the lines rather than copying them
+	listings: List[Tuple[str, List[str]]] = []
+	with report.stage("download") as stage:
+		blacklist = loadBlacklist()
+		lines.extend(blacklist)
+		listings.append((BLACKLIST_KEY, blacklist))
+		for source, formattedLines, _ in fetchOrLoadSources(getSources(), options, cache, report, parsePool, archive):
+			if formattedLines is not None:
+				lines.extend(formattedLines)
+				listings.append((source.name, formattedLines))
+		stage.linesOut = len(lines)
+	with report.stage("dedup", len(lines)) as stage:
+		uniqueLines = removeDupes(lines)
+		stage.linesOut = len(uniqueLines)
 	printError("finished downloading ({} total, {} unique)".format(len(lines), len(uniqueLines)))
-	savedViaWhitelist = []
-	for whitelisted in loadWhitelist():
-		if whitelisted in uniqueLines:
-			uniqueLines.remove(whitelisted)
-			savedViaWhitelist.append(whitelisted)
-	if len(savedViaWhitelist) > 0:
-		printError("{} domain(s) saved via whitelisting ({})".format(len(savedViaWhitelist), ", ".join(savedViaWhitelist)))
+	whitelist = loadWhitelist()
+	with report.stage("whitelist", len(uniqueLines)) as stage:
+		(uniqueLines, savedViaWhitelist, savedCount) = removeWhitelisted(uniqueLines, whitelist)
+		stage.linesOut = len(uniqueLines)
+	printWhitelistSummary(savedViaWhitelist, savedCount)
+	if options.indexPath is not None:
+		with report.stage("index", len(lines)):
+			writeSourceIndex(options.indexPath, listings, whitelist)
+		printError("lookup index written to {}".format(os.path.abspath(options.indexPath)))
+	writeDomainExports(uniqueLines, options, report)
+	writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+
+
+def processIncremental(targets, options, cache, report, deltaWriter, parsePool, archive):
+	"""
+	applies only what changed in each source since the last run to the domains kept in options.storePath
+	with --cache, sources that haven't changed upstream cost nothing beyond the conditional request
+	"""
+	whitelist = loadWhitelist()
+	index = WhitelistIndex(whitelist)
+	with DomainStore(options.storePath) as store:
+		with report.stage("whitelist"):
+			if store.updateWhitelist(whitelist, index.findRule):
+				printError("whitelist changed, checking every stored domain again")
+		with report.stage("download") as stage:
+			sources = getSources()
+			storedKeys = set(store.getSourceKeys())
+			changes = [store.updateSource(BLACKLIST_KEY, loadBlacklist(), index.findRule)]
+			for source, formattedLines, statistics in fetchOrLoadSources(sources, options, cache, report, parsePool, archive):
+				# a failed source keeps what it listed last time, an unchanged one has nothing to apply
+				if formattedLines is None or (statistics.notModified and source.url in storedKeys):
+					continue
+				changes.append(store.updateSource(source.url, formattedLines, index.findRule))
+			configuredKeys = set([BLACKLIST_KEY] + [source.url for source in sources])
+			for key in storedKeys - configuredKeys:
+				changes.append((0, store.removeSource(key)))
+			addedCount = sum(added for (added, _) in changes)
+			removedCount = sum(removed for (_, removed) in changes)
+			changedCount = sum(1 for (added, removed) in changes if added + removed > 0)
+			stage.linesOut = addedCount + removedCount
+		printError("{} changed source(s), {} domain listing(s) added, {} removed".format(changedCount, addedCount, removedCount))
+		savedCounts = store.countWhitelisted()
+		savedVia = [rule for rule in removeDupes(whitelist) if rule in savedCounts]
+		printWhitelistSummary(savedVia, sum(savedCounts.values()))
+		uniqueLines = list(store.getBlockedDomains())
+		printError("{} unique domain(s) stored, {} blocked".format(store.countDomains(), len(uniqueLines)))
+		writeDomainExports(uniqueLines, options, report)
+		writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+
+
+def publishTargets(targets, publisher):
+	"""serves the outputs as they are now on disk, if they are being served"""
+	if publisher is None:
+		return
+	for target in targets:
+		if os.path.exists(target.filename):
+			publisher.publish(target.filename)
+
+
+def processDaemon(targets, options, cache, deltaWriter, parsePool, archive, publisher):
+	"""
+	keeps every source's domains in memory and downloads each source again when it is due, until stopped
+	the outputs are only written again when the blocked domains change, and each refresh writes its own report
+	a refresh that fails is logged and tried again within MIN_REFRESH_INTERVAL seconds, rather than stopping the daemon
+	"""
+	cache = cache if cache is not None else MemoryCache()
+	sources = getSources()
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
+	schedule = RefreshSchedule(options.refreshInterval * 60)
+	domains = DomainSet()
+	whitelist: Optional[List[str]] = None
+	# true after a failed refresh, whose outputs might not have been written
+	failed = False
+	stopped = createStopEvent()
+	while not stopped.is_set():
+		report = RunReport(options.traceMemory)
+		now = time.monotonic()
+		due = schedule.getDue(sources, now)
+		try:
+			with report.stage("download") as stage:
+				changed = domains.updateSource(BLACKLIST_KEY, loadBlacklist()) or failed
+				# only the blacklist and whitelist are checked again when no source is due
+				if len(due) > 0:
+					for source, formattedLines, statistics in fetchOrLoadSources(due, options, cache, report, parsePool, archive):
+						schedule.schedule(source, None if statistics.failed else statistics.freshFor, now)
+						# a failed source keeps what it listed last time
+						if formattedLines is not None:
+							changed = domains.updateSource(source.url, formattedLines) or changed
+				stage.linesOut = len(domains)
+			latestWhitelist = loadWhitelist()
+			if latestWhitelist != whitelist:
+				whitelist = latestWhitelist
+				changed = True
+			if changed:
+				with report.stage("whitelist", len(domains)) as stage:
+					(uniqueLines, savedViaWhitelist, savedCount) = removeWhitelisted(list(domains), whitelist)
+					stage.linesOut = len(uniqueLines)
+				printWhitelistSummary(savedViaWhitelist, savedCount)
+				writeDomainExports(uniqueLines, options, report)
+				writeTargets(targets, uniqueLines, options.collapse, report, deltaWriter, options.sort)
+				publishTargets(targets, publisher)
+			else:
+				printError("no domains changed, outputs left as they are")
+			writeReports(report, options)
+			failed = False
+		except Exception as e:
+			failed = True
+			printError("refresh failed - '{}'".format(e))
+			# sources that the failure left unscheduled are tried again soon rather than straight away
+			for source in schedule.getDue(due, now):
+				schedule.schedule(source, MIN_REFRESH_INTERVAL, now)
+		delay = max(schedule.getNextDue() - time.monotonic(), 0)
+		if failed:
+			delay = min(delay, MIN_REFRESH_INTERVAL)
+		printError("next refresh at {}".format(time.strftime("%H:%M:%S", time.localtime(time.time() + delay))))
+		stopped.wait(delay)
+	printError("stopped")
+
+
+class LookupResult:
+	"""why a domain is or isn't blocked, according to the run that built the lookup index"""
+
+	def __init__(self, domain: str, listedBy: List[str], parents: List[Tuple[str, List[str]]], whitelistRule: Optional[str]) -> None:
+		self._domain = domain
+		self._listedBy = listedBy
+		self._parents = parents
+		self._whitelistRule = whitelistRule
+
+	@property
+	def domain(self) -> str:
+		return self._domain
+
+	@property
+	def listedBy(self) -> List[str]:
+		"""the sources that listed the domain itself, including the blacklist"""
+		return self._listedBy
+
+	@property
+	def parents(self) -> List[Tuple[str, List[str]]]:
+		"""each blocked parent of the domain, nearest first, with the sources that listed it"""
+		return self._parents
+
+	@property
+	def whitelistRule(self) -> Optional[str]:
+		return self._whitelistRule
+
+	@property
+	def blacklisted(self) -> bool:
+		"""true if the blacklist lists the domain itself or one of its blocked parents"""
+		return BLACKLIST_KEY in self.listedBy or any(BLACKLIST_KEY in listedBy for (_, listedBy) in self.parents)
+
+	def getVerdict(self) -> str:
+		if len(self.listedBy) > 0 and self.whitelistRule is None:
+			return "blocked by blacklist" if self.blacklisted else "blocked"
+		if len(self.parents) > 0:
+			# the whitelist only removes the domain's own entry, a blocked parent still covers it
+			return "blocked via parent by blacklist" if self.blacklisted else "blocked via parent"
+		if len(self.listedBy) > 0:
+			return "whitelisted"
+		return "not listed"
+
+	def describe(self) -> str:
+		details = []
+		if len(self.listedBy) > 0:
+			details.append("listed by {}".format(describeListers(self.listedBy)))
+		for parent, listedBy in self.parents:
+			details.append("parent {} listed by {} (blocks subdomains on unbound, bind and rpz)".format(parent, describeListers(listedBy)))
+		if self.whitelistRule is not None:
+			details.append("whitelist rule {}".format(self.whitelistRule))
+		return "\t".join([self.domain, self.getVerdict()] + details)
+
+
+def describeListers(listedBy: List[str]) -> str:
+	"""the sources that listed a domain, naming the blacklist as such rather than as if it were a source"""
+	return ", ".join("the blacklist ({})".format(name) if name == BLACKLIST_KEY else name for name in listedBy)
+
+
+def lookupDomains(index: SourceIndex, domains: List[str]) -> List[LookupResult]:
+	"""looks up every domain and all of its parents in one batch"""
+	domains = [normalizeQuery(domain) for domain in domains]
+	whitelistIndex = WhitelistIndex(index.getWhitelist())
+	candidates = set(domains)
+	for domain in domains:
+		candidates.update(getParentDomains(domain))
+	found = index.findSources(candidates)
+	results = []
+	for domain in domains:
+		# a whitelisted parent was left out of the output, so it blocks nothing
+		parents = [(parent, found[parent]) for parent in getParentDomains(domain) if parent in found and whitelistIndex.findRule(parent) is None]
+		results.append(LookupResult(domain, found.get(domain, []), parents, whitelistIndex.findRule(domain)))
+	return results
+
+
+def lookup(args: List[str]):
+	(domains, options) = parseOptions(args)
+	if options.indexPath is None:
+		raise UsageError("lookup requires --index, the file written by a run with --index")
+	if options.domainsPath is not None:
+		domains.extend(readLines(options.domainsPath))
+	if len(domains) == 0:
+		raise UsageError("lookup requires at least one domain, or --domains=FILE")
+	with SourceIndex(options.indexPath) as index:
+		results = lookupDomains(index, domains)
+	writeLinesToStdOut(result.describe() for result in results)
+
+
+def writeReports(report, options):
+	if options.reportPath is not None:
+		report.writeJson(options.reportPath)
+		printError("report written to {}".format(os.path.abspath(options.reportPath)))
+	if options.prometheusPath is not None:
+		report.writePrometheus(options.prometheusPath)
+		printError("metrics written to {}".format(os.path.abspath(options.prometheusPath)))
+
+
+def process(targets: List[Target], options):
+	for target in targets:
+		printError("using {}".format(target.serverFormatter.name))
+	report = RunReport(options.traceMemory)
+	cache = SourceCache(options.cacheDirectory) if options.cacheDirectory is not None else None
+	archive = None
+	if options.archiveDirectory is not None:
+		archive = SourceArchive(options.archiveDirectory, options.maxArchiveAge * 3600)
+	deltaWriter = None
+	if options.deltaDirectory is not None:
+		deltaWriter = DeltaWriter(options.deltaDirectory, ControlRunner() if options.applyDelta else None)
+	publisher = Publisher() if options.serveAddress is not None else None
+	server = startServer(publisher, *options.serveAddress) if publisher is not None else None
+	if options.stream:
+		memoryBudget = options.memoryBudget * 1024 * 1024 if options.memoryBudget is not None else None
+		processStreaming(targets[0], cache, report, memoryBudget, createDownloadPolicy(options), openCircuitBreaker(options))
 	else:
-		printError("no domains saving via whitelisting")
-	formattedForServer = serverFormatter.format(uniqueLines)
-	writeLines(formattedForServer, filename)
+		with ParsePool(options.parseProcesses) if options.parseProcesses is not None else contextlib.nullcontext() as parsePool:
+			if options.daemon:
+				processDaemon(targets, options, cache, deltaWriter, parsePool, archive, publisher)
+			elif options.storePath is not None:
+				processIncremental(targets, options, cache, report, deltaWriter, parsePool, archive)
+			else:
+				processInMemory(targets, options, cache, report, deltaWriter, parsePool, archive)
+	if not options.daemon:
+		writeReports(report, options)
+		publishTargets(targets, publisher)
+	if server is not None:
+		if not options.daemon:
+			printError("serving until stopped")
+			createStopEvent().wait()
+		server.shutdown()
+
+
+class Options:
+	"""settings given on the command line as --name or --name=value"""
+
+	def __init__(self) -> None:
+		self.workers = 1
+		self.connectionsPerHost = DEFAULT_CONNECTIONS_PER_HOST
+		self.cacheDirectory = None
+		self.collapse = False
+		self.sort = False
+		self.overwrite = False
+		self.daemon = False
+		self.refreshInterval = DEFAULT_REFRESH_INTERVAL
+		self.serveAddress = None
+		self.hostsPerLine = 1
+		self.dnsmasqDirective = DNSMASQ_DIRECTIVES[0]
+		self.stream = False
+		self.reportPath = None
+		self.prometheusPath = None
+		self.traceMemory = False
+		self.storePath = None
+		self.deltaDirectory = None
+		self.applyDelta = False
+		self.rpzZone = DEFAULT_RPZ_ZONE
+		self.snapshotPath = None
+		self.bloomPath = None
+		self.bloomFalsePositiveRate = DEFAULT_FALSE_POSITIVE_RATE
+		self.indexPath = None
+		self.domainsPath = None
+		self.memoryBudget = None
+		self.parseProcesses = None
+		self.archiveDirectory = None
+		self.maxArchiveAge = DEFAULT_MAX_ARCHIVE_AGE
+		self.offline = False
+		self.connectTimeout = DEFAULT_CONNECT_TIMEOUT
+		self.readTimeout = DEFAULT_READ_TIMEOUT
+		self.downloadTimeout = DEFAULT_DOWNLOAD_TIMEOUT
+		self.retries = DEFAULT_RETRIES
+		self.breakerPath = None
+
+
+def parsePositiveInt(name: str, value: str) -> int:
+	try:
+		number = int(value)
+	except ValueError:
+		raise UsageError("{} requires a whole number".format(name))
+	if number < 1:
+		raise UsageError("{} must be at least 1".format(name))
+	return number
+
+
+def parseCount(name: str, value: str) -> int:
+	"""a whole number that may be 0"""
+	try:
+		number = int(value)
+	except ValueError:
+		raise UsageError("{} requires a whole number".format(name))
+	if number < 0:
+		raise UsageError("{} must not be negative".format(name))
+	return number
+
+
+def parseSeconds(name: str, value: str) -> float:
+	try:
+		seconds = float(value)
+	except ValueError:
+		raise UsageError("{} requires a number of seconds".format(name))
+	if not seconds > 0:
+		raise UsageError("{} must be more than 0".format(name))
+	return seconds
+
+
+def parseProcessCount(name: str, value: str) -> int:
+	"""a number of processes, or one for every core if no number is given"""
+	if len(value) == 0:
+		return os.cpu_count() or 1
+	return parsePositiveInt(name, value)
+
+
+def parseServeAddress(name: str, value: str) -> Tuple[str, int]:
+	"""[HOST:]PORT, where no host means every interface and no port means the default"""
+	(host, _, port) = value.rpartition(":")
+	if len(port) == 0:
+		return (host, DEFAULT_SERVE_PORT)
+	if not port.isdigit() or not 0 < int(port) < 65536:
+		raise UsageError("{} requires a port number, e.g. {}=8080 or {}=127.0.0.1:8080".format(name, name, name))
+	return (host, int(port))
+
+
+def parseHostsPerLine(name: str, value: str) -> int:
+	count = parsePositiveInt(name, value)
+	if count > MAX_HOSTS_PER_LINE:
+		raise UsageError("{} can be at most {}, the most Windows reads from one line".format(name, MAX_HOSTS_PER_LINE))
+	return count
+
+
+def parseDnsmasqDirective(name: str, value: str) -> str:
+	if value not in DNSMASQ_DIRECTIVES:
+		raise UsageError("{} must be one of {}".format(name, ", ".join(DNSMASQ_DIRECTIVES)))
+	return value
+
+
+def parseRate(name: str, value: str) -> float:
+	try:
+		rate = float(value)
+	except ValueError:
+		raise UsageError("{} requires a number".format(name))
+	if not 0 < rate < 1:
+		raise UsageError("{} must be more than 0 and less than 1".format(name))
+	return rate
+
+
+def parsePath(name: str, value: str) -> str:
+	if len(value) == 0:
+		raise UsageError("{} requires a path".format(name))
+	return value
+
+
+def parseName(name: str, value: str) -> str:
+	if len(value) == 0:
+		raise UsageError("{} requires a name".format(name))
+	return value
+
+
+# maps each option to the Options attribute it sets, and how to parse its value (None for flags)
+optionParsers = {
+	"--workers": ("workers", parsePositiveInt),
+	"--connections-per-host": ("connectionsPerHost", parsePositiveInt),
+	"--cache": ("cacheDirectory", parsePath),
+	"--collapse": ("collapse", None),
+	"--sort": ("sort", None),
+	"--overwrite": ("overwrite", None),
+	"--daemon": ("daemon", None),
+	"--refresh-interval": ("refreshInterval", parsePositiveInt),
+	"--serve": ("serveAddress", parseServeAddress),
+	"--hosts-per-line": ("hostsPerLine", parseHostsPerLine),
+	"--dnsmasq-directive": ("dnsmasqDirective", parseDnsmasqDirective),
+	"--stream": ("stream", None),
+	"--report": ("reportPath", parsePath),
+	"--prometheus": ("prometheusPath", parsePath),
+	"--trace-memory": ("traceMemory", None),
+	"--incremental": ("storePath", parsePath),
+	"--delta": ("deltaDirectory", parsePath),
+	"--apply-delta": ("applyDelta", None),
+	"--rpz-zone": ("rpzZone", parseName),
+	"--snapshot": ("snapshotPath", parsePath),
+	"--bloom": ("bloomPath", parsePath),
+	"--bloom-fp-rate": ("bloomFalsePositiveRate", parseRate),
+	"--index": ("indexPath", parsePath),
+	"--domains": ("domainsPath", parsePath),
+	"--memory-budget": ("memoryBudget", parsePositiveInt),
+	"--parse-processes": ("parseProcesses", parseProcessCount),
+	"--archive": ("archiveDirectory", parsePath),
+	"--max-archive-age": ("maxArchiveAge", parsePositiveInt),
+	"--offline": ("offline", None),
+	"--connect-timeout": ("connectTimeout", parseSeconds),
+	"--read-timeout": ("readTimeout", parseSeconds),
+	"--download-timeout": ("downloadTimeout", parseSeconds),
+	"--retries": ("retries", parseCount),
+	"--circuit-breaker": ("breakerPath", parsePath),
+}
+
+
+def parseOptions(args):
+	positional: List[str] = []
+	options = Options()
+	for arg in args:
+		if not arg.startswith("--"):
+			positional.append(arg)
+			continue
+		(name, _, value) = arg.partition("=")
+		if name not in optionParsers:
+			raise UsageError("unknown option: {}".format(name))
+		(attribute, parser) = optionParsers[name]
+		setattr(options, attribute, True if parser is None else parser(name, value))
+	return (positional, options)
+
+
+def checkOutputPath(filename: str, options) -> str:
+	"""with --overwrite or --delta the output is expected to be rewritten every run"""
+	if os.path.exists(filename) and not options.overwrite and options.deltaDirectory is None:
+		raise FileExistsError(filename)
+	if not isCompressionAvailable(getCompression(filename)):
+		raise UsageError("writing {} needs the zstandard package (pip install zstandard)".format(filename))
+	return filename
+
+
+def parseTarget(arg: str, options) -> Target:
+	"""parses a type=path target, e.g. unbound=blackhole.txt"""
+	(serverType, _, filename) = arg.partition("=")
+	if len(filename) == 0:
+		raise UsageError("target {} requires a path, e.g. {}=output.txt".format(arg, serverType))
+	return Target(
+		determineServerFormatter(serverType, options.rpzZone, options.hostsPerLine, options.dnsmasqDirective), checkOutputPath(filename, options)
+	)
+
+
+def parseTargets(args: List[str], options) -> List[Target]:
+	"""either type=path targets, or a server type followed by an optional filename"""
+	if not any("=" in arg for arg in args):
+		filename = checkOutputPath(args[1], options) if len(args) >= 2 else None
+		return [Target(determineServerFormatter(args[0], options.rpzZone, options.hostsPerLine, options.dnsmasqDirective), filename)]
+	if not all("=" in arg for arg in args):
+		raise UsageError("targets must all be given as type=path")
+	targets = [parseTarget(arg, options) for arg in args]
+	filenames = [os.path.abspath(target.filename) for target in targets]
+	if len(set(filenames)) != len(filenames):
+		raise UsageError("each target must be written to a different file")
+	deltaNames = [target.deltaName for target in targets]
+	if options.deltaDirectory is not None and len(set(deltaNames)) != len(deltaNames):
+		raise UsageError("with --delta, each target's file must have a different name")
+	return targets
 
 
 def parseArguments(args):
+	(args, options) = parseOptions(args)
 	if len(args) < 1:
 		print(getUsage())
 		raise UsageError("too few arguments")
-	serverFormatter = determineServerFormatter(args[0])
-	if len(args) >= 2:
-		if os.path.exists(args[1]):
-			raise FileExistsError(args[1])
-		filename = args[1]
-	else:
-		filename = None
-	return (serverFormatter, filename)
-
-
-def printError(message: str):
-	print(message, file=sys.stderr)
+	if options.memoryBudget is not None:
+		# only streaming avoids holding every line at once
+		options.stream = True
+	if options.daemon:
+		# a daemon rewrites its outputs whenever the domains change
+		options.overwrite = True
+	if options.daemon and (options.stream or options.storePath is not None or options.indexPath is not None or options.offline):
+		raise UsageError("--daemon keeps every domain in memory, so it cannot be used with --stream, --incremental, --index or --offline")
+	if options.stream and options.collapse:
+		raise UsageError("--collapse needs every domain at once, so it cannot be used with --stream")
+	if options.stream and options.sort:
+		raise UsageError("--sort needs every domain at once, so it cannot be used with --stream")
+	if options.stream and options.storePath is not None:
+		raise UsageError("--incremental keeps every domain in its store, so it cannot be used with --stream")
+	if options.stream and options.deltaDirectory is not None:
+		raise UsageError("--delta compares every domain with the previous run, so it cannot be used with --stream")
+	if options.stream and options.snapshotPath is not None:
+		raise UsageError("--snapshot sorts every domain at once, so it cannot be used with --stream")
+	if options.stream and options.bloomPath is not None:
+		raise UsageError("--bloom is sized from the number of domains, so it cannot be used with --stream")
+	if options.offline and options.archiveDirectory is None:
+		raise UsageError("--offline builds from the last known good copies, so it requires --archive")
+	if options.stream and options.archiveDirectory is not None:
+		raise UsageError("--stream can't fall back once a source has started streaming, so it cannot be used with --archive")
+	if options.stream and options.parseProcesses is not None:
+		raise UsageError("--stream parses each line as it arrives, so it cannot be used with --parse-processes")
+	if options.indexPath is not None and (options.stream or options.storePath is not None):
+		raise UsageError("--index is built from every source's domains at once, so it cannot be used with --stream or --incremental")
+	if options.applyDelta and options.deltaDirectory is None:
+		raise UsageError("--apply-delta requires --delta")
+	targets = parseTargets(args, options)
+	if options.stream and len(targets) > 1:
+		raise UsageError("--stream writes a single target, so it cannot be used with more than one")
+	if options.daemon and any(target.filename is None for target in targets):
+		raise UsageError("--daemon writes its outputs again and again, so every target needs a file")
+	if options.serveAddress is not None and any(target.filename is None for target in targets):
+		raise UsageError("--serve publishes the output files, so every target needs a file")
+	servedNames = [os.path.basename(target.filename) for target in targets if target.filename is not None]
+	if options.serveAddress is not None and len(set(servedNames)) != len(servedNames):
+		raise UsageError("--serve publishes each output by its file name, so their names must differ")
+	return (targets, options)
 
 
 def getUsage():
 	return """USAGE:
-first argument is DNS server type (REQUIRED): unbound, bind, winhosts
-second argument is output filename (OPTIONAL) """
+first argument is DNS server type (REQUIRED): unbound, bind, winhosts, rpz, dnsmasq
+second argument is output filename (OPTIONAL)
+
+or, to write several outputs from one download, any number of type=path targets:
+unbound=blackhole.txt bind=named.conf.local winhosts=hosts
+
+or, to see why domains are or aren't blocked: lookup DOMAIN... --index=FILE [--domains=FILE]
+
+OPTIONS:
+--workers=N                 download up to N sources at once (default 1)
+--connections-per-host=N    open at most N connections to any one host (default {})
+--cache=DIR                 keep downloaded sources in DIR, and only download them again when they change
+--hosts-per-line=N          list up to N domains (at most {}) on each line of the Windows HOSTS file, which makes it smaller and quicker to load
+--dnsmasq-directive=NAME    write dnsmasq entries as address=/domain/ or local=/domain/ (default {})
+--collapse                  leave out subdomains of blocked domains (unbound, bind, rpz and dnsmasq)
+--daemon                    keep running, downloading each source again when it is due and rewriting the outputs when the domains change
+--refresh-interval=MINUTES  how often the daemon downloads a source whose server doesn't say how long it stays fresh (default {})
+--serve[=[HOST:]PORT]       serve the outputs over HTTP once built, until stopped (default port {}), e.g. for other resolvers to download
+--overwrite                 replace output files that already exist, leaving them as they are if nothing changed
+--sort                      write the domains in alphabetical order, so that outputs diff and sync well from run to run
+--stream                    download, filter and write one line at a time to save memory (downloads one source at a time)
+--report=FILE               write the time, data and memory used by each source and stage to FILE as JSON
+--prometheus=FILE           write the same figures to FILE for node_exporter's textfile collector
+--trace-memory              include each stage's peak Python memory in the report (slows the run down)
+--incremental=FILE          keep every source's domains in FILE, and only apply what changed since the last run (best with --cache)
+--delta=DIR                 also write the domains added and removed since the last run to DIR, and replace the output file
+--apply-delta               apply the delta to the running server (unbound-control, rndc, or nsupdate for rpz)
+--rpz-zone=NAME             the name the RPZ zone is loaded as, used by the delta (default {})
+--snapshot=FILE             also write the blocked domains to FILE in a compact binary format, for other tools to look up
+--bloom=FILE                also write the blocked domains to FILE as a Bloom filter, for tools that only need a probable answer
+--bloom-fp-rate=RATE        how often the Bloom filter may wrongly report a domain as listed (default {})
+--index=FILE                also write which sources listed each domain to FILE, for lookup
+--domains=FILE              with lookup, also look up every domain in FILE (one per line)
+--memory-budget=MB          remove duplicates on disk using about MB of memory, for lists too big to hold (implies --stream)
+--parse-processes[=N]       parse sources in N other processes (default one per core), splitting large sources into chunks
+--archive=DIR               keep every source's last good copy in DIR, and use it when the source fails to download
+--max-archive-age=HOURS     only use a last good copy that is at most HOURS old (default {})
+--offline                   build from the last good copies in --archive only, without using the network
+--connect-timeout=SECONDS   give up connecting to a source after SECONDS (default {})
+--read-timeout=SECONDS      give up on a source that sends nothing for SECONDS (default {})
+--download-timeout=SECONDS  give up on a source still sending after SECONDS, however steadily it sends (default {})
+--retries=N                 try a source that fails N more times, waiting a little longer each time (default {})
+--circuit-breaker=FILE      skip a source for {} hours after {} failed runs in a row, remembering the failures in FILE """.format(
+		DEFAULT_CONNECTIONS_PER_HOST,
+		MAX_HOSTS_PER_LINE,
+		DNSMASQ_DIRECTIVES[0],
+		DEFAULT_REFRESH_INTERVAL,
+		DEFAULT_SERVE_PORT,
+		DEFAULT_RPZ_ZONE,
+		DEFAULT_FALSE_POSITIVE_RATE,
+		DEFAULT_MAX_ARCHIVE_AGE,
+		DEFAULT_CONNECT_TIMEOUT,
+		DEFAULT_READ_TIMEOUT,
+		DEFAULT_DOWNLOAD_TIMEOUT,
+		DEFAULT_RETRIES,
+		DEFAULT_COOLDOWN // 3600,
+		DEFAULT_FAILURE_THRESHOLD,
+	)
 
 
 def main(args: List[str]):
 	try:
-		(serverFormatter, filename) = parseArguments(args)
-		process(serverFormatter, filename)
+		if len(args) > 0 and args[0] == "lookup":
+			lookup(args[1:])
+			return
+		(targets, options) = parseArguments(args)
+		process(targets, options)
 	except Exception as e:
 		logging.getLogger(__name__).exception(e)
 		sys.exit(-1)
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from typing import Dict, List, Optional
+from contextlib import contextmanager
+
+try:
+	import resource
+except ImportError:  # not available on Windows
+	resource = None
+
+
+def getPeakRss() -> Optional[int]:
+	"""peak resident set size of this process in bytes, or None where it can't be measured"""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS reports bytes
+	return peak if sys.platform == "darwin" else peak * 1024
+
+
+def getCurrentRss() -> Optional[int]:
+	"""resident set size of this process right now in bytes, or None where it can't be measured (only Linux has /proc)"""
+	try:
+		with open("/proc/self/statm", "r") as file:
+			residentPages = int(file.read().split()[1])
+	except (OSError, ValueError, IndexError):
+		return None
+	return residentPages * os.sysconf("SC_PAGE_SIZE")
+
+
+class SourceStatistics:
+	"""filled in while a single source is downloaded and parsed"""
+
+	def __init__(self) -> None:
+		self.seconds = 0.0
+		self.bytesDownloaded = 0
+		self.linesIn = 0
+		self.linesOut = 0
+		self.notModified = False
+		self.failed = False
+		self.fromArchive = False
+		# seconds the server said the source stays fresh, if it said
+		self.freshFor: Optional[float] = None
+
+	def toDict(self) -> dict:
+		return {
+			"seconds": self.seconds,
+			"bytesDownloaded": self.bytesDownloaded,
+			"linesIn": self.linesIn,
+			"linesOut": self.linesOut,
+			"notModified": self.notModified,
+			"failed": self.failed,
+			"fromArchive": self.fromArchive,
+			"freshFor": self.freshFor,
+		}
+
+
+class StageStatistics:
+	def __init__(self, name: str) -> None:
+		self.name = name
+		self.seconds = 0.0
+		self.linesIn: Optional[int] = None
+		self.linesOut: Optional[int] = None
+		self.rssBefore: Optional[int] = None
+		self.rssAfter: Optional[int] = None
+		# the process's peak so far when the stage ended, which later stages repeat
+		self.peakRss: Optional[int] = None
+		# how much the stage raised the process's peak, which is 0 for every stage but those that set a new one
+		self.peakRssGrowth: Optional[int] = None
+		# None if another stage ran at the same time, as Python only traces one peak for the whole process
+		self.peakTracedBytes: Optional[int] = None
+		self.overlapped = False
+
+	def toDict(self) -> dict:
+		return {
+			"name": self.name,
+			"seconds": self.seconds,
+			"linesIn": self.linesIn,
+			"linesOut": self.linesOut,
+			"rssBefore": self.rssBefore,
+			"rssAfter": self.rssAfter,
+			"peakRss": self.peakRss,
+			"peakRssGrowth": self.peakRssGrowth,
+			"peakTracedBytes": self.peakTracedBytes,
+		}
+
+
+class RunReport:
+	"""records the time, data and memory used by each source and each stage of a run"""
+
+	def __init__(self, traceMemory: bool = False) -> None:
+		self._traceMemory = traceMemory
+		self._startedAt = time.time()
+		self._startedCounter = time.perf_counter()
+		self._stages: List[StageStatistics] = []
+		self._sources: Dict[str, SourceStatistics] = {}
+		self._activeStages: List[StageStatistics] = []
+		self._lock = threading.Lock()
+		if traceMemory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	@property
+	def stages(self) -> List[StageStatistics]:
+		return self._stages
+
+	@property
+	def sources(self) -> Dict[str, SourceStatistics]:
+		return self._sources
+
+	@contextmanager
+	def stage(self, name: str, linesIn: Optional[int] = None):
+		"""
+		times the body of a with block, which may set linesOut on the yielded StageStatistics
+		stages may run at the same time in different threads, e.g. one per target
+		"""
+		statistics = StageStatistics(name)
+		statistics.linesIn = linesIn
+		statistics.rssBefore = getCurrentRss()
+		peakBefore = getPeakRss()
+		with self._lock:
+			# the traced peak is only reset when no other stage is measuring it
+			if self._traceMemory and len(self._activeStages) == 0:
+				tracemalloc.reset_peak()
+			for active in self._activeStages:
+				active.overlapped = True
+			statistics.overlapped = len(self._activeStages) > 0
+			self._activeStages.append(statistics)
+		start = time.perf_counter()
+		try:
+			yield statistics
+		finally:
+			statistics.seconds = time.perf_counter() - start
+			statistics.rssAfter = getCurrentRss()
+			statistics.peakRss = getPeakRss()
+			if peakBefore is not None and statistics.peakRss is not None:
+				statistics.peakRssGrowth = statistics.peakRss - peakBefore
+			with self._lock:
+				self._activeStages.remove(statistics)
+				if self._traceMemory and not statistics.overlapped:
+					statistics.peakTracedBytes = tracemalloc.get_traced_memory()[1]
+				self._stages.append(statistics)
+
+	def addSource(self, name: str, statistics: SourceStatistics):
+		with self._lock:
+			self._sources[name] = statistics
+
+	def toDict(self) -> dict:
+		return {
+			"startedAt": self._startedAt,
+			"seconds": time.perf_counter() - self._startedCounter,
+			"peakRss": getPeakRss(),
+			"stages": [stage.toDict() for stage in self._stages],
+			"sources": {name: statistics.toDict() for (name, statistics) in self._sources.items()},
+		}
+
+	def writeJson(self, path: str):
+		writeAtomically(path, json.dumps(self.toDict(), indent="\t"))
+
+	def writePrometheus(self, path: str):
+		"""writes a file for node_exporter's textfile collector"""
+		writeAtomically(path, formatPrometheus(self.toDict()))
+
+
+def escapeLabel(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatPrometheus(report: dict) -> str:
+	metrics = [
+		("pyhosts_last_run_timestamp_seconds", "when the last run started", [("", report["startedAt"])]),
+		("pyhosts_run_duration_seconds", "how long the last run took", [("", report["seconds"])]),
+		(
+			"pyhosts_stage_duration_seconds",
+			"how long each stage of the last run took",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["seconds"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_lines_out",
+			"how many lines each stage of the last run produced",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["linesOut"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_rss_after_bytes",
+			"resident memory when each stage of the last run ended",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["rssAfter"]) for stage in report["stages"]],
+		),
+		(
+			"pyhosts_stage_peak_rss_growth_bytes",
+			"how much each stage of the last run raised the peak resident memory",
+			[('{{stage="{}"}}'.format(escapeLabel(stage["name"])), stage["peakRssGrowth"]) for stage in report["stages"]],
+		),
+	]
+	sourceMetrics = [
+		("pyhosts_source_duration_seconds", "how long each source took to download and parse", "seconds"),
+		("pyhosts_source_bytes_downloaded", "how many bytes were downloaded for each source", "bytesDownloaded"),
+		("pyhosts_source_lines", "how many domains each source contributed", "linesOut"),
+		("pyhosts_source_failed", "1 if the source could not be downloaded", "failed"),
+		("pyhosts_source_from_archive", "1 if the source's last known good copy was used instead", "fromArchive"),
+	]
+	for metric, help, key in sourceMetrics:
+		values = [('{{source="{}"}}'.format(escapeLabel(name)), float(source[key])) for (name, source) in report["sources"].items()]
+		metrics.append((metric, help, values))
+	if report["peakRss"] is not None:
+		metrics.append(("pyhosts_peak_rss_bytes", "peak resident memory of the last run", [("", report["peakRss"])]))
+	lines: List[str] = []
+	for metric, help, values in metrics:
+		lines.append("# HELP {} {}".format(metric, help))
+		lines.append("# TYPE {} gauge".format(metric))
+		for labels, value in values:
+			if value is not None:
+				lines.append("{}{} {}".format(metric, labels, value))
+	return "\n".join(lines) + "\n"
+
+
+def writeAtomically(path: str, text: str):
+	"""readers such as the textfile collector must never see a half-written file"""
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "w", encoding="utf-8") as file:
+		file.write(text)
+	os.replace(temporaryPath, path)
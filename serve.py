@@ -0,0 +1,196 @@
+import os
+import gzip
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+from console import printError
+
+
+DEFAULT_SERVE_PORT = 8080
+# outputs that are compressed already aren't compressed again
+CONTENT_TYPES = {".gz": "application/gzip", ".zst": "application/zstd"}
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class PublishedFile:
+	"""one output held in memory as it was when it was published, with a gzip copy made once rather than per request"""
+
+	def __init__(self, path: str) -> None:
+		with open(path, "rb") as file:
+			self._content = file.read()
+		self._lastModified = formatdate(os.path.getmtime(path), usegmt=True)
+		digest = hashlib.sha256(self._content).hexdigest()
+		self._etag = '"{}"'.format(digest)
+		self._contentType = CONTENT_TYPES.get(os.path.splitext(path)[1], TEXT_CONTENT_TYPE)
+		self._gzipped = None
+		self._gzipEtag = None
+		if self._contentType == TEXT_CONTENT_TYPE:
+			self._gzipped = gzip.compress(self._content, mtime=0)
+			# a different representation needs a different strong ETag
+			self._gzipEtag = '"{}-gzip"'.format(digest)
+
+	@property
+	def lastModified(self) -> str:
+		return self._lastModified
+
+	@property
+	def contentType(self) -> str:
+		return self._contentType
+
+	def getVariant(self, acceptsGzip: bool) -> Tuple[bytes, str, bool]:
+		"""the bytes to send, their ETag, and whether they are gzip encoded"""
+		if acceptsGzip and self._gzipped is not None:
+			return (self._gzipped, self._gzipEtag, True)
+		return (self._content, self._etag, False)
+
+
+class Publisher:
+	"""the outputs being served, by the name they are served as, swapped whole so a request never sees half an update"""
+
+	def __init__(self) -> None:
+		self._files: Dict[str, PublishedFile] = {}
+		self._lock = threading.Lock()
+
+	def publish(self, path: str):
+		published = PublishedFile(path)
+		with self._lock:
+			self._files[os.path.basename(path)] = published
+		printError("serving {} as /{}".format(os.path.abspath(path), os.path.basename(path)))
+
+	def find(self, name: str) -> Optional[PublishedFile]:
+		with self._lock:
+			return self._files.get(name)
+
+
+def parseQuality(parameters: str) -> float:
+	"""the q value among a coding's parameters, e.g. q=0.5, which is 1 if there is none and 0 if it can't be parsed"""
+	for parameter in parameters.split(";"):
+		(name, _, value) = parameter.partition("=")
+		if name.strip().lower() == "q":
+			try:
+				return min(max(float(value.strip()), 0.0), 1.0)
+			except ValueError:
+				return 0.0
+	return 1.0
+
+
+def acceptsGzip(header: Optional[str]) -> bool:
+	"""
+	if Accept-Encoding allows gzip, going by its q value, or by that of * when gzip isn't listed
+	gzip;q=0 refuses gzip, and no header at all is taken to mean the client wants the file as it is
+	"""
+	if header is None:
+		return False
+	qualities: Dict[str, float] = {}
+	for item in header.split(","):
+		(coding, _, parameters) = item.partition(";")
+		coding = coding.strip().lower()
+		if coding == "x-gzip":
+			coding = "gzip"
+		if len(coding) > 0:
+			qualities[coding] = max(qualities.get(coding, 0.0), parseQuality(parameters))
+	return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def matchesEtag(header: Optional[str], etag: str) -> bool:
+	"""if If-None-Match lists the ETag, weakly compared as the header requires, or is *"""
+	if header is None:
+		return False
+	candidates = [candidate.strip() for candidate in header.split(",")]
+	return "*" in candidates or etag in [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+
+
+def parseRange(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+	"""
+	the first and last byte asked for by a single range such as bytes=0-499, bytes=500- or bytes=-500
+	None if the whole file should be sent instead, as it is for several ranges or a header that can't be parsed
+	raises ValueError if the range lies outside the file
+	"""
+	if header is None or not header.startswith("bytes=") or "," in header:
+		return None
+	(first, dash, last) = header[len("bytes=") :].strip().partition("-")
+	if dash == "" or first == last == "" or not all(part == "" or part.isdigit() for part in (first, last)):
+		return None
+	if first == "":
+		suffixLength = int(last)
+		if suffixLength == 0:
+			raise ValueError(header)
+		return (max(length - suffixLength, 0), length - 1)
+	start = int(first)
+	end = min(int(last), length - 1) if last != "" else length - 1
+	if start >= length or start > end:
+		raise ValueError(header)
+	return (start, end)
+
+
+class PublishHandler(BaseHTTPRequestHandler):
+	"""serves the published outputs with strong ETags, conditional GETs, single byte ranges and gzip"""
+
+	server_version = "pyhosts"
+
+	def log_message(self, format, *args):
+		printError("{} - {}".format(self.address_string(), format % args))
+
+	def do_HEAD(self):
+		self.respond(False)
+
+	def do_GET(self):
+		self.respond(True)
+
+	def respond(self, sendBody: bool):
+		published = self.server.publisher.find(unquote(urlparse(self.path).path).lstrip("/"))
+		if published is None:
+			self.send_error(404)
+			return
+		(content, etag, gzipped) = published.getVariant(acceptsGzip(self.headers.get("Accept-Encoding")))
+		if matchesEtag(self.headers.get("If-None-Match"), etag):
+			self.send_response(304)
+			self.sendValidators(published, etag)
+			self.end_headers()
+			return
+		byteRange = None
+		ifRange = self.headers.get("If-Range")
+		if ifRange is None or ifRange == etag:
+			try:
+				byteRange = parseRange(self.headers.get("Range"), len(content))
+			except ValueError:
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */{}".format(len(content)))
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+		if byteRange is None:
+			self.send_response(200)
+			body = content
+		else:
+			(start, end) = byteRange
+			self.send_response(206)
+			self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(content)))
+			body = content[start : end + 1]
+		self.send_header("Content-Type", published.contentType)
+		if gzipped:
+			self.send_header("Content-Encoding", "gzip")
+		self.send_header("Content-Length", str(len(body)))
+		self.sendValidators(published, etag)
+		self.end_headers()
+		if sendBody:
+			self.wfile.write(body)
+
+	def sendValidators(self, published: PublishedFile, etag: str):
+		self.send_header("ETag", etag)
+		self.send_header("Last-Modified", published.lastModified)
+		self.send_header("Accept-Ranges", "bytes")
+		self.send_header("Vary", "Accept-Encoding")
+
+
+def startServer(publisher: Publisher, host: str, port: int) -> ThreadingHTTPServer:
+	"""serves the publisher's outputs from a background thread until shutdown() is called"""
+	server = ThreadingHTTPServer((host, port), PublishHandler)
+	server.daemon_threads = True
+	server.publisher = publisher
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	printError("serving on http://{}:{}/".format(host or "0.0.0.0", server.server_port))
+	return server
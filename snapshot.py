@@ -0,0 +1,183 @@
+import os
+import mmap
+import struct
+from typing import Iterable, List, Optional, Tuple
+from domains import getParentDomains
+from exceptions import SnapshotFormatError
+
+
+# magic, number of domains, domains per block, number of blocks, where the block index starts
+SNAPSHOT_HEADER = struct.Struct("<8sIIIQ")
+SNAPSHOT_MAGIC = b"PYHOSTS1"
+SNAPSHOT_OFFSET = struct.Struct("<Q")
+DEFAULT_BLOCK_SIZE = 16
+
+
+def toKey(domain: str) -> bytes:
+	"""a.example.com becomes com.example.a, so that domains under the same parent sort next to each other"""
+	return ".".join(reversed(domain.split("."))).encode("utf-8")
+
+
+def fromKey(key: bytes) -> str:
+	return ".".join(reversed(key.decode("utf-8").split(".")))
+
+
+def encodeVarint(number: int) -> bytes:
+	encoded = bytearray()
+	while number >= 0x80:
+		encoded.append((number & 0x7F) | 0x80)
+		number >>= 7
+	encoded.append(number)
+	return bytes(encoded)
+
+
+def decodeVarint(buffer, position: int) -> Tuple[int, int]:
+	"""returns the number and the position after it"""
+	number = 0
+	shift = 0
+	while True:
+		byte = buffer[position]
+		position += 1
+		number |= (byte & 0x7F) << shift
+		if byte < 0x80:
+			return (number, position)
+		shift += 7
+
+
+def commonPrefixLength(first: bytes, second: bytes) -> int:
+	length = min(len(first), len(second))
+	for index in range(length):
+		if first[index] != second[index]:
+			return index
+	return length
+
+
+def writeSnapshot(domains: Iterable[str], path: str, blockSize: int = DEFAULT_BLOCK_SIZE) -> int:
+	"""
+	writes the domains as sorted reversed-label keys, in blocks of blockSize keys followed by an index of block offsets
+	each key only stores what differs from the one before it, except the first key of a block,
+	which is stored whole so a reader can binary search the blocks
+	returns the number of domains written
+	"""
+	keys: List[bytes] = sorted(set(toKey(domain) for domain in domains))
+	blockOffsets: List[int] = []
+	temporaryPath = path + ".tmp"
+	with open(temporaryPath, "wb") as file:
+		file.write(b"\0" * SNAPSHOT_HEADER.size)
+		previous = b""
+		for index, key in enumerate(keys):
+			if index % blockSize == 0:
+				blockOffsets.append(file.tell())
+				previous = b""
+			shared = commonPrefixLength(previous, key)
+			file.write(encodeVarint(shared) + encodeVarint(len(key) - shared) + key[shared:])
+			previous = key
+		indexOffset = file.tell()
+		for offset in blockOffsets:
+			file.write(SNAPSHOT_OFFSET.pack(offset))
+		file.seek(0)
+		file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(keys), blockSize, len(blockOffsets), indexOffset))
+	os.replace(temporaryPath, path)
+	return len(keys)
+
+
+class DomainSetReader:
+	"""
+	answers lookups against a snapshot written by writeSnapshot, reading only the few blocks each lookup touches
+	the file is memory mapped, so many processes can share one copy of it through the page cache
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		with open(path, "rb") as file:
+			self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._map) < SNAPSHOT_HEADER.size:
+			self._map.close()
+			raise SnapshotFormatError(path)
+		(magic, self._count, self._blockSize, self._blockCount, self._indexOffset) = SNAPSHOT_HEADER.unpack_from(self._map, 0)
+		if magic != SNAPSHOT_MAGIC or self._indexOffset + self._blockCount * SNAPSHOT_OFFSET.size > len(self._map):
+			self._map.close()
+			raise SnapshotFormatError(path)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __len__(self) -> int:
+		return self._count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self._map.close()
+
+	def blockOffset(self, block: int) -> int:
+		return SNAPSHOT_OFFSET.unpack_from(self._map, self._indexOffset + block * SNAPSHOT_OFFSET.size)[0]
+
+	def firstKey(self, block: int) -> bytes:
+		(_, position) = decodeVarint(self._map, self.blockOffset(block))
+		(length, position) = decodeVarint(self._map, position)
+		return self._map[position : position + length]
+
+	def containsKey(self, key: bytes) -> bool:
+		if self._blockCount == 0:
+			return False
+		# the last block whose first key is not after the key
+		(low, high) = (0, self._blockCount - 1)
+		while low < high:
+			middle = (low + high + 1) // 2
+			if self.firstKey(middle) <= key:
+				low = middle
+			else:
+				high = middle - 1
+		position = self.blockOffset(low)
+		entries = min(self._blockSize, self._count - low * self._blockSize)
+		current = b""
+		for _ in range(entries):
+			(shared, position) = decodeVarint(self._map, position)
+			(length, position) = decodeVarint(self._map, position)
+			current = current[:shared] + self._map[position : position + length]
+			position += length
+			if current == key:
+				return True
+			if current > key:
+				return False
+		return False
+
+	def contains(self, domain: str) -> bool:
+		"""true if exactly this domain is in the snapshot"""
+		return self.containsKey(toKey(normalizeQuery(domain)))
+
+	def findBlockingDomain(self, domain: str) -> Optional[str]:
+		"""returns the domain itself or its nearest parent in the snapshot, or None if neither is"""
+		domain = normalizeQuery(domain)
+		if self.contains(domain):
+			return domain
+		for parent in getParentDomains(domain):
+			if self.contains(parent):
+				return parent
+		return None
+
+	def isBlocked(self, domain: str) -> bool:
+		"""true if the domain or any of its parents is in the snapshot"""
+		return self.findBlockingDomain(domain) is not None
+
+	def __iter__(self):
+		"""every domain in key order, decoding the whole file"""
+		position = SNAPSHOT_HEADER.size
+		current = b""
+		for _ in range(self._count):
+			(shared, position) = decodeVarint(self._map, position)
+			(length, position) = decodeVarint(self._map, position)
+			current = current[:shared] + self._map[position : position + length]
+			position += length
+			yield fromKey(current)
+
+
+def normalizeQuery(domain: str) -> str:
+	"""lookups may come straight from logs, e.g. Example.COM."""
+	return domain.strip().rstrip(".").lower()
@@ -1,7 +1,38 @@
+import io
+import gzip
+import time
+import random
 import requests
-from typing import List
-from main import printError
-from exceptions import DownloadError, NoSourcesConfiguredError
+import multiprocessing
+from typing import Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+from urllib.parse import urlparse
+from console import printError
+from cache import CacheEntry, createConditionalHeaders, getFreshness
+from report import SourceStatistics
+from parsers import HOSTS, HOSTS_WITH_COMMENTS, PLAIN, isAsciiCompatible, parsePayload
+from exceptions import CircuitOpenError, DownloadError, DownloadTimeoutError, NoSourcesConfiguredError
+
+
+DEFAULT_CONNECTIONS_PER_HOST = 4
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+# the longest a whole download may take, for a server that keeps sending a little at a time
+DEFAULT_DOWNLOAD_TIMEOUT = 300.0
+DEFAULT_RETRIES = 2
+# seconds, doubled for every retry
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# rate limits and server errors are worth retrying, anything else will fail the same way again
+RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# what every gzip file starts with
+GZIP_MAGIC = b"\x1f\x8b"
+# payloads bigger than this are cut into pieces of about this size, which are parsed at the same time
+PARSE_CHUNK_SIZE = 4 * 1024 * 1024
+# how much of a body is read at a time, between checks of the download timeout
+BODY_CHUNK_SIZE = 64 * 1024
 
 
 def getSources():
@@ -69,32 +100,457 @@ def normalize(line: str) -> str:
 	return line
 
 
-def downloadSource(session: requests.Session, source) -> List[str]:
-	response = session.get(source.url)
-	if response.status_code != 200:
-		printError("downloading '{}' gave HTTP status code {}", source, response.status_code)
-	return response.text.splitlines()
+class DownloadPolicy:
+	"""
+	how long to wait for a source, and how often to try it again
+	readTimeout is the longest wait for any single read from the server, and downloadTimeout for reading the whole body,
+	so a source takes at most about (retries + 1) * (connectTimeout + readTimeout + downloadTimeout) plus the backoff before it fails
+	"""
+
+	def __init__(
+		self,
+		connectTimeout: float = DEFAULT_CONNECT_TIMEOUT,
+		readTimeout: float = DEFAULT_READ_TIMEOUT,
+		retries: int = DEFAULT_RETRIES,
+		backoff: float = DEFAULT_BACKOFF,
+		downloadTimeout: float = DEFAULT_DOWNLOAD_TIMEOUT,
+	) -> None:
+		self._connectTimeout = connectTimeout
+		self._readTimeout = readTimeout
+		self._downloadTimeout = downloadTimeout
+		self._retries = retries
+		self._backoff = backoff
+
+	@property
+	def timeout(self) -> Tuple[float, float]:
+		return (self._connectTimeout, self._readTimeout)
+
+	@property
+	def downloadTimeout(self) -> float:
+		return self._downloadTimeout
+
+	@property
+	def retries(self) -> int:
+		return self._retries
+
+	def getDelay(self, attempt: int) -> float:
+		"""a random wait of up to backoff * 2^attempt seconds, so that workers retrying the same host spread out"""
+		return random.uniform(0, min(self._backoff * 2**attempt, MAX_BACKOFF))
+
+
+def downloadSource(session: requests.Session, source, headers=None, stream=False, policy=None) -> requests.Response:
+	"""
+	returns a 200 or 304 response, retrying connection errors, timeouts and retriable status codes
+	raises DownloadError for any other status code, rather than letting an error page be parsed as domains
+	unless stream is true the body has been read, within the policy's download timeout, before the response is returned
+	"""
+	policy = policy if policy is not None else DownloadPolicy()
+	for attempt in range(policy.retries + 1):
+		isLastAttempt = attempt == policy.retries
+		try:
+			response = session.get(source.url, headers=headers, stream=True, timeout=policy.timeout)
+			if response.status_code == 200 and not stream:
+				# what the content property would have stored after reading the body itself
+				response._content = BodyReader(source, response, policy.downloadTimeout).readall()
+		except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, DownloadTimeoutError) as e:
+			if isLastAttempt:
+				raise
+			printError("downloading '{}' failed ({}), trying again".format(source, type(e).__name__))
+		else:
+			if response.status_code in (200, 304):
+				return response
+			response.close()
+			if isLastAttempt or response.status_code not in RETRIABLE_STATUS_CODES:
+				raise DownloadError(source, response.status_code)
+			printError("downloading '{}' gave HTTP status code {}, trying again".format(source, response.status_code))
+		time.sleep(policy.getDelay(attempt))
+
+
+class BodyReader(io.RawIOBase):
+	"""
+	the body of a streamed response as a binary stream, unpacked from any Content-Encoding,
+	which raises DownloadTimeoutError once downloadTimeout seconds have passed since it was created,
+	something the read timeout alone never does for a server that keeps sending a little at a time
+	errors from urllib3 are raised as the requests errors that iter_content would raise
+	"""
+
+	def __init__(self, source, response: requests.Response, downloadTimeout: float) -> None:
+		self._source = source
+		self._response = response
+		self._downloadTimeout = downloadTimeout
+		self._deadline = time.monotonic() + downloadTimeout
+		# read1 returns whatever has arrived rather than waiting for a whole buffer, where urllib3 is new enough to have it
+		self._read = response.raw.read1 if hasattr(response.raw, "read1") else response.raw.read
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		if time.monotonic() > self._deadline:
+			self._response.close()
+			raise DownloadTimeoutError(self._source, self._downloadTimeout)
+		try:
+			data = self._read(len(buffer), decode_content=True)
+		except ProtocolError as e:
+			raise requests.exceptions.ChunkedEncodingError(e)
+		except DecodeError as e:
+			raise requests.exceptions.ContentDecodingError(e)
+		except ReadTimeoutError as e:
+			raise requests.ConnectionError(e)
+		buffer[: len(data)] = data
+		return len(data)
+
+	def readall(self) -> bytes:
+		return b"".join(iter(lambda: self.read(BODY_CHUNK_SIZE), b""))
+
+
+def parseSource(source, downloadedLines) -> List[str]:
+	normalizedLines = map(normalize, downloadedLines)
+	wantedLines = filter(isValid, normalizedLines)
+	return list(source.format(wantedLines))
+
+
+def readPayload(response: requests.Response) -> Tuple[bytes, Optional[str]]:
+	"""
+	the body and its encoding, unpacking a gzip file that was sent as it is (e.g. a .gz source)
+	a body is taken to be a gzip file if it starts with GZIP_MAGIC, whatever its URL or Content-Type, as streamSource does too
+	a body sent with Content-Encoding: gzip or deflate has already been unpacked by requests
+	"""
+	content = response.content
+	if content.startswith(GZIP_MAGIC):
+		return (gzip.decompress(content), "utf-8")
+	return (content, response.encoding)
+
 
+def countPayloadLines(content: bytes) -> int:
+	"""the number of lines in the payload, counted as streamSource counts them"""
+	return content.count(b"\n") + (0 if content.endswith(b"\n") or len(content) == 0 else 1)
 
-def downloadSources(sources) -> List[str]:
-	"""downloads lists of domain names from the sources, then normalizes and validates them"""
+
+def parseResponse(source, response: requests.Response, payload=None) -> List[str]:
+	"""
+	parses the raw bytes in one pass where the source's dialect allows, otherwise line by line
+	payload is what readPayload gave for the response, if it was read already
+	"""
+	(content, encoding) = payload if payload is not None else readPayload(response)
+	parsed = parsePayload(content, encoding, source.dialect, lambda lines: parseSource(source, lines))
+	if parsed is not None:
+		return parsed
+	return parseSource(source, decodeContent(content, encoding or response.apparent_encoding).splitlines())
+
+
+def decodeContent(content: bytes, encoding: Optional[str]) -> str:
+	"""what response.text gives, where an encoding of None is only passed for ASCII content"""
+	try:
+		return str(content, encoding or "utf-8", errors="replace")
+	except (LookupError, TypeError):
+		return str(content, errors="replace")
+
+
+def parseContent(source, content: bytes, encoding: Optional[str]) -> List[str]:
+	"""like parseResponse, for a payload that was sent to another process without its response"""
+	parsed = parsePayload(content, encoding, source.dialect, lambda lines: parseSource(source, lines))
+	if parsed is not None:
+		return parsed
+	return parseSource(source, decodeContent(content, encoding).splitlines())
+
+
+def parseChunk(source, content: bytes, encoding: Optional[str]) -> bytes:
+	"""runs in a worker process, and returns one line per formatted line as bytes, which pickle far faster than a list"""
+	return "".join(line + "\n" for line in parseContent(source, content, encoding)).encode("utf-8", "surrogatepass")
+
+
+def splitPayload(payload: bytes, chunkSize: int) -> List[bytes]:
+	"""cuts the payload just after a newline every chunkSize bytes or so"""
+	chunks = []
+	start = 0
+	while len(payload) - start > chunkSize:
+		end = payload.find(b"\n", start + chunkSize)
+		if end == -1:
+			break
+		chunks.append(payload[start : end + 1])
+		start = end + 1
+	chunks.append(payload[start:])
+	return chunks
+
+
+def getProcessContext():
+	"""
+	forkserver where the platform has it, otherwise spawn, as workers are started from download threads
+	and forking a process that has other threads running can deadlock the child
+	"""
+	method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+	return multiprocessing.get_context(method)
+
+
+class ParsePool:
+	"""
+	parses downloaded sources in other processes, cutting large sources into chunks so they use every core too
+	the workers import the main module again, so a script that uses it has to guard its entry point with if __name__ == "__main__"
+	"""
+
+	def __init__(self, processes: int) -> None:
+		self._processes = processes
+		self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=getProcessContext())
+
+	@property
+	def processes(self) -> int:
+		return self._processes
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self._executor.shutdown()
+
+	def parse(self, source, response: requests.Response, payload=None) -> List[str]:
+		"""like parseResponse, in the pool's processes"""
+		(content, encoding) = payload if payload is not None else readPayload(response)
+		if encoding is None and not content.isascii():
+			# guessed once for the whole payload, as each chunk might be guessed differently
+			encoding = response.apparent_encoding
+		# lines can only be found by their newline bytes in encodings that keep ASCII as it is
+		chunks = splitPayload(content, PARSE_CHUNK_SIZE) if isAsciiCompatible(encoding) else [content]
+		futures = [self._executor.submit(parseChunk, source, chunk, encoding) for chunk in chunks]
+		lines: List[str] = []
+		for future in futures:
+			lines.extend(future.result().decode("utf-8", "surrogatepass").split("\n")[:-1])
+		return lines
+
+
+def fetchSource(session: requests.Session, source, cache=None, statistics=None, parsePool=None, archive=None, policy=None) -> List[str]:
+	"""
+	downloads a single source, then normalizes and validates its lines
+	with a cache, a source that has not changed upstream (HTTP 304) reuses its cached lines without parsing
+	with an archive, the lines are kept as the source's last known good copy
+	"""
+	statistics = statistics if statistics is not None else SourceStatistics()
+	start = time.perf_counter()
+	cached = cache.load(source) if cache is not None else None
+	response = downloadSource(session, source, createConditionalHeaders(cached), policy=policy)
+	statistics.freshFor = getFreshness(response.headers)
+	response.content
+	# what came over the network once the whole body has been read, which is less than its length if it was compressed
+	statistics.bytesDownloaded = response.raw.tell()
+	if cached is not None and response.status_code == 304:
+		statistics.notModified = True
+		statistics.linesOut = len(cached.lines)
+		statistics.seconds = time.perf_counter() - start
+		if archive is not None:
+			archive.confirm(source, cached.lines)
+		return cached.lines
+	payload = readPayload(response)
+	formattedLines = parsePool.parse(source, response, payload) if parsePool is not None else parseResponse(source, response, payload)
+	# counted after unpacking, so a .gz source counts its lines rather than newline bytes in the compressed body
+	statistics.linesIn = countPayloadLines(payload[0])
+	statistics.linesOut = len(formattedLines)
+	statistics.seconds = time.perf_counter() - start
+	if cache is not None and response.status_code == 200:
+		entry = CacheEntry(response.headers.get("ETag"), response.headers.get("Last-Modified"), formattedLines)
+		if entry.isConditional():
+			cache.save(source, entry)
+	if archive is not None and response.status_code == 200:
+		archive.save(source, formattedLines)
+	return formattedLines
+
+
+def countLines(lines: Iterable[str], statistics: SourceStatistics) -> Iterator[str]:
+	for line in lines:
+		statistics.linesIn += 1
+		yield line
+
+
+def streamSource(session: requests.Session, source, cache=None, statistics=None, policy=None) -> Iterator[str]:
+	"""like fetchSource, but parses the response line by line as it arrives instead of holding all of it"""
+	statistics = statistics if statistics is not None else SourceStatistics()
+	policy = policy if policy is not None else DownloadPolicy()
+	cached = cache.load(source) if cache is not None else None
+	with downloadSource(session, source, createConditionalHeaders(cached), stream=True, policy=policy) as response:
+		if cached is not None and response.status_code == 304:
+			statistics.notModified = True
+			yield from cached.lines
+			return
+		body = io.BufferedReader(BodyReader(source, response, policy.downloadTimeout), BODY_CHUNK_SIZE)
+		# the same rule as readPayload, looking at the first bytes without taking them from the body
+		if body.peek(len(GZIP_MAGIC)).startswith(GZIP_MAGIC):
+			unpacked = io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding="utf-8", errors="replace")
+		else:
+			unpacked = io.TextIOWrapper(body, encoding=response.encoding or "utf-8", errors="replace")
+		downloadedLines = countLines((line.rstrip("\n") for line in unpacked), statistics)
+		formattedLines = source.format(filter(isValid, map(normalize, downloadedLines)))
+		if cache is None or response.status_code != 200:
+			yield from formattedLines
+		else:
+			# the cache needs this source's lines, which is still far less than every source's
+			keptLines: List[str] = []
+			for line in formattedLines:
+				keptLines.append(line)
+				yield line
+			entry = CacheEntry(response.headers.get("ETag"), response.headers.get("Last-Modified"), keptLines)
+			if entry.isConditional():
+				cache.save(source, entry)
+		statistics.bytesDownloaded = response.raw.tell()
+
+
+def createSession(sources, connectionsPerHost: int) -> requests.Session:
+	"""
+	creates a session whose connection pools are shared between worker threads
+	sources on the same host (e.g. v.firebog.net) reuse the same keep-alive pool
+	pool_block caps the number of simultaneous connections to any one host
+	"""
+	hostCount = len(set(urlparse(source.url).netloc for source in sources))
+	adapter = HTTPAdapter(pool_connections=max(hostCount, 1), pool_maxsize=connectionsPerHost, pool_block=True)
+	session = requests.Session()
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+
+def loadFromArchive(source, archive, statistics: SourceStatistics, ignoreAge: bool = False) -> Optional[List[str]]:
+	"""the source's last known good lines, or None if there are none young enough"""
+	lines = archive.load(source, ignoreAge)
+	age = archive.getAge(source)
+	if lines is None:
+		if age is None:
+			printError("no last known good copy of '{}'".format(source))
+		else:
+			printError("last known good copy of '{}' is {:.1f} hours old, too old to use".format(source, age / 3600))
+		return None
+	statistics.fromArchive = True
+	statistics.linesOut = len(lines)
+	printError("using last known good copy of '{}' from {:.1f} hours ago".format(source, age / 3600))
+	return lines
+
+
+def loadArchivedSources(sources, archive, report=None) -> Iterator[Tuple[object, Optional[List[str]], SourceStatistics]]:
+	"""like fetchSources, but takes every source from its last known good copy, however old, without using the network"""
 	if len(sources) == 0:
 		raise NoSourcesConfiguredError()
+	printError("loading {} {} from {}".format(len(sources), "source" if len(sources) == 1 else "sources", archive.directory))
+	for source in sources:
+		statistics = SourceStatistics()
+		if report is not None:
+			report.addSource(source.name, statistics)
+		lines = loadFromArchive(source, archive, statistics, ignoreAge=True)
+		statistics.failed = lines is None
+		if lines is not None:
+			printError(createSourceDownloadSummary(source, len(lines)))
+		yield (source, lines, statistics)
+
+
+def fetchSources(
+	sources,
+	workers: int = 1,
+	connectionsPerHost: int = DEFAULT_CONNECTIONS_PER_HOST,
+	cache=None,
+	report=None,
+	parsePool=None,
+	archive=None,
+	policy=None,
+	breaker=None,
+) -> Iterator[Tuple[object, Optional[List[str]], SourceStatistics]]:
+	"""
+	yields (source, lines, statistics) for every source in source order, with lines None if the download failed
+	up to 'workers' sources are downloaded at once, and with a ParsePool parsed in other processes
+	with an archive, a source that fails falls back to its last known good copy, if that is young enough
+	with a CircuitBreaker, a source that keeps failing is skipped for a while
+	"""
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
+	with createSession(sources, connectionsPerHost) as session:
+		printError("begin downloading from {} {}".format(len(sources), "source" if len(sources) == 1 else "sources"))
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			allStatistics = [SourceStatistics() for _ in sources]
+			futures = [
+				None
+				if breaker is not None and breaker.getOpenUntil(source) is not None
+				else executor.submit(fetchSource, session, source, cache, statistics, parsePool, archive, policy)
+				for (source, statistics) in zip(sources, allStatistics)
+			]
+			for source, future, statistics in zip(sources, futures, allStatistics):
+				if report is not None:
+					report.addSource(source.name, statistics)
+				try:
+					if future is None:
+						breaker.check(source)
+					formattedLines = future.result()
+				except Exception as e:
+					statistics.failed = True
+					printError("download failed for '{}' - '{}'".format(source, e))
+					if breaker is not None and future is not None:
+						breaker.recordFailure(source)
+					formattedLines = loadFromArchive(source, archive, statistics) if archive is not None else None
+					if formattedLines is not None:
+						printError(createSourceDownloadSummary(source, len(formattedLines)))
+					yield (source, formattedLines, statistics)
+					continue
+				if breaker is not None:
+					breaker.recordSuccess(source)
+				printError(createSourceDownloadSummary(source, len(formattedLines)))
+				yield (source, formattedLines, statistics)
+	if breaker is not None:
+		breaker.save()
+
+
+def downloadSources(
+	sources,
+	workers: int = 1,
+	connectionsPerHost: int = DEFAULT_CONNECTIONS_PER_HOST,
+	cache=None,
+	report=None,
+	parsePool=None,
+	archive=None,
+	policy=None,
+	breaker=None,
+) -> List[str]:
+	"""
+	downloads lists of domain names from the sources, then normalizes and validates them
+	results and summaries are always in source order, however many workers are used
+	"""
 	lines: List[str] = []
+	for _, formattedLines, _ in fetchSources(sources, workers, connectionsPerHost, cache, report, parsePool, archive, policy, breaker):
+		if formattedLines is not None:
+			lines.extend(formattedLines)
+	return lines
+
+
+def streamSources(sources, cache=None, report=None, policy=None, breaker=None) -> Iterator[str]:
+	"""
+	yields the lines of every source in turn, downloading them one at a time
+	each source's time includes the work done on its lines further down the stream
+	"""
+	if len(sources) == 0:
+		raise NoSourcesConfiguredError()
 	with requests.Session() as session:
 		printError("begin downloading from {} {}".format(len(sources), "source" if len(sources) == 1 else "sources"))
 		for source in sources:
+			statistics = SourceStatistics()
+			if report is not None:
+				report.addSource(source.name, statistics)
+			start = time.perf_counter()
 			try:
-				downloadedLines = downloadSource(session, source)
+				if breaker is not None:
+					breaker.check(source)
+				for line in streamSource(session, source, cache, statistics, policy):
+					statistics.linesOut += 1
+					yield line
+			except CircuitOpenError as e:
+				statistics.failed = True
+				printError("download failed for '{}' - '{}'".format(source, e))
+				continue
 			except Exception as e:
+				statistics.failed = True
 				printError("download failed for '{}' - '{}'".format(source, e))
+				if breaker is not None:
+					breaker.recordFailure(source)
 				continue
-			normalizedLines = map(normalize, downloadedLines)
-			wantedLines = filter(isValid, normalizedLines)
-			formattedLines = list(source.format(wantedLines))
-			lines.extend(formattedLines)
-			printError(createSourceDownloadSummary(source, len(formattedLines)))
-	return lines
+			finally:
+				statistics.seconds = time.perf_counter() - start
+			if breaker is not None:
+				breaker.recordSuccess(source)
+			printError(createSourceDownloadSummary(source, statistics.linesOut))
+	if breaker is not None:
+		breaker.save()
 
 
 def createSourceDownloadSummary(source, count) -> str:
@@ -109,15 +565,26 @@ def sourceToString(source) -> str:
 
 
 class BaseSource:
+	# plain sources don't change their lines in format
+	_dialect = PLAIN
+
 	@property
 	def name(self) -> str:
 		return self._name
 
+	@property
+	def dialect(self):
+		"""
+		how parsers.parsePayload should read this source, or None to always use normalize, isValid and format
+		a source that overrides format must set a dialect that does exactly the same, or None
+		"""
+		return self._dialect
+
 	@property
 	def url(self) -> str:
 		return self._url
 
-	def format(self, lines: List[str]) -> List[str]:
+	def format(self, lines: Iterable[str]) -> Iterable[str]:
 		return lines
 
 	def __str__(self) -> str:
@@ -125,20 +592,20 @@ class BaseSource:
 
 
 class MVPS(BaseSource):
+	_dialect = HOSTS_WITH_COMMENTS
+
 	def __init__(self) -> None:
 		self._name = "MVPS"
 		self._url = "http://winhelp2002.mvps.org/hosts.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			if line.__contains__("localhost"):
 				continue
 			line = str.replace(line, "0.0.0.0 ", "")
 			line = line.partition("#")[0]  # removes trailing comment if present
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class FirebogAdGuardDNS(BaseSource):
@@ -154,17 +621,18 @@ class FirebogPrigentAds(BaseSource):
 
 
 class FirebogPrigentCrypto(BaseSource):
+	# removes 0.0.0.0 without the space, which no dialect does
+	_dialect = None
+
 	def __init__(self) -> None:
 		self._name = "Firebog Prigent Crypto"
 		self._url = "https://v.firebog.net/hosts/Prigent-Crypto.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			line = str.replace(line, "0.0.0.0", "")
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class FirebogPrigentMalware(BaseSource):
@@ -198,17 +666,17 @@ class OSIntDigitalSide(BaseSource):
 
 
 class PolishFiltersTeamKADHosts(BaseSource):
+	_dialect = HOSTS
+
 	def __init__(self) -> None:
 		self._name = "Polish Filters Team KAD Hosts"
 		self._url = "https://raw.githubusercontent.com/PolishFiltersTeam/KADhosts/master/KADhosts.txt"
 
 	@classmethod
-	def format(self, lines: List[str]) -> List[str]:
-		formatted = []
+	def format(self, lines: Iterable[str]) -> Iterator[str]:
 		for line in lines:
 			line = str.replace(line, "0.0.0.0 ", "")
-			formatted.append(line)
-		return formatted
+			yield line
 
 
 class PhishingArmyBlocklistExtended(BaseSource):
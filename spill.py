@@ -0,0 +1,134 @@
+import os
+import heapq
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+
+
+# roughly what a str and the list slot and tuple holding it cost on top of its characters, in bytes
+ENTRY_OVERHEAD = 120
+# how many runs are merged at once, to stay well below the limit on open files
+MERGE_WIDTH = 64
+
+
+def writeRun(directory: str, entries: Iterable[Tuple[str, int]], runNumber: int) -> str:
+	"""writes (domain, position) entries in the order given, one 'position<tab>domain' per line"""
+	path = os.path.join(directory, "run{}.txt".format(runNumber))
+	with open(path, "w", encoding="utf-8", newline="\n") as file:
+		for domain, position in entries:
+			file.write("{}\t{}\n".format(position, domain))
+	return path
+
+
+def readRun(path: str) -> Iterator[Tuple[str, int]]:
+	with open(path, "r", encoding="utf-8", newline="\n") as file:
+		for line in file:
+			(position, _, domain) = line[:-1].partition("\t")
+			yield (domain, int(position))
+
+
+def byPosition(entry: Tuple[str, int]) -> int:
+	return entry[1]
+
+
+class ExternalDeduplicator:
+	"""
+	removes duplicates like removeDupes, keeping the first of each domain in the original order,
+	while holding no more than about memoryBudget bytes of domains at once
+
+	1. the lines are cut into runs that fit the budget, each sorted by domain and written to a temporary file
+	2. the runs are merged, keeping only the earliest position of each domain, into runs sorted by position
+	3. those runs are merged by position, which gives back the original order
+	"""
+
+	def __init__(self, memoryBudget: int, directory: Optional[str] = None) -> None:
+		self._memoryBudget = memoryBudget
+		self._directory = directory
+		self._totalCount = 0
+		self._uniqueCount = 0
+		self._runCount = 0
+
+	@property
+	def totalCount(self) -> int:
+		return self._totalCount
+
+	@property
+	def uniqueCount(self) -> int:
+		return self._uniqueCount
+
+	@property
+	def runCount(self) -> int:
+		"""how many temporary files were written, 0 if everything fit in the budget"""
+		return self._runCount
+
+	def readChunks(self, entries: Iterator[Tuple[str, int]]) -> Iterator[List[Tuple[str, int]]]:
+		"""
+		groups entries into lists of half the memory budget,
+		as the next list is filled while the previous one is still being written out
+		"""
+		chunk: List[Tuple[str, int]] = []
+		chunkSize = 0
+		for entry in entries:
+			chunk.append(entry)
+			chunkSize += ENTRY_OVERHEAD + len(entry[0])
+			if chunkSize >= self._memoryBudget // 2:
+				yield chunk
+				chunk = []
+				chunkSize = 0
+		if len(chunk) > 0:
+			yield chunk
+
+	def spill(self, directory: str, chunk: List[Tuple[str, int]], key=None) -> str:
+		chunk.sort(key=key)
+		self._runCount += 1
+		return writeRun(directory, chunk, self._runCount)
+
+	def mergeRuns(self, directory: str, paths: List[str], key=None) -> Iterator[Tuple[str, int]]:
+		"""merges the runs in passes of MERGE_WIDTH until one pass can merge what is left"""
+		while len(paths) > MERGE_WIDTH:
+			mergedPaths = []
+			for start in range(0, len(paths), MERGE_WIDTH):
+				group = paths[start : start + MERGE_WIDTH]
+				self._runCount += 1
+				mergedPaths.append(writeRun(directory, heapq.merge(*[readRun(path) for path in group], key=key), self._runCount))
+				for path in group:
+					os.remove(path)
+			paths = mergedPaths
+		return heapq.merge(*[readRun(path) for path in paths], key=key)
+
+	def keepFirstOfEach(self, entries: Iterator[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+		"""the entries are sorted by domain then position, so the first of each domain is its earliest"""
+		previous = None
+		for domain, position in entries:
+			if domain != previous:
+				self._uniqueCount += 1
+				previous = domain
+				yield (domain, position)
+
+	def countLines(self, lines: Iterable[str]) -> Iterator[Tuple[str, int]]:
+		for line in lines:
+			self._totalCount += 1
+			yield (line, self._totalCount)
+
+	def deduplicate(self, lines: Iterable[str]) -> Iterator[str]:
+		with tempfile.TemporaryDirectory(prefix="pyhosts-", dir=self._directory) as directory:
+			sortedRuns: List[str] = []
+			pending = None
+			for chunk in self.readChunks(self.countLines(lines)):
+				if pending is not None:
+					sortedRuns.append(self.spill(directory, pending))
+				pending = chunk
+			if pending is None:
+				return
+			if len(sortedRuns) == 0:
+				# everything fit in the budget, so there is nothing to spill
+				uniqueLines = OrderedDict.fromkeys(domain for (domain, _) in pending)
+				self._uniqueCount = len(uniqueLines)
+				yield from uniqueLines
+				return
+			sortedRuns.append(self.spill(directory, pending))
+			pending = None
+			merged = self.mergeRuns(directory, sortedRuns)
+			positionRuns = [self.spill(directory, chunk, byPosition) for chunk in self.readChunks(self.keepFirstOfEach(merged))]
+			for domain, _ in self.mergeRuns(directory, positionRuns, byPosition):
+				yield domain
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+
+class DomainStore:
+	"""
+	keeps every source's domains between runs in an SQLite database, with how many sources list each domain
+	a changed source only adds and removes the domains that differ from last time, so the merged set
+	and the whitelist result are updated in time proportional to the change rather than to every domain
+	domains keep the order in which they were first listed, like removeDupes
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		self._connection = sqlite3.connect(path)
+		self._connection.executescript(
+			"""
+			CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY AUTOINCREMENT, domain TEXT NOT NULL UNIQUE, refs INTEGER NOT NULL, rule TEXT);
+			CREATE INDEX IF NOT EXISTS whitelistedDomains ON domains (rule) WHERE rule IS NOT NULL;
+			CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS sourceDomains (source TEXT NOT NULL, domain TEXT NOT NULL, PRIMARY KEY (source, domain)) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS whitelist (position INTEGER PRIMARY KEY, rule TEXT NOT NULL);
+			"""
+		)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exceptionType, *args):
+		"""keeps the changes only if the whole run succeeded"""
+		if exceptionType is None:
+			self._connection.commit()
+		else:
+			self._connection.rollback()
+		self._connection.close()
+
+	def getSourceKeys(self) -> List[str]:
+		return [row[0] for row in self._connection.execute("SELECT source FROM sources")]
+
+	def updateSource(self, key: str, lines: List[str], findRule: Callable[[str], Optional[str]]) -> Tuple[int, int]:
+		"""replaces what the source listed last time with lines, returning how many domains it added and removed"""
+		stored = set(row[0] for row in self._connection.execute("SELECT domain FROM sourceDomains WHERE source = ?", (key,)))
+		listed = OrderedDict.fromkeys(lines)
+		added = [domain for domain in listed if domain not in stored]
+		removed = [domain for domain in stored if domain not in listed]
+		cursor = self._connection.cursor()
+		if len(listed) > 0:
+			cursor.execute("INSERT OR IGNORE INTO sources (source) VALUES (?)", (key,))
+		else:
+			cursor.execute("DELETE FROM sources WHERE source = ?", (key,))
+		cursor.executemany("INSERT INTO sourceDomains (source, domain) VALUES (?, ?)", ((key, domain) for domain in added))
+		cursor.executemany(
+			"INSERT INTO domains (domain, refs, rule) VALUES (?, 1, ?) ON CONFLICT (domain) DO UPDATE SET refs = refs + 1",
+			((domain, findRule(domain)) for domain in added),
+		)
+		cursor.executemany("DELETE FROM sourceDomains WHERE source = ? AND domain = ?", ((key, domain) for domain in removed))
+		cursor.executemany("UPDATE domains SET refs = refs - 1 WHERE domain = ?", ((domain,) for domain in removed))
+		cursor.executemany("DELETE FROM domains WHERE domain = ? AND refs <= 0", ((domain,) for domain in removed))
+		return (len(added), len(removed))
+
+	def removeSource(self, key: str) -> int:
+		"""forgets a source that is no longer configured, returning how many domains it removed"""
+		return self.updateSource(key, [], lambda domain: None)[1]
+
+	def updateWhitelist(self, whitelist: List[str], findRule: Callable[[str], Optional[str]]) -> bool:
+		"""
+		checks every stored domain against the whitelist again, but only if it changed since the last run
+		returns true if it changed
+		"""
+		stored = [row[0] for row in self._connection.execute("SELECT rule FROM whitelist ORDER BY position")]
+		if stored == whitelist:
+			return False
+		cursor = self._connection.cursor()
+		cursor.execute("DELETE FROM whitelist")
+		cursor.executemany("INSERT INTO whitelist (position, rule) VALUES (?, ?)", enumerate(whitelist))
+		rules = [(findRule(domain), id) for (id, domain) in self._connection.execute("SELECT id, domain FROM domains")]
+		cursor.executemany("UPDATE domains SET rule = ? WHERE id = ?", rules)
+		return True
+
+	def countDomains(self) -> int:
+		return self._connection.execute("SELECT COUNT(*) FROM domains").fetchone()[0]
+
+	def countWhitelisted(self) -> Dict[str, int]:
+		"""how many domains each whitelist rule saves"""
+		return dict(self._connection.execute("SELECT rule, COUNT(*) FROM domains WHERE rule IS NOT NULL GROUP BY rule"))
+
+	def getBlockedDomains(self) -> Iterator[str]:
+		"""every domain listed by a source and not whitelisted, in the order they were first listed"""
+		for row in self._connection.execute("SELECT domain FROM domains WHERE rule IS NULL ORDER BY id"):
+			yield row[0]
+
+
+class SourceIndex:
+	"""
+	which sources listed each domain in the run that built it, and the whitelist that run used
+	lookups are batched, so thousands of domains and their parents take a handful of queries
+	"""
+
+	# how many names go in one "IN (...)" query, below SQLite's limit on parameters
+	BATCH_SIZE = 500
+
+	def __init__(self, path: str) -> None:
+		if not os.path.exists(path):
+			raise FileNotFoundError(path)
+		self._path = path
+		self._connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(path))), uri=True)
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self._connection.close()
+
+	def getWhitelist(self) -> List[str]:
+		return [row[0] for row in self._connection.execute("SELECT rule FROM whitelist ORDER BY position")]
+
+	def findSources(self, domains: Iterable[str]) -> Dict[str, List[str]]:
+		"""maps each of the domains that was listed to the names of the sources that listed it, in source order"""
+		domains = list(set(domains))
+		found: Dict[str, List[str]] = {}
+		for start in range(0, len(domains), SourceIndex.BATCH_SIZE):
+			batch = domains[start : start + SourceIndex.BATCH_SIZE]
+			query = (
+				"SELECT listings.domain, sources.name FROM listings JOIN sources ON sources.id = listings.sourceId"
+				" WHERE listings.domain IN ({}) ORDER BY listings.sourceId".format(",".join("?" * len(batch)))
+			)
+			for domain, name in self._connection.execute(query, batch):
+				found.setdefault(domain, []).append(name)
+		return found
+
+
+def writeSourceIndex(path: str, listings: List[Tuple[str, List[str]]], whitelist: List[str]):
+	"""builds the index for (source name, lines) pairs beside the old one, then replaces it in one go"""
+	temporaryPath = path + ".tmp"
+	if os.path.exists(temporaryPath):
+		os.remove(temporaryPath)
+	connection = sqlite3.connect(temporaryPath)
+	try:
+		connection.executescript(
+			"""
+			CREATE TABLE sources (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+			CREATE TABLE listings (domain TEXT NOT NULL, sourceId INTEGER NOT NULL, PRIMARY KEY (domain, sourceId)) WITHOUT ROWID;
+			CREATE TABLE whitelist (position INTEGER PRIMARY KEY, rule TEXT NOT NULL);
+			"""
+		)
+		for sourceId, (name, lines) in enumerate(listings):
+			connection.execute("INSERT INTO sources (id, name) VALUES (?, ?)", (sourceId, name))
+			connection.executemany("INSERT OR IGNORE INTO listings (domain, sourceId) VALUES (?, ?)", ((line, sourceId) for line in lines))
+		connection.executemany("INSERT INTO whitelist (position, rule) VALUES (?, ?)", enumerate(whitelist))
+		connection.commit()
+	finally:
+		connection.close()
+	os.replace(temporaryPath, path)
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from typing import List, Optional
+from delta import DeltaWriter
+from exceptions import ControlCommandError
+from formatters import UnboundFormatter, WindowsHostsFileFormatter
+
+
+class RecordingRunner:
+	"""stands in for ControlRunner, remembering every command rather than running it"""
+
+	def __init__(self, failure: Optional[str] = None) -> None:
+		self.calls = []
+		self._failure = failure
+
+	def run(self, command: List[str], input: Optional[str]):
+		self.calls.append((command, input))
+		if self._failure is not None:
+			raise ControlCommandError(command, self._failure)
+
+
+class DeltaWriterTests(unittest.TestCase):
+	def setUp(self):
+		self._temporaryDirectory = tempfile.TemporaryDirectory()
+		self.directory = self._temporaryDirectory.name
+
+	def tearDown(self):
+		self._temporaryDirectory.cleanup()
+
+	def read(self, filename: str) -> str:
+		with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as file:
+			return file.read()
+
+	def testFirstRunOnlyRemembersDomains(self):
+		runner = RecordingRunner()
+		delta = DeltaWriter(self.directory, runner).write("blackhole.conf", UnboundFormatter(), ["a.com", "b.com"])
+		self.assertTrue(delta.isEmpty())
+		self.assertEqual(runner.calls, [])
+		self.assertEqual(self.read("blackhole.conf.add"), "")
+		self.assertEqual(self.read("blackhole.conf.remove"), "")
+		self.assertEqual(self.read("blackhole.conf.domains"), "a.com\nb.com\n")
+
+	def testAdditionsAndRemovalsAreApplied(self):
+		runner = RecordingRunner()
+		writer = DeltaWriter(self.directory, runner)
+		writer.write("blackhole.conf", UnboundFormatter(), ["a.com", "b.com"])
+		delta = writer.write("blackhole.conf", UnboundFormatter(), ["b.com", "c.com"])
+		self.assertEqual(delta.added, ["c.com"])
+		self.assertEqual(delta.removed, ["a.com"])
+		self.assertEqual(
+			runner.calls,
+			[
+				(["unbound-control", "local_zones_remove"], "a.com.\n"),
+				(["unbound-control", "local_zones"], "c.com. always_nxdomain\n"),
+			],
+		)
+		self.assertEqual(self.read("blackhole.conf.add"), "c.com. always_nxdomain\n")
+		self.assertEqual(self.read("blackhole.conf.remove"), "a.com.\n")
+		self.assertEqual(self.read("blackhole.conf.domains"), "b.com\nc.com\n")
+
+	def testUnchangedDomainsRunNothing(self):
+		runner = RecordingRunner()
+		writer = DeltaWriter(self.directory, runner)
+		writer.write("blackhole.conf", UnboundFormatter(), ["a.com"])
+		self.assertTrue(writer.write("blackhole.conf", UnboundFormatter(), ["a.com"]).isEmpty())
+		self.assertEqual(runner.calls, [])
+
+	def testFailedCommandIsRetriedWithTheSameDelta(self):
+		DeltaWriter(self.directory).write("blackhole.conf", UnboundFormatter(), ["a.com"])
+		failing = RecordingRunner("connection refused")
+		with self.assertRaises(ControlCommandError):
+			DeltaWriter(self.directory, failing).write("blackhole.conf", UnboundFormatter(), ["a.com", "b.com"])
+		self.assertEqual(self.read("blackhole.conf.domains"), "a.com\n")
+		runner = RecordingRunner()
+		delta = DeltaWriter(self.directory, runner).write("blackhole.conf", UnboundFormatter(), ["a.com", "b.com"])
+		self.assertEqual(delta.added, ["b.com"])
+		self.assertEqual(runner.calls, failing.calls)
+		self.assertEqual(self.read("blackhole.conf.domains"), "a.com\nb.com\n")
+
+	def testServerWithoutDeltaIsSkipped(self):
+		runner = RecordingRunner()
+		self.assertIsNone(DeltaWriter(self.directory, runner).write("hosts", WindowsHostsFileFormatter(), ["a.com"]))
+		self.assertEqual(runner.calls, [])
+		self.assertFalse(os.path.exists(os.path.join(self.directory, "hosts.domains")))
+
+
+if __name__ == "__main__":
+	unittest.main()